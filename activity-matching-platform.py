@@ -1,7 +1,11 @@
 import streamlit as st
 import pandas as pd
 import datetime
+import os
 import random
+import uuid
+from joinzy_core import BookingEngine
+from joinzy_index import DatetimeIndex, select_page
 
 # Set page configuration
 st.set_page_config(
@@ -10,16 +14,10 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize session state variables
-if 'logged_in' not in st.session_state:
-    st.session_state['logged_in'] = False
-if 'current_user' not in st.session_state:
-    st.session_state['current_user'] = None
-if 'users' not in st.session_state:
-    st.session_state['users'] = []
-if 'activities' not in st.session_state:
+# Demo data loaded into a fresh database
+def seed_storage(storage):
     # Sample activities data
-    st.session_state['activities'] = [
+    activities = [
         {
             "id": 1,
             "name": "Football Match",
@@ -65,20 +63,80 @@ if 'activities' not in st.session_state:
             "vendor": "Dice & Drinks"
         },
     ]
+    storage.seed(activities=activities)
+
+# Shared engine (storage and pricing rules), opened once per server process
+@st.cache_resource
+def get_engine():
+    return BookingEngine.open(os.environ.get('ACTIVITY_MATCHER_DB', 'activity_matcher.db'), seed=seed_storage)
+
+def get_storage():
+    return get_engine().storage
+
+# Initialize session state variables
+if 'logged_in' not in st.session_state:
+    st.session_state['logged_in'] = False
+if 'current_user' not in st.session_state:
+    st.session_state['current_user'] = None
+if 'users' not in st.session_state:
+    st.session_state['users'] = get_storage().list_users()
+if 'activities' not in st.session_state:
+    st.session_state['activities'] = get_storage().list_activities()
+if 'activity_index' not in st.session_state:
+    st.session_state['activity_index'] = DatetimeIndex(st.session_state['activities'])
 if 'bookings' not in st.session_state:
-    st.session_state['bookings'] = []
-if 'coupons' not in st.session_state:
-    st.session_state['coupons'] = {
-        "NEWUSER": 0.15,  # 15% off
-        "WEEKEND": 0.10,  # 10% off
-        "MEMBER2024": 0.20  # 20% off
+    st.session_state['bookings'] = get_storage().list_bookings()
+if 'data_version' not in st.session_state:
+    # Views cached from this session's data are keyed on (session key, counter)
+    st.session_state['session_key'] = uuid.uuid4().hex
+    st.session_state['data_version'] = 0
+
+# Function to get the version of this session's data for cache keys
+def data_version():
+    return st.session_state['session_key'], st.session_state['data_version']
+
+# Function to invalidate cached views after this session's data changed
+def bump_data_version():
+    st.session_state['data_version'] += 1
+
+# Activity types, vendors, each vendor's activities and booking counts per
+# activity, cached until the session's data changes
+@st.cache_data(max_entries=256)
+def activity_summary(version, _activities, _bookings):
+    activities_by_vendor = {}
+    for activity in _activities:
+        activities_by_vendor.setdefault(activity['vendor'], []).append(activity)
+    booking_counts = {}
+    for booking in _bookings:
+        booking_counts[booking['activity_id']] = booking_counts.get(booking['activity_id'], 0) + 1
+    return {
+        "types": list(set(activity['type'] for activity in _activities)),
+        "vendors": list(activities_by_vendor),
+        "activities_by_vendor": activities_by_vendor,
+        "booking_counts": booking_counts
     }
 
+# Booking table for one activity, cached until the session's data changes
+@st.cache_data(max_entries=256)
+def booking_table(version, activity_id, _bookings):
+    activity_bookings = [b for b in _bookings if b['activity_id'] == activity_id]
+    booking_data = []
+    users = get_storage().get_users(b['user_id'] for b in activity_bookings)
+    for booking in activity_bookings:
+        user = users.get(booking['user_id'], {"name": "Unknown", "phone": "Unknown"})
+        booking_data.append({
+            "Booking ID": booking['id'],
+            "User Name": user['name'],
+            "Phone": user['phone'],
+            "Booking Date": booking['booking_time'].strftime('%b %d, %Y'),
+            "Amount Paid": f"${booking['final_cost']:.2f}"
+        })
+    return pd.DataFrame(booking_data)
+
 # Function to handle login
 def login(username, password):
-    # For demo, simple login check
-    user = next((user for user in st.session_state['users'] if user['username'] == username), None)
-    if user and user['password'] == password:
+    user = get_engine().login(username, password)
+    if user:
         st.session_state['logged_in'] = True
         st.session_state['current_user'] = user
         return True
@@ -86,45 +144,52 @@ def login(username, password):
 
 # Function to handle registration
 def register_user(user_data):
-    # Check if username already exists
-    if any(user['username'] == user_data['username'] for user in st.session_state['users']):
+    if not get_engine().register_user(user_data):
         return False
     st.session_state['users'].append(user_data)
+    bump_data_version()
     return True
 
 # Function to book an activity
 def book_activity(activity_id, user_id, coupon_code=None):
-    activity = next((act for act in st.session_state['activities'] if act['id'] == activity_id), None)
-    if not activity or activity['available_slots'] <= activity['booked_slots']:
-        return False, "Activity not found or fully booked."
+    success, result = get_engine().book_activity(activity_id, user_id, coupon_code)
+    if not success:
+        return False, result
     
-    cost = activity['cost']
-    discount = 0
-    
-    if coupon_code and coupon_code in st.session_state['coupons']:
-        discount = cost * st.session_state['coupons'][coupon_code]
-        cost -= discount
-    
-    booking = {
-        "id": len(st.session_state['bookings']) + 1,
-        "activity_id": activity_id,
-        "user_id": user_id,
-        "booking_time": datetime.datetime.now(),
-        "original_cost": activity['cost'],
-        "discount": discount,
-        "final_cost": cost,
-        "coupon_applied": coupon_code if coupon_code else "None"
-    }
-    
-    st.session_state['bookings'].append(booking)
+    st.session_state['bookings'].append(result)
     
     # Update booked slots
     for act in st.session_state['activities']:
         if act['id'] == activity_id:
             act['booked_slots'] += 1
             break
+    bump_data_version()
+    
+    return True, result
+
+# Function to cancel a booking; the freed slot goes to the next user on the
+# activity's waitlist, if any
+def cancel_booking(booking_id, user_id):
+    success, promoted = get_engine().cancel_booking(booking_id, user_id)
+    if not success:
+        return False, promoted
     
-    return True, booking
+    booking = next(b for b in st.session_state['bookings'] if b['id'] == booking_id)
+    st.session_state['bookings'].remove(booking)
+    if promoted:
+        st.session_state['bookings'].append(promoted)
+    else:
+        for act in st.session_state['activities']:
+            if act['id'] == booking['activity_id']:
+                act['booked_slots'] -= 1
+                break
+    bump_data_version()
+    
+    return True, "Your booking has been cancelled."
+
+# Function to wait for a fully booked activity
+def join_waitlist(activity_id, user_id, coupon_code=None):
+    return get_engine().join_waitlist(activity_id, user_id, coupon_code)
 
 # Main app layout
 def main():
@@ -226,7 +291,7 @@ def main():
                     st.error("Please fill in all required fields!")
                 else:
                     user_data = {
-                        "id": len(st.session_state['users']) + 1,
+                        "id": get_engine().next_id('users'),
                         "name": name,
                         "age": age,
                         "phone": phone,
@@ -280,39 +345,60 @@ def main():
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            activity_type = st.selectbox("Activity Type", ["All"] + list(set(act['type'] for act in st.session_state['activities'])))
+            summary = activity_summary(data_version(), st.session_state['activities'], st.session_state['bookings'])
+            activity_type = st.selectbox("Activity Type", ["All"] + summary['types'])
         with col2:
             time_filter = st.selectbox("Time Frame", ["All", "Today", "This Week", "This Month"])
         with col3:
             sort_by = st.selectbox("Sort By", ["Date", "Cost: Low to High", "Cost: High to Low", "Availability"])
         
-        # Filter activities
-        filtered_activities = st.session_state['activities']
-        if activity_type != "All":
-            filtered_activities = [act for act in filtered_activities if act['type'] == activity_type]
-        
+        # Filter activities with a range query on the date index; results come back sorted by date
+        start, end = None, None
+        today = datetime.datetime.combine(datetime.datetime.now().date(), datetime.time())
         if time_filter == "Today":
-            today = datetime.datetime.now().date()
-            filtered_activities = [act for act in filtered_activities if act['datetime'].date() == today]
+            start, end = today, today + datetime.timedelta(days=1)
         elif time_filter == "This Week":
-            today = datetime.datetime.now().date()
-            end_of_week = today + datetime.timedelta(days=(6-today.weekday()))
-            filtered_activities = [act for act in filtered_activities if today <= act['datetime'].date() <= end_of_week]
+            start, end = today, today + datetime.timedelta(days=(7-today.weekday()))
+        elif time_filter == "This Month":
+            start, end = today, (today.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        
+        activity_index = st.session_state['activity_index']
+        group = None if activity_type == "All" else activity_type
+        total = activity_index.count(start, end, group=group)
+        
+        # Pagination
+        col4, col5 = st.columns(2)
+        with col4:
+            page_size = st.selectbox("Activities per page", [10, 20, 50], index=1)
+        with col5:
+            page_count = max(1, -(-total // page_size))
+            page_number = st.number_input("Page", min_value=1, max_value=page_count, value=1)
+        offset = (page_number - 1) * page_size
         
-        # Sort activities
+        # Select only the visible page rather than sorting every match
         if sort_by == "Date":
-            filtered_activities.sort(key=lambda x: x['datetime'])
-        elif sort_by == "Cost: Low to High":
-            filtered_activities.sort(key=lambda x: x['cost'])
-        elif sort_by == "Cost: High to Low":
-            filtered_activities.sort(key=lambda x: x['cost'], reverse=True)
-        elif sort_by == "Availability":
-            filtered_activities.sort(key=lambda x: x['available_slots'] - x['booked_slots'], reverse=True)
+            filtered_activities, _ = activity_index.range(start, end, group=group, limit=offset + page_size)
+            filtered_activities = filtered_activities[offset:]
+        else:
+            candidates, _ = activity_index.range(start, end, group=group)
+            if sort_by == "Cost: Low to High":
+                filtered_activities = select_page(candidates, lambda x: x['cost'], page_number - 1, page_size)
+            elif sort_by == "Cost: High to Low":
+                filtered_activities = select_page(candidates, lambda x: x['cost'], page_number - 1, page_size, reverse=True)
+            elif sort_by == "Availability":
+                filtered_activities = select_page(
+                    candidates,
+                    lambda x: x['available_slots'] - x['booked_slots'],
+                    page_number - 1,
+                    page_size,
+                    reverse=True
+                )
         
         # Display activities
         if not filtered_activities:
             st.info("No activities match your criteria")
         else:
+            st.caption(f"Showing {offset + 1}-{offset + len(filtered_activities)} of {total} activities")
             for activity in filtered_activities:
                 with st.expander(f"{activity['name']} - {activity['datetime'].strftime('%b %d, %Y at %I:%M %p')}"):
                     col1, col2 = st.columns([2, 1])
@@ -336,7 +422,19 @@ def main():
                         if st.session_state['logged_in']:
                             coupon_code = st.text_input("Coupon Code (if any)", key=f"coupon_{activity['id']}")
                             
-                            if st.button("Book Now", key=f"book_{activity['id']}"):
+                            if available <= 0:
+                                # Fully booked: wait for a cancellation instead
+                                if st.button("Join Waitlist", key=f"waitlist_{activity['id']}"):
+                                    success, message = join_waitlist(
+                                        activity['id'],
+                                        st.session_state['current_user']['id'],
+                                        coupon_code
+                                    )
+                                    if success:
+                                        st.success(message)
+                                    else:
+                                        st.error(message)
+                            elif st.button("Book Now", key=f"book_{activity['id']}"):
                                 success, result = book_activity(
                                     activity['id'], 
                                     st.session_state['current_user']['id'],
@@ -344,8 +442,8 @@ def main():
                                 )
                                 if success:
                                     st.success("Activity booked successfully!")
-                                    if coupon_code and coupon_code in st.session_state['coupons']:
-                                        discount_percent = st.session_state['coupons'][coupon_code] * 100
+                                    if get_engine().pricing.coupon_rate(coupon_code):
+                                        discount_percent = get_engine().pricing.coupon_rate(coupon_code) * 100
                                         st.info(f"Coupon applied: {discount_percent:.0f}% discount")
                                 else:
                                     st.error(result)
@@ -398,7 +496,11 @@ def main():
                                     st.write(f"**Booking ID:** {booking['id']}")
                                     st.write(f"**Booked on:** {booking['booking_time'].strftime('%b %d, %Y')}")
                                     if st.button("Cancel Booking", key=f"cancel_{booking['id']}"):
-                                        st.warning("This is a mock cancellation. In a real application, this would cancel your booking.")
+                                        success, message = cancel_booking(booking['id'], user_id)
+                                        if success:
+                                            st.success(message)
+                                        else:
+                                            st.error(message)
                 
                 with tabs[1]:
                     st.subheader("Past Bookings")
@@ -434,13 +536,14 @@ def main():
         
         st.info("This is a mockup of the vendor interface. In a real application, vendors would have their own login.")
         
+        summary = activity_summary(data_version(), st.session_state['activities'], st.session_state['bookings'])
         tabs = st.tabs(["My Activities", "Manage Bookings", "Add New Activity"])
         
         with tabs[0]:
             st.subheader("My Activities")
             
-            vendor_name = st.selectbox("Select Vendor", list(set(act['vendor'] for act in st.session_state['activities'])))
-            vendor_activities = [act for act in st.session_state['activities'] if act['vendor'] == vendor_name]
+            vendor_name = st.selectbox("Select Vendor", summary['vendors'])
+            vendor_activities = summary['activities_by_vendor'].get(vendor_name, [])
             
             for activity in vendor_activities:
                 with st.expander(f"{activity['name']} - {activity['datetime'].strftime('%b %d, %Y')}"):
@@ -452,7 +555,7 @@ def main():
                         st.write(f"**Date & Time:** {activity['datetime'].strftime('%b %d, %Y at %I:%M %p')}")
                         st.write(f"**Cost per Person:** ${activity['cost']:.2f}")
                         
-                        bookings = len([b for b in st.session_state['bookings'] if b['activity_id'] == activity['id']])
+                        bookings = summary['booking_counts'].get(activity['id'], 0)
                         st.write(f"**Bookings:** {bookings}")
                         st.write(f"**Capacity:** {activity['booked_slots']}/{activity['available_slots']} slots filled")
                         st.progress(activity['booked_slots'] / activity['available_slots'])
@@ -467,8 +570,8 @@ def main():
         with tabs[1]:
             st.subheader("Manage Bookings")
             
-            vendor_name = st.selectbox("Select Vendor", list(set(act['vendor'] for act in st.session_state['activities'])), key="vendor_bookings")
-            vendor_activities = [act for act in st.session_state['activities'] if act['vendor'] == vendor_name]
+            vendor_name = st.selectbox("Select Vendor", summary['vendors'], key="vendor_bookings")
+            vendor_activities = summary['activities_by_vendor'].get(vendor_name, [])
             
             activity_id = st.selectbox(
                 "Select Activity", 
@@ -478,25 +581,13 @@ def main():
             
             if activity_id:
                 activity_id = activity_id[0]
-                activity_bookings = [b for b in st.session_state['bookings'] if b['activity_id'] == activity_id]
+                booking_count = summary['booking_counts'].get(activity_id, 0)
                 
-                if not activity_bookings:
+                if not booking_count:
                     st.info("No bookings for this activity yet")
                 else:
-                    st.write(f"Total Bookings: {len(activity_bookings)}")
-                    
-                    booking_data = []
-                    for booking in activity_bookings:
-                        user = next((u for u in st.session_state['users'] if u['id'] == booking['user_id']), {"name": "Unknown", "phone": "Unknown"})
-                        booking_data.append({
-                            "Booking ID": booking['id'],
-                            "User Name": user['name'],
-                            "Phone": user['phone'],
-                            "Booking Date": booking['booking_time'].strftime('%b %d, %Y'),
-                            "Amount Paid": f"${booking['final_cost']:.2f}"
-                        })
-                    
-                    st.dataframe(pd.DataFrame(booking_data))
+                    st.write(f"Total Bookings: {booking_count}")
+                    st.dataframe(booking_table(data_version(), activity_id, st.session_state['bookings']))
         
         with tabs[2]:
             st.subheader("Add New Activity")
@@ -511,7 +602,7 @@ def main():
                         ["Sports", "Board Games", "Card Games", "Outdoor Adventure", "Other"]
                     )
                     location = st.text_input("Location")
-                    vendor_name = st.selectbox("Vendor Name", list(set(act['vendor'] for act in st.session_state['activities'])))
+                    vendor_name = st.selectbox("Vendor Name", summary['vendors'])
                 
                 with col2:
                     activity_date = st.date_input("Date", value=datetime.datetime.now().date() + datetime.timedelta(days=1))
@@ -527,7 +618,7 @@ def main():
                     else:
                         activity_datetime = datetime.datetime.combine(activity_date, activity_time)
                         new_activity = {
-                            "id": len(st.session_state['activities']) + 1,
+                            "id": get_engine().next_id('activities'),
                             "name": activity_name,
                             "type": activity_type,
                             "location": location,
@@ -538,7 +629,10 @@ def main():
                             "vendor": vendor_name
                         }
                         
+                        get_engine().create_activity(new_activity)
                         st.session_state['activities'].append(new_activity)
+                        st.session_state['activity_index'].add(new_activity)
+                        bump_data_version()
                         st.success("Activity added successfully!")
 
 # Run the app
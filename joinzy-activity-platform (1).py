@@ -1,7 +1,11 @@
 import streamlit as st
 import pandas as pd
 import datetime
+import os
 import random
+import uuid
+from joinzy_core import Engine
+from joinzy_index import PartyFilterIndex
 
 # Set page configuration
 st.set_page_config(
@@ -10,16 +14,10 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize session state variables
-if 'logged_in' not in st.session_state:
-    st.session_state['logged_in'] = False
-if 'current_user' not in st.session_state:
-    st.session_state['current_user'] = None
-if 'users' not in st.session_state:
-    st.session_state['users'] = []
-if 'activities' not in st.session_state:
+# Demo data loaded into a fresh database
+def seed_storage(storage):
     # Sample activities data
-    st.session_state['activities'] = [
+    activities = [
         {
             "id": 1,
             "party_name": "Sunday Football Fun",
@@ -70,52 +68,8 @@ if 'activities' not in st.session_state:
         },
     ]
 
-# Function to handle user registration
-def register_user(user_data):
-    # Check if username already exists
-    if any(user['username'] == user_data['username'] for user in st.session_state['users']):
-        return False
-    st.session_state['users'].append(user_data)
-    return True
-
-# Function to handle login
-def login(username, password):
-    # For demo, simple login check
-    user = next((user for user in st.session_state['users'] if user['username'] == username), None)
-    if user and user['password'] == password:
-        st.session_state['logged_in'] = True
-        st.session_state['current_user'] = user
-        return True
-    return False
-
-# Function to create a new activity
-def create_activity(activity_data):
-    activity_data["id"] = len(st.session_state['activities']) + 1
-    st.session_state['activities'].append(activity_data)
-    return activity_data["id"]
-
-# Function to join an activity
-def join_activity(activity_id, user_id):
-    for activity in st.session_state['activities']:
-        if activity['id'] == activity_id:
-            if activity['current_participants'] < activity['max_participants'] and user_id not in activity['participants']:
-                activity['participants'].append(user_id)
-                activity['current_participants'] += 1
-                return True
-    return False
-
-# Function to leave an activity
-def leave_activity(activity_id, user_id):
-    for activity in st.session_state['activities']:
-        if activity['id'] == activity_id and user_id in activity['participants']:
-            activity['participants'].remove(user_id)
-            activity['current_participants'] -= 1
-            return True
-    return False
-
-# Create sample users if none exist
-if not st.session_state['users']:
-    sample_users = [
+    # Sample users data
+    users = [
         {
             "id": 1,
             "name": "John Doe",
@@ -161,7 +115,109 @@ if not st.session_state['users']:
             "location": "Eastside"
         },
     ]
-    st.session_state['users'].extend(sample_users)
+    storage.seed(users=users, parties=activities)
+
+# Shared engine, opened once per server process
+@st.cache_resource
+def get_engine():
+    return Engine.open(os.environ.get('JOINZY_ACTIVITIES_DB', 'joinzy_activities.db'), seed=seed_storage)
+
+def get_storage():
+    return get_engine().storage
+
+# Initialize session state variables
+if 'logged_in' not in st.session_state:
+    st.session_state['logged_in'] = False
+if 'current_user' not in st.session_state:
+    st.session_state['current_user'] = None
+if 'users' not in st.session_state:
+    st.session_state['users'] = get_storage().list_users()
+if 'activities' not in st.session_state:
+    st.session_state['activities'] = get_storage().list_parties()
+if 'activity_index' not in st.session_state:
+    st.session_state['activity_index'] = PartyFilterIndex(st.session_state['activities'])
+if 'data_version' not in st.session_state:
+    # Views cached from this session's data are keyed on (session key, counter)
+    st.session_state['session_key'] = uuid.uuid4().hex
+    st.session_state['data_version'] = 0
+
+# Function to get the version of this session's data for cache keys
+def data_version():
+    return st.session_state['session_key'], st.session_state['data_version']
+
+# Function to invalidate cached views after this session's data changed
+def bump_data_version():
+    st.session_state['data_version'] += 1
+
+# Function to handle user registration
+def register_user(user_data):
+    if not get_engine().register_user(user_data):
+        return False
+    st.session_state['users'].append(user_data)
+    bump_data_version()
+    return True
+
+# Function to handle login
+def login(username, password):
+    user = get_engine().login(username, password)
+    if user:
+        st.session_state['logged_in'] = True
+        st.session_state['current_user'] = user
+        return True
+    return False
+
+# Function to create a new activity
+def create_activity(activity_data):
+    activity_data["id"] = get_engine().next_id('parties')
+    get_engine().create_party(activity_data)
+    st.session_state['activities'].append(activity_data)
+    st.session_state['activity_index'].add(activity_data)
+    bump_data_version()
+    return activity_data["id"]
+
+# Function to join an activity
+def join_activity(activity_id, user_id):
+    success, _ = get_engine().join_party(activity_id, user_id)
+    if success:
+        for activity in st.session_state['activities']:
+            if activity['id'] == activity_id:
+                activity['participants'].append(user_id)
+                activity['current_participants'] += 1
+                st.session_state['activity_index'].update(activity)
+                break
+        bump_data_version()
+    return success
+
+# Function to leave an activity
+def leave_activity(activity_id, user_id):
+    success, _ = get_engine().leave_party(activity_id, user_id)
+    if success:
+        for activity in st.session_state['activities']:
+            if activity['id'] == activity_id:
+                activity['participants'].remove(user_id)
+                activity['current_participants'] -= 1
+                st.session_state['activity_index'].update(activity)
+                break
+        bump_data_version()
+    return success
+
+# Activity Summary Table rows for a type filter and viewer, cached until
+# the session's data changes
+@st.cache_data(max_entries=256)
+def activity_table(version, activity_type, user_id, _activity_index):
+    table_data = []
+    for activity in _activity_index.query(activity_type=activity_type):
+        table_data.append({
+            "ID": activity['id'],
+            "Party Name": activity['party_name'],
+            "Activity Type": activity['activity_type'],
+            "Date": activity['date'].strftime('%d/%m/%Y'),
+            "Start Time": activity['start_time'].strftime('%H:%M'),
+            "Location": activity['location'],
+            "Participants": f"{activity['current_participants']}/{activity['max_participants']}",
+            "Is Participant": user_id in activity['participants']
+        })
+    return pd.DataFrame(table_data), {row["ID"]: row["Party Name"] for row in table_data}
 
 # Main app layout
 def main():
@@ -223,7 +279,7 @@ def main():
                             st.error("Please fill in all required fields!")
                         else:
                             user_data = {
-                                "id": len(st.session_state['users']) + 1,
+                                "id": get_engine().next_id('users'),
                                 "name": name,
                                 "age": age,
                                 "phone": phone,
@@ -271,9 +327,9 @@ def display_main_page():
             search_button = st.button("Search")
     
     # Filter activities based on selection
-    filtered_activities = st.session_state['activities']
-    if selected_type != "All Types":
-        filtered_activities = [act for act in filtered_activities if act['activity_type'] == selected_type]
+    filtered_activities = st.session_state['activity_index'].query(
+        activity_type=None if selected_type == "All Types" else selected_type
+    )
     
     # Create Party Form (shown when Create Party button is clicked)
     if create_button:
@@ -321,33 +377,13 @@ def display_main_page():
     if not filtered_activities:
         st.info("No activities found for the selected type. Try creating a new one!")
     else:
-        # Create a DataFrame for display
-        table_data = []
-        for activity in filtered_activities:
-            # Format date and time
-            formatted_date = activity['date'].strftime('%d/%m/%Y')
-            formatted_time = activity['start_time'].strftime('%H:%M')
-            
-            # Format participants
-            participants_str = f"{activity['current_participants']}/{activity['max_participants']}"
-            
-            # Check if current user is a participant
-            is_participant = False
-            if st.session_state['logged_in']:
-                is_participant = st.session_state['current_user']['id'] in activity['participants']
-            
-            table_data.append({
-                "ID": activity['id'],
-                "Party Name": activity['party_name'],
-                "Activity Type": activity['activity_type'],
-                "Date": formatted_date,
-                "Start Time": formatted_time,
-                "Location": activity['location'],
-                "Participants": participants_str,
-                "Is Participant": is_participant
-            })
-        
-        df = pd.DataFrame(table_data)
+        # Table rows are rebuilt only when the data, the filter or the user changes
+        df, party_names = activity_table(
+            data_version(),
+            None if selected_type == "All Types" else selected_type,
+            st.session_state['current_user']['id'] if st.session_state['logged_in'] else None,
+            st.session_state['activity_index']
+        )
         
         # Display table with custom formatting
         st.dataframe(
@@ -362,8 +398,8 @@ def display_main_page():
         # Let user select an activity to view details
         selected_activity_id = st.selectbox(
             "Select an activity to view details",
-            options=[a["ID"] for a in table_data],
-            format_func=lambda x: next((a["Party Name"] for a in table_data if a["ID"] == x), ""),
+            options=list(party_names),
+            format_func=lambda x: party_names.get(x, ""),
         )
         
         if selected_activity_id:
@@ -379,15 +415,18 @@ def display_main_page():
                     st.markdown(f"**Location:** {selected_activity['location']}")
                     st.markdown(f"**Participants:** {selected_activity['current_participants']}/{selected_activity['max_participants']}")
                     
+                    # Look up the creator and every participant in one batch
+                    users = get_storage().get_users([selected_activity['creator_id']] + selected_activity['participants'])
+                    
                     # Show creator
-                    creator = next((user for user in st.session_state['users'] if user['id'] == selected_activity['creator_id']), None)
+                    creator = users.get(selected_activity['creator_id'])
                     if creator:
                         st.markdown(f"**Created by:** {creator['name']}")
                     
                     # Show participants
                     st.markdown("**Participants List:**")
                     for participant_id in selected_activity['participants']:
-                        participant = next((user for user in st.session_state['users'] if user['id'] == participant_id), None)
+                        participant = users.get(participant_id)
                         if participant:
                             st.markdown(f"- {participant['name']}")
                 
@@ -453,10 +492,8 @@ def display_my_activities():
                         
                         # List participants
                         st.markdown("**Participants:**")
-                        for participant_id in activity['participants']:
-                            participant = next((user for user in st.session_state['users'] if user['id'] == participant_id), None)
-                            if participant:
-                                st.markdown(f"- {participant['name']}")
+                        for participant in get_storage().get_users(activity['participants']).values():
+                            st.markdown(f"- {participant['name']}")
                     
                     with col2:
                         if st.button("Edit", key=f"edit_{activity['id']}"):
@@ -473,6 +510,7 @@ def display_my_activities():
         if not joined_activities:
             st.info("You haven't joined any activities created by others. Go to the Main Page to find activities!")
         else:
+            creators = get_storage().get_users(activity['creator_id'] for activity in joined_activities)
             for activity in joined_activities:
                 with st.expander(f"{activity['party_name']} - {activity['date'].strftime('%d/%m/%Y')}"):
                     col1, col2 = st.columns([3, 1])
@@ -484,7 +522,7 @@ def display_my_activities():
                         st.markdown(f"**Participants:** {activity['current_participants']}/{activity['max_participants']}")
                         
                         # Show creator
-                        creator = next((user for user in st.session_state['users'] if user['id'] == activity['creator_id']), None)
+                        creator = creators.get(activity['creator_id'])
                         if creator:
                             st.markdown(f"**Created by:** {creator['name']}")
                     
@@ -553,18 +591,19 @@ def display_profile():
                 st.error("New passwords do not match")
             else:
                 # Update user info
-                updated_user = user.copy()
-                updated_user.update({
+                fields = {
                     "name": name,
                     "age": age,
                     "phone": phone,
                     "gender": gender,
                     "preferred_activities": preferred_activities,
                     "location": location
-                })
+                }
                 
                 if new_password:
-                    updated_user["password"] = new_password
+                    fields["password"] = new_password
+                
+                updated_user = get_engine().update_user(user['id'], **fields)
                 
                 # Update in session state
                 for i, u in enumerate(st.session_state['users']):
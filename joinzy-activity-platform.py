@@ -2,8 +2,10 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import datetime
+import os
 import random
 from PIL import Image
+from joinzy_core import PartyEngine
 
 # Set page configuration
 st.set_page_config(
@@ -12,13 +14,14 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize session state variables
-if 'logged_in' not in st.session_state:
-    st.session_state['logged_in'] = False
-if 'current_user' not in st.session_state:
-    st.session_state['current_user'] = None
-if 'users' not in st.session_state:
-    st.session_state['users'] = [
+# Radius of the "Near me" quick filter, in km
+NEAR_ME_KM = 5
+# Venues offered in the Create Party form when the user's location is known
+NEAREST_VENUES = 10
+
+# Demo data loaded into a fresh database
+def seed_storage(storage):
+    users = [
         {
             "id": 1,
             "name": "John Doe",
@@ -50,8 +53,7 @@ if 'users' not in st.session_state:
             "membership_status": "Basic"
         }
     ]
-if 'parties' not in st.session_state:
-    st.session_state['parties'] = [
+    parties = [
         {
             "id": 1,
             "name": "Saturday Football Match",
@@ -101,8 +103,7 @@ if 'parties' not in st.session_state:
             "venue_booked": True
         }
     ]
-if 'venues' not in st.session_state:
-    st.session_state['venues'] = [
+    venues = [
         {
             "id": 1,
             "name": "Central Park Field",
@@ -142,35 +143,41 @@ if 'venues' not in st.session_state:
             "available_hours": ["08:00-21:00"]
         }
     ]
-if 'activity_types' not in st.session_state:
-    st.session_state['activity_types'] = [
-        "Football", "Basketball", "Volleyball", "Tennis", "Badminton",
-        "Board Games", "Chess", "Card Games", "Role-Playing Games"
-    ]
-if 'coupons' not in st.session_state:
-    st.session_state['coupons'] = {
-        "WELCOME": 0.15,  # 15% off
-        "WEEKEND": 0.10,  # 10% off
-        "PREMIUM": 0.20   # 20% off for premium members
-    }
-if 'activity_images' not in st.session_state:
-    # In a real app, these would be proper image paths
-    st.session_state['activity_images'] = {
-        "Football": "/api/placeholder/100/100?text=Football",
-        "Basketball": "/api/placeholder/100/100?text=Basketball",
-        "Volleyball": "/api/placeholder/100/100?text=Volleyball",
-        "Tennis": "/api/placeholder/100/100?text=Tennis",
-        "Badminton": "/api/placeholder/100/100?text=Badminton",
-        "Board Games": "/api/placeholder/100/100?text=Board+Games",
-        "Chess": "/api/placeholder/100/100?text=Chess",
-        "Card Games": "/api/placeholder/100/100?text=Card+Games",
-        "Role-Playing Games": "/api/placeholder/100/100?text=RPGs"
-    }
+    storage.seed(users=users, parties=parties, venues=venues)
+
+# Shared engine (storage and catalog), opened once per server process
+@st.cache_resource
+def get_engine():
+    return PartyEngine.open(os.environ.get('JOINZY_DB', 'joinzy.db'), seed=seed_storage)
+
+def get_catalog():
+    return get_engine().catalog
+
+# One page of the Home listing and the number of matching parties. Cached
+# per catalog version, so reruns from unrelated widgets reuse it.
+@st.cache_data(max_entries=256)
+def home_listing(version, filters, after, page_size):
+    catalog = get_catalog()
+    return catalog.count_parties(**filters), catalog.find_parties(**filters, after=after, limit=page_size)
+
+# Initialize session state variables
+if 'logged_in' not in st.session_state:
+    st.session_state['logged_in'] = False
+if 'current_user' not in st.session_state:
+    st.session_state['current_user'] = None
+if 'home_filters' not in st.session_state:
+    st.session_state['home_filters'] = None
+if 'home_cursors' not in st.session_state:
+    # Id of the last party before each page visited so far; the last entry is the current page
+    st.session_state['home_cursors'] = [None]
+if 'party_messages' not in st.session_state:
+    # Result of the last Join/Leave/Cancel click per party, shown once on its card
+    st.session_state['party_messages'] = {}
 
 # Function to handle login
 def login(username, password):
-    user = next((user for user in st.session_state['users'] if user['username'] == username), None)
-    if user and user['password'] == password:
+    user = get_engine().login(username, password)
+    if user:
         st.session_state['logged_in'] = True
         st.session_state['current_user'] = user
         return True
@@ -178,67 +185,252 @@ def login(username, password):
 
 # Function to handle registration
 def register_user(user_data):
-    if any(user['username'] == user_data['username'] for user in st.session_state['users']):
-        return False
-    st.session_state['users'].append(user_data)
-    return True
+    return get_engine().register_user(user_data)
 
 # Function to create a new party
 def create_party(party_data):
-    st.session_state['parties'].append(party_data)
-    return True
+    return get_engine().create_party(party_data)
 
 # Function to join a party
 def join_party(party_id, user_id):
-    for party in st.session_state['parties']:
-        if party['id'] == party_id:
-            if party['current_participants'] < party['max_participants']:
-                if user_id not in party['participants']:
-                    party['participants'].append(user_id)
-                    party['current_participants'] += 1
-                    return True, "Successfully joined the party!"
-                else:
-                    return False, "You are already in this party."
-            else:
-                return False, "Party is already full."
-    return False, "Party not found."
+    return get_engine().join_party(party_id, user_id)
 
 # Function to leave a party
 def leave_party(party_id, user_id):
-    for party in st.session_state['parties']:
-        if party['id'] == party_id:
-            if user_id in party['participants']:
-                party['participants'].remove(user_id)
-                party['current_participants'] -= 1
-                return True, "Successfully left the party."
-            else:
-                return False, "You are not in this party."
-    return False, "Party not found."
+    return get_engine().leave_party(party_id, user_id)
+
+# Function to cancel a party
+def cancel_party(party_id):
+    return get_engine().cancel_party(party_id)
+
+# Functions to join and leave the waitlist of a full party
+def join_waitlist(party_id, user_id):
+    return get_engine().join_waitlist(party_id, user_id)
+
+def leave_waitlist(party_id, user_id):
+    if get_engine().leave_waitlist(party_id, user_id):
+        return True, "You have left the waitlist."
+    return False, "You are not on the waitlist."
+
+# Home page pagination callbacks, run before the rerun that renders the new page
+def next_home_page(last_party_id):
+    st.session_state['home_cursors'].append(last_party_id)
+
+def previous_home_page():
+    if len(st.session_state['home_cursors']) > 1:
+        st.session_state['home_cursors'].pop()
+
+# Navigation and account callbacks. Like the pagination ones they run before
+# the rerun a click triggers, so the sidebar is drawn with the new state in a
+# single pass instead of forcing a second full rerun.
+def go_to(page):
+    st.session_state['page'] = page
+
+def logout():
+    st.session_state['logged_in'] = False
+    st.session_state['current_user'] = None
+
+def submit_login():
+    if login(st.session_state['login_username'], st.session_state['login_password']):
+        st.session_state['notice'] = "Login successful!"
+        go_to("Home")
+    else:
+        st.session_state['login_error'] = "Invalid username or password"
+
+def submit_registration():
+    form = {field: st.session_state[f"register_{field}"] for field in (
+        "name", "age", "phone", "gender", "username", "password", "confirm_password",
+        "location", "activities_pref", "preferred_days", "preferred_times"
+    )}
+    if form['password'] != form['confirm_password']:
+        st.session_state['register_error'] = "Passwords do not match!"
+    elif not form['name'] or not form['username'] or not form['password']:
+        st.session_state['register_error'] = "Please fill in all required fields!"
+    else:
+        del form['confirm_password']
+        user_data = {
+            "id": get_engine().next_id('users'),
+            **form,
+            "joined_date": datetime.datetime.now(),
+            "membership_status": "Basic"
+        }
+
+        if register_user(user_data):
+            # Automatically log the new user in
+            login(user_data['username'], user_data['password'])
+            st.session_state['notice'] = "Registration successful!"
+            go_to("Home")
+        else:
+            st.session_state['register_error'] = "Username already exists. Please choose another."
+
+# Party card callbacks; the result is shown on the card's next run
+def toggle_party(party_id, user_id, joining):
+    action = join_party if joining else leave_party
+    st.session_state['party_messages'][party_id] = action(party_id, user_id)
+
+def toggle_waitlist(party_id, user_id, joining):
+    action = join_waitlist if joining else leave_waitlist
+    st.session_state['party_messages'][party_id] = action(party_id, user_id)
+
+def cancel_created_party(party_id):
+    cancel_party(party_id)
+    st.session_state['party_messages'][party_id] = (True, "Party cancelled. Participants would be notified.")
+
+# Show and clear the last result for a party
+def show_party_message(party_id):
+    result = st.session_state['party_messages'].pop(party_id, None)
+    if result:
+        success, message = result
+        if success:
+            st.success(message)
+        else:
+            st.error(message)
 
 # Function to calculate party cost
 def calculate_party_cost(party_id, apply_coupon=None):
-    party = next((p for p in st.session_state['parties'] if p['id'] == party_id), None)
-    if not party:
-        return None
-    
-    base_cost = party['cost_per_person']
-    discount = 0
-    
-    # Apply coupon if valid
-    if apply_coupon and apply_coupon in st.session_state['coupons']:
-        discount = base_cost * st.session_state['coupons'][apply_coupon]
-    
-    # Apply premium member discount
-    if st.session_state['logged_in'] and st.session_state['current_user']['membership_status'] == "Premium":
-        premium_discount = base_cost * 0.10  # 10% discount for premium members
-        discount = max(discount, premium_discount)  # Take the higher discount
-    
-    final_cost = base_cost - discount
-    return {
-        "base_cost": base_cost,
-        "discount": discount,
-        "final_cost": final_cost
-    }
+    user = st.session_state['current_user'] if st.session_state['logged_in'] else None
+    return get_engine().calculate_party_cost(party_id, user, apply_coupon)
+
+# Function to calculate costs for many parties in one call, keyed by party id
+def calculate_party_costs(party_ids, apply_coupon=None):
+    user = st.session_state['current_user'] if st.session_state['logged_in'] else None
+    return get_engine().calculate_party_costs(party_ids, user, apply_coupon)
+
+# Party cards are fragments: a click on a card's buttons reruns only that
+# card, which re-reads its party so the participant count and progress bar
+# are current, and leaves the rest of the page as it is.
+
+# A party card on the Home page
+@st.fragment
+def party_card(party_id):
+    party = get_catalog().get_party(party_id)
+    if party is None:
+        st.info("This party has been cancelled.")
+        return
+
+    col_img, col_details, col_actions = st.columns([1, 3, 1])
+
+    with col_img:
+        # Display activity image
+        img_path = get_catalog().activity_images.get(party['activity_type'], "/api/placeholder/100/100?text=Activity")
+        st.image(img_path, width=100)
+
+    with col_details:
+        st.subheader(party['name'])
+
+        # Activity details
+        details_col1, details_col2 = st.columns(2)
+
+        with details_col1:
+            st.markdown(f"**Activity:** {party['activity_type']}")
+            st.markdown(f"**Date:** {party['date'].strftime('%d/%m/%Y')}")
+            st.markdown(f"**Time:** {party['start_time'].strftime('%H:%M')} - {party['end_time'].strftime('%H:%M')}")
+
+        with details_col2:
+            st.markdown(f"**Location:** {party['location']}")
+            st.markdown(f"**Participants:** {party['current_participants']}/{party['max_participants']}")
+            st.markdown(f"**Cost:** ${party['cost_per_person']:.2f} per person")
+
+        # Progress bar for participants
+        progress = party['current_participants'] / party['max_participants']
+        st.progress(progress)
+
+    with col_actions:
+        if st.session_state['logged_in']:
+            user_id = st.session_state['current_user']['id']
+            position = get_engine().waitlist_position(party_id, user_id)
+            if user_id in party['participants']:
+                st.button("Leave", key=f"leave_{party_id}", on_click=toggle_party, args=(party_id, user_id, False))
+            elif position:
+                st.caption(f"Waitlist position: {position}")
+                st.button("Leave Waitlist", key=f"unwait_{party_id}", on_click=toggle_waitlist, args=(party_id, user_id, False))
+            elif party['current_participants'] >= party['max_participants']:
+                st.button("Join Waitlist", key=f"wait_{party_id}", on_click=toggle_waitlist, args=(party_id, user_id, True))
+            else:
+                st.button("Join", key=f"join_{party_id}", on_click=toggle_party, args=(party_id, user_id, True))
+            show_party_message(party_id)
+        else:
+            st.info("Login to join")
+
+    st.markdown("---")
+
+# A joined party on the My Parties page; once left, only the result is shown
+@st.fragment
+def joined_party_card(party_id, user_id, cost_info, creator):
+    party = get_catalog().get_party(party_id)
+    if party is None or user_id not in party['participants']:
+        show_party_message(party_id)
+        return
+
+    with st.expander(f"{party['name']} - {party['date'].strftime('%d/%m/%Y')}"):
+        col1, col2, col3 = st.columns([1, 2, 1])
+
+        with col1:
+            img_path = get_catalog().activity_images.get(party['activity_type'], "/api/placeholder/100/100?text=Activity")
+            st.image(img_path, width=150)
+
+        with col2:
+            st.markdown(f"**Activity:** {party['activity_type']}")
+            st.markdown(f"**Date:** {party['date'].strftime('%d/%m/%Y')}")
+            st.markdown(f"**Time:** {party['start_time'].strftime('%H:%M')} - {party['end_time'].strftime('%H:%M')}")
+            st.markdown(f"**Location:** {party['location']}")
+            st.markdown(f"**Participants:** {party['current_participants']}/{party['max_participants']}")
+            st.markdown(f"**Description:** {party['description']}")
+
+            # Calculate cost with potential discounts
+            st.markdown(f"**Cost:** ${cost_info['final_cost']:.2f} per person")
+            if cost_info['discount'] > 0:
+                st.markdown(f"*You save: ${cost_info['discount']:.2f}*")
+
+        with col3:
+            st.button("Leave Party", key=f"myleave_{party_id}", on_click=toggle_party, args=(party_id, user_id, False))
+            show_party_message(party_id)
+
+            st.markdown("---")
+            st.markdown("**Need to know**")
+            st.markdown("Contact organizer:")
+            if creator:
+                st.markdown(f"{creator['name']}: {creator['phone']}")
+
+# A party the user created, on the My Parties page
+@st.fragment
+def created_party_card(party_id):
+    party = get_catalog().get_party(party_id)
+    if party is None:
+        result = st.session_state['party_messages'].pop(party_id, None)
+        if result:
+            st.warning(result[1])
+        return
+
+    with st.expander(f"{party['name']} - {party['date'].strftime('%d/%m/%Y')}"):
+        col1, col2 = st.columns([1, 3])
+
+        with col1:
+            img_path = get_catalog().activity_images.get(party['activity_type'], "/api/placeholder/100/100?text=Activity")
+            st.image(img_path, width=150)
+
+        with col2:
+            st.markdown(f"**Activity:** {party['activity_type']}")
+            st.markdown(f"**Date:** {party['date'].strftime('%d/%m/%Y')}")
+            st.markdown(f"**Time:** {party['start_time'].strftime('%H:%M')} - {party['end_time'].strftime('%H:%M')}")
+            st.markdown(f"**Location:** {party['location']}")
+            st.markdown(f"**Participants:** {party['current_participants']}/{party['max_participants']}")
+            st.markdown(f"**Cost:** ${party['cost_per_person']:.2f} per person")
+            st.markdown(f"**Description:** {party['description']}")
+
+            if st.button("Edit Party", key=f"edit_{party_id}"):
+                st.info("Edit functionality would be implemented here")
+
+            st.button("Cancel Party", key=f"cancel_{party_id}", on_click=cancel_created_party, args=(party_id,))
+
+            st.markdown("---")
+            st.markdown("### Participants")
+
+            # Show participants list with what each of them pays
+            participants = get_catalog().get_users(party['participants'])
+            quotes = get_catalog().quote_attendees(party_id, participants.values())
+            for participant in participants.values():
+                st.markdown(f"- {participant['name']} (${quotes[participant['id']]['final_cost']:.2f})")
 
 # Main app layout
 def main():
@@ -252,7 +444,13 @@ def main():
     else:
         nav_options.extend(["My Profile", "My Parties", "Create Party"])
     
-    page = st.sidebar.radio("Navigation", nav_options)
+    # Keyed so the navigation callbacks can switch pages; a page that is no
+    # longer offered (after logging in or out) falls back to Home
+    page = st.sidebar.radio("Navigation", nav_options, key="page")
+    
+    # One-off message from a callback in the previous run
+    if 'notice' in st.session_state:
+        st.success(st.session_state.pop('notice'))
     
     # Display user info in sidebar if logged in
     if st.session_state['logged_in']:
@@ -265,10 +463,7 @@ def main():
             st.sidebar.markdown("Basic Member")
             st.sidebar.markdown("[Upgrade to Premium]()")
         
-        if st.sidebar.button("Logout"):
-            st.session_state['logged_in'] = False
-            st.session_state['current_user'] = None
-            st.experimental_rerun()
+        st.sidebar.button("Logout", on_click=logout)
     
     # Home page
     if page == "Home":
@@ -282,14 +477,12 @@ def main():
             # Activity type filter
             selected_activity = st.selectbox(
                 "Activity Type", 
-                ["All"] + st.session_state['activity_types']
+                ["All"] + get_catalog().activity_types
             )
             
             # Create/Search buttons
             if st.session_state['logged_in']:
-                if st.button("Create New Party", key="home_create"):
-                    st.session_state['page'] = "Create Party"
-                    st.experimental_rerun()
+                st.button("Create New Party", key="home_create", on_click=go_to, args=("Create Party",))
             else:
                 st.info("Please login to create parties")
             
@@ -297,9 +490,10 @@ def main():
             
             # Quick filters
             st.markdown("### Quick Filters")
-            st.checkbox("Today only")
-            st.checkbox("Near me")
-            st.checkbox("Available slots")
+            today_only = st.checkbox("Today only")
+            near_me = st.checkbox("Near me")
+            available_only = st.checkbox("Available slots")
+            page_size = st.selectbox("Parties per page", [5, 10, 20, 50], index=1)
             
             # Information box
             st.markdown("---")
@@ -311,68 +505,71 @@ def main():
             """)
         
         with col2:
+            # Personal recommendations
+            if st.session_state['logged_in']:
+                recommendations = get_catalog().recommend_parties(st.session_state['current_user'])
+                if recommendations:
+                    st.markdown("### Recommended for you")
+                    for party, _ in recommendations:
+                        st.markdown(
+                            f"**{party['name']}** - {party['activity_type']} on {party['date'].strftime('%d/%m/%Y')} "
+                            f"at {party['start_time'].strftime('%H:%M')}, {party['location']} "
+                            f"({party['current_participants']}/{party['max_participants']})"
+                        )
+                    st.markdown("---")
+            
             # Activity Summary Table
             st.markdown("### Available Activities")
             
-            # Filter parties based on selected activity
-            filtered_parties = st.session_state['parties']
-            if selected_activity != "All":
-                filtered_parties = [p for p in filtered_parties if p['activity_type'] == selected_activity]
+            # Filter parties based on selected activity and quick filters
+            near = None
+            if near_me:
+                point = None
+                if st.session_state['logged_in']:
+                    point = get_catalog().locate(st.session_state['current_user']['location'])
+                if point:
+                    near = (*point, NEAR_ME_KM)
+                else:
+                    st.caption("Near me needs a recognised location in your profile.")
+            filters = {
+                "activity_type": None if selected_activity == "All" else selected_activity,
+                "date": datetime.date.today() if today_only else None,
+                "available": available_only,
+                "near": near
+            }
+            
+            # Start again from the first page whenever the filters change
+            if st.session_state['home_filters'] != (filters, page_size):
+                st.session_state['home_filters'] = (filters, page_size)
+                st.session_state['home_cursors'] = [None]
+            
+            # Only the parties on the visible page are fetched and rendered
+            cursors = st.session_state['home_cursors']
+            total, filtered_parties = home_listing(get_catalog().version, filters, cursors[-1], page_size)
             
             if not filtered_parties:
                 st.info(f"No {selected_activity} activities available at the moment.")
                 st.markdown("Why not create one?")
             else:
-                # Create columns for the table
                 for party in filtered_parties:
-                    col_img, col_details, col_actions = st.columns([1, 3, 1])
-                    
-                    with col_img:
-                        # Display activity image
-                        img_path = st.session_state['activity_images'].get(party['activity_type'], "/api/placeholder/100/100?text=Activity")
-                        st.image(img_path, width=100)
-                    
-                    with col_details:
-                        st.subheader(party['name'])
-                        
-                        # Activity details
-                        details_col1, details_col2 = st.columns(2)
-                        
-                        with details_col1:
-                            st.markdown(f"**Activity:** {party['activity_type']}")
-                            st.markdown(f"**Date:** {party['date'].strftime('%d/%m/%Y')}")
-                            st.markdown(f"**Time:** {party['start_time'].strftime('%H:%M')} - {party['end_time'].strftime('%H:%M')}")
-                        
-                        with details_col2:
-                            st.markdown(f"**Location:** {party['location']}")
-                            st.markdown(f"**Participants:** {party['current_participants']}/{party['max_participants']}")
-                            st.markdown(f"**Cost:** ${party['cost_per_person']:.2f} per person")
-                        
-                        # Progress bar for participants
-                        progress = party['current_participants'] / party['max_participants']
-                        st.progress(progress)
-                    
-                    with col_actions:
-                        if st.session_state['logged_in']:
-                            user_id = st.session_state['current_user']['id']
-                            if user_id in party['participants']:
-                                if st.button("Leave", key=f"leave_{party['id']}"):
-                                    success, message = leave_party(party['id'], user_id)
-                                    if success:
-                                        st.success(message)
-                                    else:
-                                        st.error(message)
-                            else:
-                                if st.button("Join", key=f"join_{party['id']}"):
-                                    success, message = join_party(party['id'], user_id)
-                                    if success:
-                                        st.success(message)
-                                    else:
-                                        st.error(message)
-                        else:
-                            st.info("Login to join")
-                    
-                    st.markdown("---")
+                    party_card(party['id'])
+                
+                # Page navigation
+                first = (len(cursors) - 1) * page_size + 1
+                last = first + len(filtered_parties) - 1
+                nav_prev, nav_info, nav_next = st.columns([1, 3, 1])
+                with nav_prev:
+                    st.button("Previous", key="home_prev", disabled=len(cursors) == 1, on_click=previous_home_page)
+                with nav_info:
+                    st.markdown(f"Showing {first}-{last} of {total} parties")
+                with nav_next:
+                    st.button(
+                        "Next",
+                        key="home_next",
+                        disabled=last >= total,
+                        on_click=next_home_page,
+                        args=(filtered_parties[-1]['id'],)
+                    )
     
     # Login page
     elif page == "Login":
@@ -382,17 +579,13 @@ def main():
         
         with col1:
             with st.form("login_form"):
-                username = st.text_input("Username")
-                password = st.text_input("Password", type="password")
+                st.text_input("Username", key="login_username")
+                st.text_input("Password", type="password", key="login_password")
                 
-                submit_button = st.form_submit_button("Login")
-                
-                if submit_button:
-                    if login(username, password):
-                        st.success("Login successful!")
-                        st.experimental_rerun()
-                    else:
-                        st.error("Invalid username or password")
+                st.form_submit_button("Login", on_click=submit_login)
+            
+            if 'login_error' in st.session_state:
+                st.error(st.session_state.pop('login_error'))
             
             st.markdown("Don't have an account? Register now!")
         
@@ -407,67 +600,43 @@ def main():
             col1, col2 = st.columns(2)
             
             with col1:
-                name = st.text_input("Full Name")
-                age = st.number_input("Age", min_value=16, max_value=100, value=25)
-                phone = st.text_input("Phone Number")
-                gender = st.selectbox("Gender", ["Male", "Female", "Non-binary", "Prefer not to say"])
+                st.text_input("Full Name", key="register_name")
+                st.number_input("Age", min_value=16, max_value=100, value=25, key="register_age")
+                st.text_input("Phone Number", key="register_phone")
+                st.selectbox("Gender", ["Male", "Female", "Non-binary", "Prefer not to say"], key="register_gender")
             
             with col2:
-                username = st.text_input("Username")
-                password = st.text_input("Password", type="password")
-                confirm_password = st.text_input("Confirm Password", type="password")
-                location = st.text_input("Your Location")
+                st.text_input("Username", key="register_username")
+                st.text_input("Password", type="password", key="register_password")
+                st.text_input("Confirm Password", type="password", key="register_confirm_password")
+                st.text_input("Your Location", key="register_location")
             
             st.subheader("Activity Preferences")
-            activities_pref = st.multiselect(
+            st.multiselect(
                 "Select activities you enjoy", 
-                st.session_state['activity_types']
+                get_catalog().activity_types,
+                key="register_activities_pref"
             )
             
             st.subheader("Availability")
             col3, col4 = st.columns(2)
             with col3:
-                preferred_days = st.multiselect(
+                st.multiselect(
                     "Preferred days", 
-                    ["Weekdays", "Weekends", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+                    ["Weekdays", "Weekends", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"],
+                    key="register_preferred_days"
                 )
             with col4:
-                preferred_times = st.multiselect(
+                st.multiselect(
                     "Preferred times",
-                    ["Morning", "Afternoon", "Evening", "Night"]
+                    ["Morning", "Afternoon", "Evening", "Night"],
+                    key="register_preferred_times"
                 )
             
-            submit_button = st.form_submit_button("Register")
-            
-            if submit_button:
-                if password != confirm_password:
-                    st.error("Passwords do not match!")
-                elif not name or not username or not password:
-                    st.error("Please fill in all required fields!")
-                else:
-                    user_data = {
-                        "id": len(st.session_state['users']) + 1,
-                        "name": name,
-                        "age": age,
-                        "phone": phone,
-                        "gender": gender,
-                        "username": username,
-                        "password": password,
-                        "activities_pref": activities_pref,
-                        "preferred_days": preferred_days,
-                        "preferred_times": preferred_times,
-                        "location": location,
-                        "joined_date": datetime.datetime.now(),
-                        "membership_status": "Basic"
-                    }
-                    
-                    if register_user(user_data):
-                        st.success("Registration successful! Please log in.")
-                        # Automatically redirect to login
-                        login(username, password)
-                        st.experimental_rerun()
-                    else:
-                        st.error("Username already exists. Please choose another.")
+            st.form_submit_button("Register", on_click=submit_registration)
+        
+        if 'register_error' in st.session_state:
+            st.error(st.session_state.pop('register_error'))
     
     # My Profile page (only accessible when logged in)
     elif page == "My Profile" and st.session_state['logged_in']:
@@ -511,15 +680,19 @@ def main():
                 
                 activities_pref = st.multiselect(
                     "Select activities you enjoy", 
-                    st.session_state['activity_types'],
+                    get_catalog().activity_types,
                     default=user['activities_pref']
                 )
                 
                 if st.button("Update Profile"):
-                    user['name'] = name
-                    user['phone'] = phone
-                    user['location'] = location
-                    user['activities_pref'] = activities_pref
+                    updated_user = get_engine().update_user(
+                        user['id'],
+                        name=name,
+                        phone=phone,
+                        location=location,
+                        activities_pref=activities_pref
+                    )
+                    st.session_state['current_user'] = updated_user
                     st.success("Profile updated successfully!")
     
     # My Parties page (only accessible when logged in)
@@ -529,100 +702,59 @@ def main():
         user_id = st.session_state['current_user']['id']
         
         # Find parties where the user is a participant or creator
-        user_parties = [p for p in st.session_state['parties'] if user_id in p['participants']]
-        created_parties = [p for p in st.session_state['parties'] if p['creator_id'] == user_id]
+        user_parties = get_catalog().parties_joined_by(user_id)
+        created_parties = get_catalog().parties_created_by(user_id)
         
-        tabs = st.tabs(["Joined Parties", "Created Parties", "Past Parties"])
+        tabs = st.tabs(["Joined Parties", "Created Parties", "My Schedule", "Past Parties"])
         
         with tabs[0]:
             if not user_parties:
                 st.info("You haven't joined any parties yet.")
-                if st.button("Browse Activities"):
-                    st.session_state['page'] = "Home"
-                    st.experimental_rerun()
+                st.button("Browse Activities", on_click=go_to, args=("Home",))
             else:
+                creators = get_catalog().get_users(party['creator_id'] for party in user_parties)
+                costs = calculate_party_costs([party['id'] for party in user_parties])
                 for party in user_parties:
-                    with st.expander(f"{party['name']} - {party['date'].strftime('%d/%m/%Y')}"):
-                        col1, col2, col3 = st.columns([1, 2, 1])
-                        
-                        with col1:
-                            img_path = st.session_state['activity_images'].get(party['activity_type'], "/api/placeholder/100/100?text=Activity")
-                            st.image(img_path, width=150)
-                        
-                        with col2:
-                            st.markdown(f"**Activity:** {party['activity_type']}")
-                            st.markdown(f"**Date:** {party['date'].strftime('%d/%m/%Y')}")
-                            st.markdown(f"**Time:** {party['start_time'].strftime('%H:%M')} - {party['end_time'].strftime('%H:%M')}")
-                            st.markdown(f"**Location:** {party['location']}")
-                            st.markdown(f"**Participants:** {party['current_participants']}/{party['max_participants']}")
-                            st.markdown(f"**Description:** {party['description']}")
-                            
-                            # Calculate cost with potential discounts
-                            cost_info = calculate_party_cost(party['id'])
-                            st.markdown(f"**Cost:** ${cost_info['final_cost']:.2f} per person")
-                            if cost_info['discount'] > 0:
-                                st.markdown(f"*You save: ${cost_info['discount']:.2f}*")
-                        
-                        with col3:
-                            if st.button("Leave Party", key=f"myleave_{party['id']}"):
-                                success, message = leave_party(party['id'], user_id)
-                                if success:
-                                    st.success(message)
-                                    st.experimental_rerun()
-                                else:
-                                    st.error(message)
-                            
-                            st.markdown("---")
-                            st.markdown("**Need to know**")
-                            st.markdown("Contact organizer:")
-                            creator = next((u for u in st.session_state['users'] if u['id'] == party['creator_id']), None)
-                            if creator:
-                                st.markdown(f"{creator['name']}: {creator['phone']}")
+                    joined_party_card(party['id'], user_id, costs[party['id']], creators.get(party['creator_id']))
+
+            # Full parties the user is waiting for; they join automatically
+            # when a place frees up
+            waitlisted = get_engine().waitlisted_parties(user_id)
+            if waitlisted:
+                st.subheader("Waitlisted Parties")
+                for party, position in waitlisted:
+                    col1, col2 = st.columns([3, 1])
+                    with col1:
+                        st.markdown(f"**{party['name']}** - {party['date'].strftime('%d/%m/%Y')} (position {position})")
+                    with col2:
+                        st.button("Leave Waitlist", key=f"myunwait_{party['id']}", on_click=toggle_waitlist, args=(party['id'], user_id, False))
         
         with tabs[1]:
             if not created_parties:
                 st.info("You haven't created any parties yet.")
-                if st.button("Create a Party"):
-                    st.session_state['page'] = "Create Party"
-                    st.experimental_rerun()
+                st.button("Create a Party", on_click=go_to, args=("Create Party",))
             else:
                 for party in created_parties:
-                    with st.expander(f"{party['name']} - {party['date'].strftime('%d/%m/%Y')}"):
-                        col1, col2 = st.columns([1, 3])
-                        
-                        with col1:
-                            img_path = st.session_state['activity_images'].get(party['activity_type'], "/api/placeholder/100/100?text=Activity")
-                            st.image(img_path, width=150)
-                        
-                        with col2:
-                            st.markdown(f"**Activity:** {party['activity_type']}")
-                            st.markdown(f"**Date:** {party['date'].strftime('%d/%m/%Y')}")
-                            st.markdown(f"**Time:** {party['start_time'].strftime('%H:%M')} - {party['end_time'].strftime('%H:%M')}")
-                            st.markdown(f"**Location:** {party['location']}")
-                            st.markdown(f"**Participants:** {party['current_participants']}/{party['max_participants']}")
-                            st.markdown(f"**Cost:** ${party['cost_per_person']:.2f} per person")
-                            st.markdown(f"**Description:** {party['description']}")
-                            
-                            if st.button("Edit Party", key=f"edit_{party['id']}"):
-                                st.info("Edit functionality would be implemented here")
-                            
-                            if st.button("Cancel Party", key=f"cancel_{party['id']}"):
-                                st.warning("This would cancel the party and notify all participants")
-                            
-                            st.markdown("---")
-                            st.markdown("### Participants")
-                            
-                            # Show participants list
-                            participant_names = []
-                            for p_id in party['participants']:
-                                participant = next((u for u in st.session_state['users'] if u['id'] == p_id), None)
-                                if participant:
-                                    participant_names.append(participant['name'])
-                            
-                            for name in participant_names:
-                                st.markdown(f"- {name}")
+                    created_party_card(party['id'])
         
         with tabs[2]:
+            upcoming = get_catalog().user_schedule(user_id, start=datetime.datetime.now())
+            if not upcoming:
+                st.info("You have no upcoming parties.")
+            else:
+                schedule = pd.DataFrame([
+                    {
+                        "Date": party['date'].strftime('%a %d/%m/%Y'),
+                        "Time": f"{party['start_time'].strftime('%H:%M')} - {party['end_time'].strftime('%H:%M')}",
+                        "Party": party['name'],
+                        "Activity": party['activity_type'],
+                        "Location": party['location']
+                    }
+                    for party in upcoming
+                ])
+                st.dataframe(schedule)
+        
+        with tabs[3]:
             st.info("Past parties would be displayed here")
             st.markdown("This would show a history of activities you've participated in")
     
@@ -637,7 +769,7 @@ def main():
             
             with col1:
                 party_name = st.text_input("Party Name")
-                activity_type = st.selectbox("Activity Type", st.session_state['activity_types'])
+                activity_type = st.selectbox("Activity Type", get_catalog().activity_types)
                 party_date = st.date_input("Date", value=datetime.datetime.now().date() + datetime.timedelta(days=1))
             
             with col2:
@@ -645,14 +777,24 @@ def main():
                 end_time = st.time_input("End Time", value=datetime.time(20, 0))
                 max_participants = st.number_input("Maximum Participants", min_value=2, max_value=50, value=10)
             
-            # Filter venues based on selected activity type
-            suitable_venues = [v for v in st.session_state['venues'] if activity_type in v['activity_types']]
-            venue_options = [(v['id'], v['name']) for v in suitable_venues]
+            # Only venues that are open and free for the chosen time can be
+            # booked; when the user can be placed, the nearest of those,
+            # nearest first
+            point = get_catalog().locate(st.session_state['current_user']['location'])
+            suitable_venues = get_catalog().venue_costs.venues_for(activity_type)
+            bookable_venues = get_catalog().bookable_venues(
+                activity_type, party_date, start_time, end_time, point, NEAREST_VENUES if point else None
+            )
+            venue_options = [(v['id'], v['name']) for v in bookable_venues]
             
             if not venue_options:
-                st.warning(f"No suitable venues found for {activity_type}")
+                if suitable_venues:
+                    st.warning(f"No {activity_type} venues are available at that time")
+                else:
+                    st.warning(f"No suitable venues found for {activity_type}")
                 location = st.text_input("Custom Location")
                 venue_cost = 0
+                venue_quote = {"cost_per_person": 0}
             else:
                 selected_venue = st.selectbox(
                     "Select Venue",
@@ -661,27 +803,23 @@ def main():
                 )
                 
                 # Get venue details
-                venue = next((v for v in st.session_state['venues'] if v['id'] == selected_venue[0]), None)
+                venue = get_catalog().venue_costs.get(selected_venue[0])
                 location = venue['name']
+                venue_quote = get_catalog().venue_costs.quote(venue['id'], start_time, end_time, max_participants)
                 
-                if 'cost_per_hour' in venue and venue['cost_per_hour'] > 0:
-                    hours = (datetime.datetime.combine(datetime.date.today(), end_time) - 
-                            datetime.datetime.combine(datetime.date.today(), start_time)).seconds / 3600
-                    venue_cost = venue['cost_per_hour'] * hours
+                if venue_quote['venue_cost'] is not None:
+                    venue_cost = venue_quote['venue_cost']
                     st.markdown(f"Venue cost: ${venue_cost:.2f} total (${venue['cost_per_hour']:.2f} per hour)")
                 
-                if 'cost_per_person' in venue and venue['cost_per_person'] > 0:
-                    st.markdown(f"Additional cost: ${venue['cost_per_person']:.2f} per person")
-                    person_cost = venue['cost_per_person']
-                else:
-                    person_cost = 0
+                if venue_quote['person_cost'] > 0:
+                    st.markdown(f"Additional cost: ${venue_quote['person_cost']:.2f} per person")
             
             st.subheader("Additional Information")
             description = st.text_area("Description", placeholder="Tell others about your party...")
             
             # Calculate cost per person
             if 'venue_cost' in locals():
-                cost_per_person = person_cost + (venue_cost / max_participants)
+                cost_per_person = venue_quote['cost_per_person']
             else:
                 cost_per_person = st.number_input("Cost per Person ($)", min_value=0.0, value=10.0, step=0.5)
             
@@ -694,7 +832,7 @@ def main():
                     st.error("Please fill in all required fields!")
                 else:
                     new_party = {
-                        "id": len(st.session_state['parties']) + 1,
+                        "id": get_engine().next_id('parties'),
                         "name": party_name,
                         "activity_type": activity_type,
                         "date": party_date,
@@ -707,4 +845,19 @@ def main():
                         "participants": [st.session_state['current_user']['id']],
                         "description": description,
                         "cost_per_person": cost_per_person,
-                        "venue_booked": True if 'venue_cost' in
\ No newline at end of file
+                        "venue_booked": True if 'venue_cost' in locals() else False
+                    }
+                    
+                    success, message = create_party(new_party)
+                    if success:
+                        st.success(message)
+                    else:
+                        st.error(message)
+    
+    # A full run only reaches here after drawing every card on the page; results
+    # for cards that weren't drawn (a party left from My Parties, say) are dropped
+    st.session_state['party_messages'].clear()
+
+# Run the app
+if __name__ == "__main__":
+    main()
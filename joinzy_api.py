@@ -0,0 +1,564 @@
+"""HTTP JSON API over the Joinzy engines, served with asyncio.
+
+A small HTTP/1.1 server on asyncio streams. Connections are kept alive
+between requests, and engine calls that touch SQLite run on a thread pool so
+the event loop never waits on the database. Catalog reads are in memory and
+are answered on the loop.
+
+    GET  /parties?activity_type=Chess&date=2025-03-05&available=1&near=40.75,-73.98&radius_km=5&after=3&limit=20
+    GET  /parties/<id>
+    GET  /parties/<id>/quote?user_id=1&coupon=WELCOME
+    POST /parties/<id>/join          {"user_id": 1}
+    POST /parties/<id>/leave         {"user_id": 1}
+    POST /parties/<id>/waitlist      {"user_id": 1}
+    POST /parties/<id>/waitlist/leave  {"user_id": 1}
+    POST /quotes                     {"party_ids": [1, 2], "user_id": 1, "coupon": "WELCOME"}
+    POST /activities/<id>/book       {"user_id": 1, "coupon": "NEWUSER"}
+    POST /activities/<id>/waitlist   {"user_id": 1, "coupon": "NEWUSER"}
+    POST /bookings/<id>/cancel       {"user_id": 1}
+    POST /users                      {"name": ..., "username": ..., "password": ..., ...}
+    POST /batch                      {"operations": [{"op": "join", "party_id": 1, "user_id": 2}, ...]}
+    GET  /occupancy?kind=party&ids=1,2&topics=Chess,Football     (server-sent events)
+
+A batch runs its operations in order in a single trip to the thread pool
+and answers with one {"status": ..., ...} result per operation. Batch ops
+are join, leave, waitlist, leave_waitlist, book, activity_waitlist,
+cancel_booking, quote and register, taking the same fields as the single
+endpoints.
+
+Users are not shared between the two databases. user_id on /parties,
+/quotes and /users is a user of the party database (POST /users registers
+there); on /activities and /bookings it is a user of the activity
+database, registered through the activity matcher app. Unknown user ids
+are answered with 404.
+
+Waitlists are for full parties and fully booked activities. A place freed
+by a leave or a cancelled booking goes to the next user on the waitlist
+(Premium members first, then in the order they joined) in the same step.
+
+/occupancy streams live slot counts from the engines' OccupancyFeed (see
+joinzy_occupancy) as server-sent events: an "occupancy" event holding a
+JSON list of {"id", "delta", "current", "capacity", "topic"} updates, at
+most one per coalescing window, starting with the current counts of the
+requested ids. kind is party (default) or activity; topics are activity
+types. Only changes made through this process's engines are seen.
+
+The API keeps its own party catalog in memory, so it needs its own party
+database: it can't share one with the Streamlit app (PartyEngine refuses a
+database another process already serves). The activity database holds no
+catalog and may be shared with the activity matcher app.
+
+    python joinzy_api.py --db joinzy_api.db --activities-db activity_matcher.db --port 8080
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import math
+import re
+import traceback
+import urllib.parse
+
+from joinzy_core import BookingEngine, PartyEngine
+from joinzy_occupancy import OccupancyFeed, Subscription
+
+# Default radius of a near= search, in km
+NEAR_KM = 5
+# Seconds an idle keep-alive connection is held open
+KEEP_ALIVE_SECONDS = 15
+MAX_HEADERS = 100
+MAX_BODY_BYTES = 1 << 20
+MAX_BATCH_OPERATIONS = 1000
+# Seconds between comments sent on an idle event stream, so dead clients
+# are noticed and proxies keep the connection open
+HEARTBEAT_SECONDS = 15
+MAX_SUBSCRIBED = 1000
+
+REASONS = {
+    200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    409: "Conflict", 411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error"
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _public_user(user):
+    return {key: value for key, value in user.items() if key != 'password'}
+
+
+def _int(value, field):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise BadRequest(f"{field} must be an integer") from None
+
+
+def _required(body, field):
+    if body.get(field) is None:
+        raise BadRequest(f"{field} is required")
+    return body[field]
+
+
+def _string(body, field, default=""):
+    value = body.get(field, default)
+    if not isinstance(value, str):
+        raise BadRequest(f"{field} must be a string")
+    return value
+
+
+# A coupon code is optional but must be a string when given
+def _coupon(body):
+    coupon = body.get('coupon')
+    if coupon is not None and not isinstance(coupon, str):
+        raise BadRequest("coupon must be a string")
+    return coupon
+
+
+def _strings(body, field):
+    values = body.get(field, [])
+    if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+        raise BadRequest(f"{field} must be a list of strings")
+    return values
+
+
+# Wait for the client to close its side of the connection. Anything it
+# sends meanwhile is read in small chunks and thrown away, so a chatty
+# client can't make the server buffer it.
+async def _until_closed(reader):
+    try:
+        while await reader.read(1024):
+            pass
+    except ConnectionError:
+        pass
+
+
+class JoinzyAPI:
+    def __init__(self, parties, bookings=None, workers=8):
+        self.parties = parties
+        self.bookings = bookings
+        self.occupancy = parties.occupancy
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="joinzy-api")
+        self._routes = [
+            ("GET", re.compile(r"/parties"), self.list_parties),
+            ("GET", re.compile(r"/parties/(\d+)"), self.get_party),
+            ("GET", re.compile(r"/parties/(\d+)/quote"), self.quote_party),
+            ("POST", re.compile(r"/parties/(\d+)/join"), self.join_party),
+            ("POST", re.compile(r"/parties/(\d+)/leave"), self.leave_party),
+            ("POST", re.compile(r"/parties/(\d+)/waitlist"), self.join_waitlist),
+            ("POST", re.compile(r"/parties/(\d+)/waitlist/leave"), self.leave_waitlist),
+            ("POST", re.compile(r"/quotes"), self.quotes),
+            ("POST", re.compile(r"/activities/(\d+)/book"), self.book_activity),
+            ("POST", re.compile(r"/activities/(\d+)/waitlist"), self.join_activity_waitlist),
+            ("POST", re.compile(r"/bookings/(\d+)/cancel"), self.cancel_booking),
+            ("POST", re.compile(r"/users"), self.register),
+            ("POST", re.compile(r"/batch"), self.batch),
+            ("GET", re.compile(r"/occupancy"), self.occupancy_stream),
+        ]
+        self._operations = {
+            "join": self._join,
+            "leave": self._leave,
+            "waitlist": self._wait,
+            "leave_waitlist": self._unwait,
+            "book": self._book,
+            "activity_waitlist": self._wait_activity,
+            "cancel_booking": self._cancel_booking,
+            "quote": self._quote,
+            "register": self._register,
+        }
+
+    def close(self):
+        self._executor.shutdown()
+
+    # Run a blocking engine call on the thread pool
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    # Operations. Each takes a JSON body and returns (status, payload) and
+    # is shared by its endpoint and by /batch.
+    def _join(self, body):
+        party_id = _int(_required(body, 'party_id'), 'party_id')
+        user_id = _int(_required(body, 'user_id'), 'user_id')
+        if self.parties.catalog.get_user(user_id) is None:
+            return 404, {"ok": False, "message": "User not found."}
+        success, message = self.parties.join_party(party_id, user_id)
+        return (200 if success else 409), {"ok": success, "message": message}
+
+    def _leave(self, body):
+        success, message = self.parties.leave_party(_int(_required(body, 'party_id'), 'party_id'), _int(_required(body, 'user_id'), 'user_id'))
+        return (200 if success else 409), {"ok": success, "message": message}
+
+    def _wait(self, body):
+        success, message = self.parties.join_waitlist(_int(_required(body, 'party_id'), 'party_id'), _int(_required(body, 'user_id'), 'user_id'))
+        return (200 if success else 409), {"ok": success, "message": message}
+
+    def _unwait(self, body):
+        left = self.parties.leave_waitlist(_int(_required(body, 'party_id'), 'party_id'), _int(_required(body, 'user_id'), 'user_id'))
+        if not left:
+            return 409, {"ok": False, "message": "You are not on the waitlist."}
+        return 200, {"ok": True, "message": "You have left the waitlist."}
+
+    def _book(self, body):
+        if self.bookings is None:
+            return 404, {"ok": False, "message": "Bookings are not served here."}
+        activity_id = _int(_required(body, 'activity_id'), 'activity_id')
+        user_id = _int(_required(body, 'user_id'), 'user_id')
+        coupon = _coupon(body)
+        if self.bookings.storage.get_user(user_id) is None:
+            return 404, {"ok": False, "message": "User not found."}
+        success, result = self.bookings.book_activity(activity_id, user_id, coupon)
+        if not success:
+            return 409, {"ok": False, "message": result}
+        return 201, {"ok": True, "booking": result}
+
+    def _wait_activity(self, body):
+        if self.bookings is None:
+            return 404, {"ok": False, "message": "Bookings are not served here."}
+        activity_id = _int(_required(body, 'activity_id'), 'activity_id')
+        user_id = _int(_required(body, 'user_id'), 'user_id')
+        coupon = _coupon(body)
+        if self.bookings.storage.get_user(user_id) is None:
+            return 404, {"ok": False, "message": "User not found."}
+        success, message = self.bookings.join_waitlist(activity_id, user_id, coupon)
+        return (200 if success else 409), {"ok": success, "message": message}
+
+    # The booking made for the next waiting user, if any, is returned as
+    # "promoted"
+    def _cancel_booking(self, body):
+        if self.bookings is None:
+            return 404, {"ok": False, "message": "Bookings are not served here."}
+        success, result = self.bookings.cancel_booking(
+            _int(_required(body, 'booking_id'), 'booking_id'),
+            _int(_required(body, 'user_id'), 'user_id')
+        )
+        if not success:
+            return 404, {"ok": False, "message": result}
+        return 200, {"ok": True, "promoted": result}
+
+    def _quote(self, body):
+        party_ids = _required(body, 'party_ids')
+        if not isinstance(party_ids, list):
+            raise BadRequest("party_ids must be a list")
+        party_ids = [_int(party_id, 'party_ids') for party_id in party_ids]
+        user = None
+        if body.get('user_id') is not None:
+            user = self.parties.catalog.get_user(_int(body['user_id'], 'user_id'))
+            if user is None:
+                return 404, {"ok": False, "message": "User not found."}
+        quotes = self.parties.calculate_party_costs(party_ids, user, _coupon(body))
+        return 200, {"ok": True, "quotes": {str(party_id): quote for party_id, quote in quotes.items()}}
+
+    # Every field is type-checked before anything is stored: a malformed
+    # user would break the recommendation encoder when the catalog loads
+    def _register(self, body):
+        if not body.get('name') or not body.get('username') or not body.get('password'):
+            raise BadRequest("name, username and password are required")
+        age = body.get('age', 25)
+        if not isinstance(age, int) or isinstance(age, bool):
+            raise BadRequest("age must be an integer")
+        user_data = {
+            "name": _string(body, 'name'),
+            "age": age,
+            "phone": _string(body, 'phone'),
+            "gender": _string(body, 'gender', "Prefer not to say"),
+            "username": _string(body, 'username'),
+            "password": _string(body, 'password'),
+            "activities_pref": _strings(body, 'activities_pref'),
+            "preferred_days": _strings(body, 'preferred_days'),
+            "preferred_times": _strings(body, 'preferred_times'),
+            "location": _string(body, 'location'),
+            "joined_date": datetime.datetime.now(),
+            "membership_status": "Basic"
+        }
+        user_data = {"id": self.parties.next_id('users'), **user_data}
+        if not self.parties.register_user(user_data):
+            return 409, {"ok": False, "message": "Username already exists."}
+        return 201, {"ok": True, "user": _public_user(user_data)}
+
+    # An operation that fails unexpectedly is recorded as a 500 result and
+    # the batch goes on, so the client still learns which earlier operations
+    # were committed
+    def _batch(self, operations):
+        results = []
+        for operation in operations:
+            action = self._operations.get(operation.get('op')) if isinstance(operation, dict) else None
+            try:
+                if action is None:
+                    raise BadRequest("op must be one of " + ", ".join(self._operations))
+                status, payload = action(operation)
+            except BadRequest as error:
+                status, payload = 400, {"ok": False, "message": str(error)}
+            except Exception:
+                traceback.print_exc()
+                status, payload = 500, {"ok": False, "message": "Internal server error."}
+            results.append(dict(payload, status=status))
+        return results
+
+    # Endpoints
+    async def list_parties(self, request):
+        query = request['query']
+        filters = {
+            "activity_type": query.get('activity_type'),
+            "date": None,
+            "available": query.get('available', "0").lower() in ("1", "true", "yes"),
+            "near": None
+        }
+        try:
+            if query.get('date'):
+                filters['date'] = datetime.date.fromisoformat(query['date'])
+            if query.get('near'):
+                lat, lon = (float(part) for part in query['near'].split(","))
+                filters['near'] = (lat, lon, float(query.get('radius_km', NEAR_KM)))
+        except ValueError:
+            raise BadRequest("date must be YYYY-MM-DD and near must be lat,lon") from None
+        if filters['near'] and not all(math.isfinite(value) for value in filters['near']):
+            raise BadRequest("near and radius_km must be finite numbers")
+        after = _int(query['after'], 'after') if query.get('after') else None
+        limit = _int(query.get('limit', 50), 'limit')
+        catalog = self.parties.catalog
+        parties = catalog.find_parties(**filters, after=after, limit=max(1, min(limit, 500)))
+        return 200, {"total": catalog.count_parties(**filters), "parties": parties}
+
+    async def get_party(self, request, party_id):
+        party = self.parties.catalog.get_party(int(party_id))
+        if party is None:
+            return 404, {"ok": False, "message": "Party not found."}
+        return 200, party
+
+    async def quote_party(self, request, party_id):
+        party_id = _int(party_id, 'party_id')
+        body = {"party_ids": [party_id], "user_id": request['query'].get('user_id'), "coupon": request['query'].get('coupon')}
+        status, payload = self._quote(body)
+        if status == 200 and str(party_id) not in payload['quotes']:
+            return 404, {"ok": False, "message": "Party not found."}
+        return status, payload
+
+    async def join_party(self, request, party_id):
+        return await self._run(self._join, dict(request['body'], party_id=party_id))
+
+    async def leave_party(self, request, party_id):
+        return await self._run(self._leave, dict(request['body'], party_id=party_id))
+
+    async def join_waitlist(self, request, party_id):
+        return await self._run(self._wait, dict(request['body'], party_id=party_id))
+
+    async def leave_waitlist(self, request, party_id):
+        return await self._run(self._unwait, dict(request['body'], party_id=party_id))
+
+    async def quotes(self, request):
+        return self._quote(request['body'])
+
+    async def book_activity(self, request, activity_id):
+        return await self._run(self._book, dict(request['body'], activity_id=activity_id))
+
+    async def join_activity_waitlist(self, request, activity_id):
+        return await self._run(self._wait_activity, dict(request['body'], activity_id=activity_id))
+
+    async def cancel_booking(self, request, booking_id):
+        return await self._run(self._cancel_booking, dict(request['body'], booking_id=booking_id))
+
+    async def register(self, request):
+        return await self._run(self._register, request['body'])
+
+    async def batch(self, request):
+        operations = request['body'].get('operations')
+        if not isinstance(operations, list):
+            raise BadRequest("operations must be a list")
+        if len(operations) > MAX_BATCH_OPERATIONS:
+            raise BadRequest(f"at most {MAX_BATCH_OPERATIONS} operations per batch")
+        return 200, {"results": await self._run(self._batch, operations)}
+
+    async def occupancy_stream(self, request):
+        if self.occupancy is None:
+            return 404, {"ok": False, "message": "Occupancy is not served here."}
+        query = request['query']
+        kind = query.get('kind', "party")
+        if kind not in ("party", "activity"):
+            raise BadRequest("kind must be party or activity")
+        if not self.occupancy.serves(kind):
+            return 404, {"ok": False, "message": "Occupancy is not served here."}
+        ids = [_int(item_id, 'ids') for item_id in query.get('ids', "").split(",") if item_id.strip()]
+        topics = [topic.strip() for topic in query.get('topics', "").split(",") if topic.strip()]
+        if not ids and not topics:
+            raise BadRequest("ids or topics is required")
+        if len(ids) + len(topics) > MAX_SUBSCRIBED:
+            raise BadRequest(f"at most {MAX_SUBSCRIBED} ids and topics per stream")
+        return 200, self.occupancy.subscribe(kind, ids, topics)
+
+    async def dispatch(self, request):
+        allowed = False
+        for method, pattern, handler in self._routes:
+            match = pattern.fullmatch(request['path'])
+            if match:
+                if method == request['method']:
+                    return await handler(request, *match.groups())
+                allowed = True
+        if allowed:
+            return 405, {"ok": False, "message": "Method not allowed."}
+        return 404, {"ok": False, "message": "Not found."}
+
+    # HTTP
+    # One request from the stream as a dict, or None once the client is done
+    async def _read_request(self, reader):
+        try:
+            line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_SECONDS)
+        except asyncio.TimeoutError:
+            return None
+        if not line.strip():
+            return None
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            raise BadRequest("malformed request line") from None
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise BadRequest("too many headers")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        url = urllib.parse.urlsplit(target)
+        request = {
+            "method": method.upper(),
+            "path": url.path.rstrip("/") or "/",
+            "query": dict(urllib.parse.parse_qsl(url.query)),
+            "headers": headers,
+            "keep_alive": headers.get("connection", "").lower() != "close" if version == "HTTP/1.1"
+            else headers.get("connection", "").lower() == "keep-alive",
+            "body": {}
+        }
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            request['error'] = 411
+            request['keep_alive'] = False
+            return request
+        length = _int(headers.get("content-length", 0), "Content-Length")
+        if length > MAX_BODY_BYTES:
+            request['error'] = 413
+            request['keep_alive'] = False
+            return request
+        if length:
+            try:
+                body = json.loads(await reader.readexactly(length))
+            except ValueError:
+                raise BadRequest("body must be JSON") from None
+            if not isinstance(body, dict):
+                raise BadRequest("body must be a JSON object")
+            request['body'] = body
+        return request
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                # A request that can't be parsed leaves the stream in an
+                # unknown state, so the connection is closed after answering
+                try:
+                    request = await self._read_request(reader)
+                except BadRequest as error:
+                    request = {"keep_alive": False, "error": 400, "message": str(error)}
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                    break
+                if request is None:
+                    break
+                if 'error' in request:
+                    status = request['error']
+                    payload = {"ok": False, "message": request.get('message', REASONS[status])}
+                else:
+                    try:
+                        status, payload = await self.dispatch(request)
+                    except BadRequest as error:
+                        status, payload = 400, {"ok": False, "message": str(error)}
+                    except Exception:
+                        traceback.print_exc()
+                        status, payload = 500, {"ok": False, "message": "Internal server error."}
+                if isinstance(payload, Subscription):
+                    await self._stream(reader, writer, payload)
+                    break
+                body = json.dumps(payload, default=_json_default).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if request['keep_alive'] else 'close'}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+                if not request['keep_alive']:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # Send a subscription's updates as server-sent events until the client
+    # goes away. Clients send nothing more on the connection, so the end of
+    # its input is the hang-up, which frees the subscription at once.
+    async def _stream(self, reader, writer, subscription):
+        hang_up = asyncio.ensure_future(_until_closed(reader))
+        try:
+            async with subscription:
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: text/event-stream\r\n"
+                    b"Cache-Control: no-cache\r\n"
+                    b"Connection: keep-alive\r\n\r\n"
+                )
+                batch = await subscription.snapshot()
+                while True:
+                    if batch:
+                        writer.write(b"event: occupancy\ndata: " + json.dumps(batch).encode() + b"\n\n")
+                    else:
+                        writer.write(b": keep-alive\n\n")
+                    await writer.drain()
+                    next_batch = asyncio.ensure_future(subscription.next_batch(HEARTBEAT_SECONDS))
+                    await asyncio.wait((next_batch, hang_up), return_when=asyncio.FIRST_COMPLETED)
+                    if hang_up.done():
+                        next_batch.cancel()
+                        return
+                    batch = next_batch.result()
+        finally:
+            hang_up.cancel()
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Joinzy engines as an HTTP JSON API.")
+    parser.add_argument("--db", default="joinzy_api.db", help="party database; not shared with the Streamlit app")
+    parser.add_argument("--activities-db", default=None, help="activity matcher database for /activities/<id>/book")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=8, help="threads for storage calls")
+    args = parser.parse_args()
+
+    occupancy = OccupancyFeed()
+    parties = PartyEngine.open(args.db, occupancy=occupancy)
+    bookings = BookingEngine.open(args.activities_db, occupancy=occupancy) if args.activities_db else None
+    api = JoinzyAPI(parties, bookings, workers=args.workers)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(api.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.close()
+        parties.close()
+        if bookings:
+            bookings.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Venue availability calendar built on bitsets of fixed-size time slots.
+
+A day is split into SLOT_MINUTES slots and each venue keeps one integer per
+date whose set bits are the booked slots. A booking is checked against a
+two-day window (its date and the next), so parties running past midnight
+and opening hours like "16:00-02:00" need no special cases: a venue is free
+when the booking's bits are all inside the opening hours and none of them
+is already set.
+"""
+
+import datetime
+import threading
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+FULL_DAY = (1 << SLOTS_PER_DAY) - 1
+
+
+def _slot(time, round_up=False):
+    minutes = time.hour * 60 + time.minute + (time.second > 0 or time.microsecond > 0)
+    if round_up:
+        return -(-minutes // SLOT_MINUTES)
+    return minutes // SLOT_MINUTES
+
+
+# Bits for start_time up to end_time over a two-day window; an end at or
+# before the start runs into the next day
+def span_mask(start_time, end_time):
+    start = _slot(start_time)
+    end = _slot(end_time, round_up=True)
+    if end <= start:
+        end += SLOTS_PER_DAY
+    return ((1 << (end - start)) - 1) << start
+
+
+# Daily opening hours as a one-day mask; spans past midnight wrap around
+def opening_mask(available_hours):
+    if not available_hours:
+        return FULL_DAY
+    mask = 0
+    for hours in available_hours:
+        start, end = (datetime.time.fromisoformat(part.strip()) for part in hours.split("-"))
+        span = span_mask(start, end)
+        mask |= (span | span >> SLOTS_PER_DAY) & FULL_DAY
+    return mask
+
+
+class VenueCalendar:
+    def __init__(self, venues=()):
+        self._lock = threading.Lock()
+        self._open = {}
+        self._booked = {}
+        self._bookings = {}
+        for venue in venues:
+            open_slots = opening_mask(venue.get('available_hours'))
+            self._open[venue['id']] = open_slots | open_slots << SLOTS_PER_DAY
+
+    def _window(self, venue_id, date):
+        next_day = date + datetime.timedelta(days=1)
+        return self._booked.get((venue_id, date), 0) | self._booked.get((venue_id, next_day), 0) << SLOTS_PER_DAY
+
+    def _is_free(self, venue_id, date, span):
+        open_slots = self._open.get(venue_id)
+        if open_slots is None:
+            return False
+        return span & ~open_slots == 0 and span & self._window(venue_id, date) == 0
+
+    def is_free(self, venue_id, date, start_time, end_time):
+        with self._lock:
+            return self._is_free(venue_id, date, span_mask(start_time, end_time))
+
+    # The venues among venue_ids that can take a booking, in the given order
+    def free_venues(self, venue_ids, date, start_time, end_time):
+        span = span_mask(start_time, end_time)
+        with self._lock:
+            return [venue_id for venue_id in venue_ids if self._is_free(venue_id, date, span)]
+
+    # Check and book in one step. check_hours=False skips the opening-hours
+    # check (for bookings made before hours were enforced); clashes are
+    # always refused.
+    def book(self, booking_id, venue_id, date, start_time, end_time, check_hours=True):
+        span = span_mask(start_time, end_time)
+        with self._lock:
+            if booking_id in self._bookings or venue_id not in self._open:
+                return False
+            if span & self._window(venue_id, date):
+                return False
+            if check_hours and span & ~self._open[venue_id]:
+                return False
+            next_day = date + datetime.timedelta(days=1)
+            for day, bits in ((date, span & FULL_DAY), (next_day, span >> SLOTS_PER_DAY)):
+                if bits:
+                    self._booked[(venue_id, day)] = self._booked.get((venue_id, day), 0) | bits
+            self._bookings[booking_id] = (venue_id, date, span)
+            return True
+
+    def release(self, booking_id):
+        with self._lock:
+            booking = self._bookings.pop(booking_id, None)
+            if booking is None:
+                return
+            venue_id, date, span = booking
+            next_day = date + datetime.timedelta(days=1)
+            for day, bits in ((date, span & FULL_DAY), (next_day, span >> SLOTS_PER_DAY)):
+                if bits:
+                    booked = self._booked.get((venue_id, day), 0) & ~bits
+                    if booked:
+                        self._booked[(venue_id, day)] = booked
+                    else:
+                        self._booked.pop((venue_id, day), None)
@@ -0,0 +1,926 @@
+"""Streamlit-free core of the Joinzy apps.
+
+The engines hold all shared state and take users and ids as explicit
+arguments, so the same code backs the Streamlit scripts, worker processes,
+load tests and batch jobs:
+
+    engine = PartyEngine.open("joinzy.db")
+    user = engine.login("johnd", "password")
+    success, message = engine.join_party(2, user['id'])
+
+Engine covers accounts and parties kept only in storage, PartyEngine adds
+the in-memory Catalog (indexes, venue calendar, schedules, pricing) of the
+party platform, and BookingEngine prices and books vendor activities.
+Given a joinzy_occupancy.OccupancyFeed, the engines publish every change in
+a party's or activity's taken slots to it.
+
+A PartyEngine answers from its catalog, which is loaded once and never sees
+writes made by other processes. It therefore claims its database for the
+life of the engine, and a second PartyEngine on the same file (the API and
+the Streamlit app, say) fails to open. Give each process its own database.
+"""
+
+import copy
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on this platform; a database is then not claimed
+    fcntl = None
+
+from joinzy_calendar import VenueCalendar
+from joinzy_geo import GridIndex, geocode
+from joinzy_index import PartyFilterIndex, ScheduleIndex, Waitlist
+from joinzy_pricing import PricingEngine, VenueCostService
+from joinzy_recommend import RecommendationCache, venue_areas
+from joinzy_storage import SQLiteStorage
+
+ACTIVITY_TYPES = [
+    "Football", "Basketball", "Volleyball", "Tennis", "Badminton",
+    "Board Games", "Chess", "Card Games", "Role-Playing Games"
+]
+
+PARTY_PRICING_RULES = [
+    {
+        "kind": "coupon",
+        "rates": {
+            "WELCOME": 0.15,  # 15% off
+            "WEEKEND": 0.10,  # 10% off
+            "PREMIUM": 0.20   # 20% off for premium members
+        }
+    },
+    # Premium members get 10% off, unless their coupon is worth more
+    {"kind": "membership", "rates": {"Premium": 0.10}}
+]
+
+BOOKING_PRICING_RULES = [
+    {
+        "kind": "coupon",
+        "rates": {
+            "NEWUSER": 0.15,  # 15% off
+            "WEEKEND": 0.10,  # 10% off
+            "MEMBER2024": 0.20  # 20% off
+        }
+    }
+]
+
+# Membership tiers whose waitlist entries are promoted before everyone else's
+WAITLIST_PRIORITY = ("Premium",)
+
+
+# In a real app, these would be proper image paths
+ACTIVITY_IMAGES = {
+    "Football": "/api/placeholder/100/100?text=Football",
+    "Basketball": "/api/placeholder/100/100?text=Basketball",
+    "Volleyball": "/api/placeholder/100/100?text=Volleyball",
+    "Tennis": "/api/placeholder/100/100?text=Tennis",
+    "Badminton": "/api/placeholder/100/100?text=Badminton",
+    "Board Games": "/api/placeholder/100/100?text=Board+Games",
+    "Chess": "/api/placeholder/100/100?text=Chess",
+    "Card Games": "/api/placeholder/100/100?text=Card+Games",
+    "Role-Playing Games": "/api/placeholder/100/100?text=RPGs"
+}
+
+
+# Repository holding users and parties keyed by id, with secondary
+# indexes so lookups don't have to scan every record
+class Repository:
+    def __init__(self, users=(), parties=()):
+        self.users_by_id = {}
+        self.user_id_by_username = {}
+        self.parties_by_id = {}
+        self.party_ids_by_creator = {}
+        self.party_ids_by_participant = {}
+        for user in users:
+            self.add_user(user)
+        for party in parties:
+            self.add_party(party)
+
+    # Users
+    def get_user(self, user_id):
+        return self.users_by_id.get(user_id)
+
+    def get_users(self, user_ids):
+        return {user_id: self.users_by_id[user_id] for user_id in user_ids if user_id in self.users_by_id}
+
+    def get_user_by_username(self, username):
+        user_id = self.user_id_by_username.get(username)
+        return self.users_by_id.get(user_id) if user_id is not None else None
+
+    def username_taken(self, username):
+        return username in self.user_id_by_username
+
+    def list_users(self):
+        return list(self.users_by_id.values())
+
+    def add_user(self, user):
+        if user['username'] in self.user_id_by_username:
+            return False
+        self.users_by_id[user['id']] = user
+        self.user_id_by_username[user['username']] = user['id']
+        return True
+
+    def update_user(self, user_id, **fields):
+        user = self.users_by_id.get(user_id)
+        if not user:
+            return None
+        new_username = fields.get('username', user['username'])
+        if new_username != user['username']:
+            if new_username in self.user_id_by_username:
+                return None
+            del self.user_id_by_username[user['username']]
+            self.user_id_by_username[new_username] = user_id
+        user = dict(user, **fields)
+        self.users_by_id[user_id] = user
+        return user
+
+    def delete_user(self, user_id):
+        user = self.users_by_id.pop(user_id, None)
+        if not user:
+            return False
+        del self.user_id_by_username[user['username']]
+        return True
+
+    # Parties
+    def get_party(self, party_id):
+        return self.parties_by_id.get(party_id)
+
+    def list_parties(self):
+        return list(self.parties_by_id.values())
+
+    def parties_created_by(self, user_id):
+        return [self.parties_by_id[p_id] for p_id in list(self.party_ids_by_creator.get(user_id, ()))]
+
+    def parties_joined_by(self, user_id):
+        return [self.parties_by_id[p_id] for p_id in list(self.party_ids_by_participant.get(user_id, ()))]
+
+    def add_party(self, party):
+        self.parties_by_id[party['id']] = party
+        self.party_ids_by_creator.setdefault(party['creator_id'], {})[party['id']] = None
+        for user_id in party['participants']:
+            self.party_ids_by_participant.setdefault(user_id, {})[party['id']] = None
+
+    def delete_party(self, party_id):
+        party = self.parties_by_id.pop(party_id, None)
+        if not party:
+            return False
+        self.party_ids_by_creator.get(party['creator_id'], {}).pop(party_id, None)
+        for user_id in party['participants']:
+            self.party_ids_by_participant.get(user_id, {}).pop(party_id, None)
+        return True
+
+    # Participant changes publish a new party record instead of mutating the
+    # shared one, so a reader sees the participant list and count change together
+    def add_participant(self, party_id, user_id):
+        party = self.parties_by_id[party_id]
+        self.parties_by_id[party_id] = dict(
+            party,
+            participants=party['participants'] + [user_id],
+            current_participants=party['current_participants'] + 1
+        )
+        self.party_ids_by_participant.setdefault(user_id, {})[party_id] = None
+
+    # Hand a participant's place to another user in one published record
+    def replace_participant(self, party_id, user_id, new_user_id):
+        party = self.parties_by_id[party_id]
+        self.parties_by_id[party_id] = dict(
+            party,
+            participants=[p_id for p_id in party['participants'] if p_id != user_id] + [new_user_id]
+        )
+        self.party_ids_by_participant.get(user_id, {}).pop(party_id, None)
+        self.party_ids_by_participant.setdefault(new_user_id, {})[party_id] = None
+
+    def remove_participant(self, party_id, user_id):
+        party = self.parties_by_id[party_id]
+        self.parties_by_id[party_id] = dict(
+            party,
+            participants=[p_id for p_id in party['participants'] if p_id != user_id],
+            current_participants=party['current_participants'] - 1
+        )
+        self.party_ids_by_participant.get(user_id, {}).pop(party_id, None)
+
+
+# Fixed pool of locks shared out by key, so each party gets its own lock
+# without allocating one per party or funnelling everything through one
+class LockStripes:
+    def __init__(self, size=64):
+        self._locks = [threading.Lock() for _ in range(size)]
+
+    def lock_for(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+
+# Process-wide catalog shared by every session. Adding users and parties
+# happens under the catalog lock; joining and leaving only take the party's
+# stripe lock. Records are replaced rather than mutated, so reads need no
+# lock, and they hand out copies so no session keeps a reference into the
+# shared data. Venues, activity types, pricing rules and images are read-only
+# configuration and are shared as-is. Full parties keep a waitlist, and a
+# freed slot goes to the next waiting user under the same party lock.
+class Catalog:
+    def __init__(self, repository, venues, activity_types, pricing, activity_images, waitlist=()):
+        self._lock = threading.Lock()
+        self._party_locks = LockStripes()
+        self._version_lock = threading.Lock()
+        self.version = 0
+        self._repository = repository
+        self._filter_index = PartyFilterIndex(repository.list_parties())
+        self.venues = venues
+        self.activity_types = activity_types
+        self.pricing = pricing
+        self.venue_costs = VenueCostService(venues)
+        self.activity_images = activity_images
+        self._recommendations = RecommendationCache(
+            repository.list_users(),
+            self._filter_index.query(available=True),
+            activity_types,
+            venue_areas(venues)
+        )
+        self._venue_points = {venue['name']: self.venue_costs.point(venue['id']) for venue in venues}
+        self._party_locations = GridIndex()
+        self._venue_ids = {venue['name']: venue['id'] for venue in venues}
+        self._calendar = VenueCalendar(venues)
+        self._schedules = ScheduleIndex()
+        self._waitlist = Waitlist(
+            (party_id, user_id, priority) for party_id, user_id, priority in waitlist
+            if user_id not in (repository.get_party(party_id) or {'participants': ()})['participants']
+        )
+        for party in repository.list_parties():
+            self._locate_party(party)
+            self._book_venue(party, check_hours=False)
+            for user_id in party['participants']:
+                self._schedules.add(user_id, party, check=False)
+
+    # Users
+    def get_user(self, user_id):
+        return _copy_user(self._repository.get_user(user_id))
+
+    # Users for many ids in one pass, keyed by id; unknown ids are left out
+    def get_users(self, user_ids):
+        return {user_id: _copy_user(user) for user_id, user in self._repository.get_users(user_ids).items()}
+
+    def get_user_by_username(self, username):
+        return _copy_user(self._repository.get_user_by_username(username))
+
+    # A user the recommender can't encode is taken out of the repository
+    # again before the error is raised
+    def add_user(self, user):
+        with self._lock:
+            added = self._repository.add_user(copy.deepcopy(user))
+            if added:
+                try:
+                    self._recommendations.add_user(user)
+                except Exception:
+                    self._repository.delete_user(user['id'])
+                    raise
+                self._bump_version()
+            return added
+
+    def update_user(self, user_id, **fields):
+        with self._lock:
+            user = self._repository.update_user(user_id, **copy.deepcopy(fields))
+            if user:
+                self._recommendations.update_user(user)
+                self._bump_version()
+            return _copy_user(user)
+
+    # Parties
+    def get_party(self, party_id):
+        return _copy_party(self._repository.get_party(party_id))
+
+    def list_parties(self):
+        return [_copy_party(party) for party in self._repository.list_parties()]
+
+    def parties_joined_by(self, user_id):
+        return [_copy_party(party) for party in self._repository.parties_joined_by(user_id)]
+
+    def parties_created_by(self, user_id):
+        return [_copy_party(party) for party in self._repository.parties_created_by(user_id)]
+
+    # Parties the user is in, in time order, optionally only those starting
+    # from `start` on
+    def user_schedule(self, user_id, start=None):
+        parties = (self._repository.get_party(party_id) for party_id in self._schedules.schedule(user_id, start))
+        return [_copy_party(party) for party in parties if party]
+
+    # Parties matching the Home page filters, from the inverted index.
+    # `near` is a (latitude, longitude, radius_km) circle the party's
+    # location has to fall in.
+    def find_parties(self, activity_type=None, date=None, available=False, near=None, after=None, limit=None):
+        parties = self._filter_index.query(activity_type, date, available, self._parties_near(near), after, limit)
+        return [_copy_party(party) for party in parties]
+
+    def count_parties(self, activity_type=None, date=None, available=False, near=None):
+        return self._filter_index.count(activity_type, date, available, self._parties_near(near))
+
+    def _parties_near(self, near):
+        if near is None:
+            return None
+        return [party_id for _, party_id in self._party_locations.within(*near)]
+
+    # Locations
+    # Coordinates of a venue name, address or area, or None if unknown
+    def locate(self, place):
+        return self._venue_points.get(place) or geocode(place)
+
+    def _locate_party(self, party):
+        point = self.locate(party['location'])
+        if point:
+            self._party_locations.add(party['id'], *point)
+
+    # Venues
+    # The given venues that are open and not booked for the whole time slot
+    def free_venues(self, venues, date, start_time, end_time):
+        free = set(self._calendar.free_venues([venue['id'] for venue in venues], date, start_time, end_time))
+        return [venue for venue in venues if venue['id'] in free]
+
+    # Up to k venues for an activity type that are free for the time slot,
+    # nearest to near=(latitude, longitude) first when given. The nearest
+    # query is widened until it yields k free venues or runs out, so booked
+    # venues close by never hide free ones further away.
+    def bookable_venues(self, activity_type, date, start_time, end_time, near=None, k=None):
+        if near is None or k is None:
+            venues = self.venue_costs.venues_for(activity_type, near)
+            return self.free_venues(venues, date, start_time, end_time)[:k]
+        count = k
+        while True:
+            nearest = self.venue_costs.venues_for(activity_type, near, count)
+            free = self.free_venues(nearest, date, start_time, end_time)
+            if len(free) >= k or len(nearest) < count:
+                return free[:k]
+            count *= 2
+
+    # Book the party's venue for its time slot. Parties at a custom
+    # location have nothing to book.
+    def book_venue(self, party):
+        return self._book_venue(party)
+
+    def release_venue(self, party_id):
+        self._calendar.release(party_id)
+
+    def _book_venue(self, party, check_hours=True):
+        venue_id = self._venue_ids.get(party['location'])
+        if venue_id is None:
+            return True
+        return self._calendar.book(party['id'], venue_id, party['date'], party['start_time'], party['end_time'], check_hours)
+
+    # Put a new party on its participants' schedules unless it overlaps a
+    # party one of them is already in. All or nothing; returns whether the
+    # party was added.
+    def hold_schedules(self, party):
+        held = []
+        for user_id in party['participants']:
+            if not self._schedules.add(user_id, party):
+                for held_id in held:
+                    self._schedules.remove(held_id, party['id'])
+                return False
+            held.append(user_id)
+        return True
+
+    def release_schedules(self, party):
+        for user_id in party['participants']:
+            self._schedules.remove(user_id, party['id'])
+
+    def add_party(self, party):
+        with self._lock:
+            party = _copy_party(party)
+            self._repository.add_party(party)
+            self._filter_index.add(party)
+            self._locate_party(party)
+            for user_id in party['participants']:
+                self._schedules.add(user_id, party, check=False)
+            if _has_free_slots(party):
+                self._recommendations.add_party(party)
+            self._bump_version()
+
+    def cancel_party(self, party_id):
+        with self._lock, self._party_locks.lock_for(party_id):
+            self._filter_index.remove(party_id)
+            self._party_locations.remove(party_id)
+            self._calendar.release(party_id)
+            self._recommendations.remove_party(party_id)
+            party = self._repository.get_party(party_id)
+            for user_id in party['participants'] if party else ():
+                self._schedules.remove(user_id, party_id)
+            self._waitlist.drop(party_id)
+            deleted = self._repository.delete_party(party_id)
+            self._bump_version()
+            return deleted
+
+    # Open parties that best match the user's preferences, as (party, score)
+    # pairs, read from the precomputed per-user lists
+    def recommend_parties(self, user, k=3):
+        recommendations = []
+        for party_id, score in self._recommendations.recommendations(user['id'], k):
+            party = self._repository.get_party(party_id)
+            if party:
+                recommendations.append((_copy_party(party), score))
+        return recommendations
+
+    # Pricing
+    # Per-person quotes for many parties for one user, keyed by party id;
+    # unknown parties are left out
+    def quote_many(self, party_ids, user=None, coupon=None):
+        parties = [party for party in (self._repository.get_party(party_id) for party_id in party_ids) if party]
+        quotes = self.pricing.quotes(
+            [party['cost_per_person'] for party in parties],
+            coupon=coupon,
+            memberships=user['membership_status'] if user else None,
+            dates=[party['date'] for party in parties],
+            group_sizes=[party['max_participants'] for party in parties]
+        )
+        return {party['id']: quote for party, quote in zip(parties, quotes)}
+
+    # Per-person quotes for one party for many users, keyed by user id
+    def quote_attendees(self, party_id, users, coupon=None):
+        party = self._repository.get_party(party_id)
+        if not party:
+            return {}
+        users = list(users)
+        quotes = self.pricing.quotes(
+            [party['cost_per_person']] * len(users),
+            coupon=coupon,
+            memberships=[user['membership_status'] for user in users],
+            dates=party['date'],
+            group_sizes=party['max_participants']
+        )
+        return {user['id']: quote for user, quote in zip(users, quotes)}
+
+    # Re-file a party after a join or leave. Recommendations only cover open
+    # parties, so the party leaves or re-enters them when it fills up or reopens.
+    def _refresh_party(self, old_party):
+        party = self._repository.get_party(old_party['id'])
+        self._filter_index.update(party)
+        if _has_free_slots(party) and not _has_free_slots(old_party):
+            self._recommendations.add_party(party)
+        elif not _has_free_slots(party) and _has_free_slots(old_party):
+            self._recommendations.remove_party(party['id'])
+
+    # Every change to users or parties moves the version on, so views cached
+    # under an older version are no longer looked up
+    def _bump_version(self):
+        with self._version_lock:
+            self.version += 1
+
+    # Check capacity and claim a slot as one step under the party's lock
+    def reserve_slot(self, party_id, user_id):
+        with self._party_locks.lock_for(party_id):
+            party = self._repository.get_party(party_id)
+            if not party:
+                return False, "Party not found."
+            if self._repository.get_user(user_id) is None:
+                return False, "User not found."
+            if party['current_participants'] >= party['max_participants']:
+                return False, "Party is already full."
+            if user_id in party['participants']:
+                return False, "You are already in this party."
+            if not self._schedules.add(user_id, party):
+                return False, "You have already joined another party at that time."
+            self._repository.add_participant(party_id, user_id)
+            self._recommendations.user_joined(user_id, party_id)
+            self._refresh_party(party)
+            self._bump_version()
+            return True, "Successfully joined the party!"
+
+    def release_slot(self, party_id, user_id):
+        with self._party_locks.lock_for(party_id):
+            party = self._repository.get_party(party_id)
+            if not party:
+                return False, "Party not found."
+            if user_id not in party['participants']:
+                return False, "You are not in this party."
+            self._repository.remove_participant(party_id, user_id)
+            self._schedules.remove(user_id, party_id)
+            self._recommendations.user_left(user_id, party_id)
+            self._refresh_party(party)
+            self._bump_version()
+            return True, "Successfully left the party."
+
+    # Waitlists
+    # Queue a user for a full party; priority users are promoted first
+    def join_waitlist(self, party_id, user_id, priority=False):
+        with self._party_locks.lock_for(party_id):
+            party = self._repository.get_party(party_id)
+            if not party:
+                return False, "Party not found."
+            if user_id in party['participants']:
+                return False, "You are already in this party."
+            if _has_free_slots(party):
+                return False, "The party still has free slots."
+            if self._schedules.overlapping(user_id, party) is not None:
+                return False, "You have already joined another party at that time."
+            if not self._waitlist.add(party_id, user_id, priority):
+                return False, "You are already on the waitlist."
+            self._bump_version()
+            return True, "You are on the waitlist and will join when a place frees up."
+
+    def leave_waitlist(self, party_id, user_id):
+        with self._party_locks.lock_for(party_id):
+            removed = self._waitlist.remove(party_id, user_id)
+            if removed:
+                self._bump_version()
+            return removed
+
+    def waitlist_position(self, party_id, user_id):
+        return self._waitlist.position(party_id, user_id)
+
+    # (party, position) for every party the user is waiting for
+    def waitlisted_parties(self, user_id):
+        waitlisted = []
+        for party_id in self._waitlist.parties_waited_by(user_id):
+            party = self._repository.get_party(party_id)
+            position = self._waitlist.position(party_id, user_id)
+            if party and position:
+                waitlisted.append((_copy_party(party), position))
+        return waitlisted
+
+    # Leave a party and, in the same step under the party's lock, give the
+    # place to the next waiting user. Waiters who have since joined another
+    # party at the same time are dropped from the queue on the way.
+    # Returns (success, message, promoted, dropped), where promoted is the
+    # (user_id, priority) pair that took the place or None, and dropped the
+    # pairs taken off the queue without one.
+    def leave(self, party_id, user_id):
+        with self._party_locks.lock_for(party_id):
+            party = self._repository.get_party(party_id)
+            if not party:
+                return False, "Party not found.", None, []
+            if user_id not in party['participants']:
+                return False, "You are not in this party.", None, []
+            promoted, dropped = None, []
+            while promoted is None:
+                waiter = self._waitlist.pop(party_id)
+                if waiter is None:
+                    break
+                if self._schedules.add(waiter[0], party):
+                    promoted = waiter
+                else:
+                    dropped.append(waiter)
+            self._schedules.remove(user_id, party_id)
+            self._recommendations.user_left(user_id, party_id)
+            if promoted is None:
+                self._repository.remove_participant(party_id, user_id)
+            else:
+                self._repository.replace_participant(party_id, user_id, promoted[0])
+                self._recommendations.user_joined(promoted[0], party_id)
+            self._refresh_party(party)
+            self._bump_version()
+            return True, "Successfully left the party.", promoted, dropped
+
+    # Undo leave() after storage refused it: the leaver gets their place
+    # back and the promoted and dropped users return to the front of the queue
+    def undo_leave(self, party_id, user_id, promoted, dropped):
+        with self._party_locks.lock_for(party_id):
+            party = self._repository.get_party(party_id)
+            if not party:
+                return
+            if promoted is None:
+                self._repository.add_participant(party_id, user_id)
+            else:
+                self._repository.replace_participant(party_id, promoted[0], user_id)
+                self._schedules.remove(promoted[0], party_id)
+                self._recommendations.user_left(promoted[0], party_id)
+            self._schedules.add(user_id, party, check=False)
+            self._recommendations.user_joined(user_id, party_id)
+            for waiter_id, priority in reversed(dropped + [promoted] if promoted else dropped):
+                self._waitlist.push_front(party_id, waiter_id, priority)
+            self._refresh_party(party)
+            self._bump_version()
+
+
+def _copy_user(user):
+    return copy.deepcopy(user) if user else None
+
+
+def _has_free_slots(party):
+    return party['current_participants'] < party['max_participants']
+
+
+def _copy_party(party):
+    if not party:
+        return None
+    party = dict(party)
+    party['participants'] = list(party['participants'])
+    return party
+
+
+def _party_occupancy(party):
+    return {"current": party['current_participants'], "capacity": party['max_participants'], "topic": party['activity_type']}
+
+
+# Accounts and parties kept only in storage. The base for the other engines
+# and enough on its own for apps without an in-memory catalog.
+class Engine:
+    def __init__(self, storage, occupancy=None):
+        self.storage = storage
+        self.occupancy = occupancy
+        if occupancy is not None:
+            self._register_occupancy(occupancy)
+
+    # Open (and if empty, seed) the database at path; seed is a function
+    # taking the storage
+    @classmethod
+    def open(cls, path, seed=None, **kwargs):
+        storage = SQLiteStorage(path)
+        try:
+            if seed and storage.is_empty():
+                seed(storage)
+            return cls(storage, **kwargs)
+        except Exception:
+            storage.close()
+            raise
+
+    def close(self):
+        self.storage.close()
+
+    def next_id(self, name):
+        return self.storage.ids.next_id(name)
+
+    # Accounts
+    def get_user_by_username(self, username):
+        return self.storage.get_user_by_username(username)
+
+    # The user if the password matches, otherwise None
+    def login(self, username, password):
+        user = self.get_user_by_username(username)
+        if user and user['password'] == password:
+            return user
+        return None
+
+    # Storage rejects usernames that already exist
+    def register_user(self, user_data):
+        return self.storage.register_user(user_data)
+
+    # The updated user, or None for an unknown id or a taken username
+    def update_user(self, user_id, **fields):
+        user = self.storage.get_user(user_id)
+        if not user:
+            return None
+        user = dict(user, **fields)
+        return user if self.storage.update_user(user) else None
+
+    # Parties
+    def create_party(self, party_data):
+        self.storage.create_party(party_data)
+        return True, "Party created successfully!"
+
+    def join_party(self, party_id, user_id):
+        success, message = self.storage.join_party(party_id, user_id)
+        if success:
+            self._publish("party", party_id, self._party_topic(party_id), 1)
+        return success, message
+
+    def leave_party(self, party_id, user_id):
+        success, message = self.storage.leave_party(party_id, user_id)
+        if success:
+            self._publish("party", party_id, self._party_topic(party_id), -1)
+        return success, message
+
+    def cancel_party(self, party_id):
+        party = self.storage.get_party(party_id) if self.occupancy is not None else None
+        cancelled = self.storage.cancel_party(party_id)
+        if cancelled and party:
+            self._publish("party", party_id, party['activity_type'], -party['current_participants'])
+        return cancelled
+
+    # Occupancy
+    def _register_occupancy(self, occupancy):
+        occupancy.register_source("party", self._party_occupancy)
+
+    def _publish(self, kind, item_id, topic, delta):
+        if self.occupancy is not None and topic is not None:
+            self.occupancy.publish(kind, item_id, topic, delta)
+
+    def _party_topic(self, party_id):
+        if self.occupancy is None:
+            return None
+        party = self.storage.get_party(party_id)
+        return party['activity_type'] if party else None
+
+    def _party_occupancy(self, party_ids):
+        parties = (self.storage.get_party(party_id) for party_id in party_ids)
+        return {party['id']: _party_occupancy(party) for party in parties if party}
+
+
+# Claim a database for the one process whose catalog serves it. The lock is
+# held until the returned file is closed, or the process exits.
+def _claim_database(path):
+    if fcntl is None or path == ":memory:":
+        return None
+    claim = open(path + "-lock", "w")
+    try:
+        fcntl.flock(claim, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        claim.close()
+        raise RuntimeError(
+            f"{path} is already served by another PartyEngine; each process with a catalog needs its own database"
+        ) from None
+    return claim
+
+
+# The party platform: storage plus the shared in-memory Catalog. Every
+# change is checked and applied in the catalog first and then stored; a
+# storage failure rolls the catalog back.
+class PartyEngine(Engine):
+    def __init__(self, storage, activity_types=ACTIVITY_TYPES, pricing_rules=PARTY_PRICING_RULES, activity_images=ACTIVITY_IMAGES, waitlist_priority=WAITLIST_PRIORITY, occupancy=None):
+        self._claim = _claim_database(storage.path)
+        repository = Repository(storage.list_users(), storage.list_parties())
+        self.catalog = Catalog(
+            repository,
+            storage.list_venues(),
+            list(activity_types),
+            PricingEngine(pricing_rules),
+            dict(activity_images),
+            storage.list_waitlists()
+        )
+        self.waitlist_priority = frozenset(waitlist_priority)
+        super().__init__(storage, occupancy)
+
+    def close(self):
+        super().close()
+        if self._claim is not None:
+            self._claim.close()
+
+    def get_user_by_username(self, username):
+        return self.catalog.get_user_by_username(username)
+
+    # A stored user the catalog then rejects is deleted again, so a bad
+    # record can't stop the next PartyEngine.open from loading
+    def register_user(self, user_data):
+        if not self.storage.register_user(user_data):
+            return False
+        try:
+            added = self.catalog.add_user(user_data)
+        except Exception:
+            self.storage.delete_user(user_data['id'])
+            raise
+        if not added:
+            self.storage.delete_user(user_data['id'])
+        return added
+
+    def update_user(self, user_id, **fields):
+        user = self.catalog.update_user(user_id, **fields)
+        if user:
+            self.storage.update_user(user)
+        return user
+
+    # The creator is the first participant, so the party must not overlap
+    # one they are already in, just as when joining
+    def create_party(self, party_data):
+        if not self.catalog.hold_schedules(party_data):
+            return False, "You have already joined another party at that time."
+        if not self.catalog.book_venue(party_data):
+            self.catalog.release_schedules(party_data)
+            return False, "The venue is not available at that time."
+        try:
+            self.storage.create_party(party_data)
+        except Exception:
+            self.catalog.release_venue(party_data['id'])
+            self.catalog.release_schedules(party_data)
+            raise
+        self.catalog.add_party(party_data)
+        self._publish("party", party_data['id'], party_data['activity_type'], party_data['current_participants'])
+        return True, f"Party '{party_data['name']}' created successfully!"
+
+    # A user joining a party they were waiting for leaves its waitlist, but
+    # only once the join is stored (storage drops the waiter row in the same
+    # transaction), so a failed join keeps their place in the queue
+    def join_party(self, party_id, user_id):
+        success, message = self.catalog.reserve_slot(party_id, user_id)
+        if success:
+            stored, stored_message = self.storage.join_party(party_id, user_id)
+            if not stored:
+                self.catalog.release_slot(party_id, user_id)
+                return False, stored_message
+            self.catalog.leave_waitlist(party_id, user_id)
+            self._publish("party", party_id, self._party_topic(party_id), 1)
+        return success, message
+
+    # The freed place goes straight to the next user on the waitlist, so the
+    # party only loses a participant when nobody is waiting
+    def leave_party(self, party_id, user_id):
+        success, message, promoted, dropped = self.catalog.leave(party_id, user_id)
+        if success:
+            stored, stored_message = self.storage.leave_party(
+                party_id,
+                user_id,
+                promoted[0] if promoted else None,
+                [waiter_id for waiter_id, _ in dropped]
+            )
+            if not stored:
+                self.catalog.undo_leave(party_id, user_id, promoted, dropped)
+                return False, stored_message
+            if promoted is None:
+                self._publish("party", party_id, self._party_topic(party_id), -1)
+        return success, message
+
+    # Waitlists, for full parties only
+    def join_waitlist(self, party_id, user_id):
+        user = self.catalog.get_user(user_id)
+        if not user:
+            return False, "User not found."
+        priority = user['membership_status'] in self.waitlist_priority
+        success, message = self.catalog.join_waitlist(party_id, user_id, priority)
+        if success and not self.storage.join_waitlist(party_id, user_id, priority):
+            self.catalog.leave_waitlist(party_id, user_id)
+            # A place may have freed up and gone to the user in between
+            party = self.catalog.get_party(party_id)
+            if party and user_id in party['participants']:
+                return True, "A place freed up and you joined the party!"
+            return False, "Party not found."
+        return success, message
+
+    def leave_waitlist(self, party_id, user_id):
+        left = self.catalog.leave_waitlist(party_id, user_id)
+        if left:
+            self.storage.leave_waitlist(party_id, user_id)
+        return left
+
+    def waitlist_position(self, party_id, user_id):
+        return self.catalog.waitlist_position(party_id, user_id)
+
+    # (party, position) for every party the user is waiting for
+    def waitlisted_parties(self, user_id):
+        return self.catalog.waitlisted_parties(user_id)
+
+    def cancel_party(self, party_id):
+        party = self.catalog.get_party(party_id)
+        self.storage.cancel_party(party_id)
+        cancelled = self.catalog.cancel_party(party_id)
+        if cancelled and party:
+            self._publish("party", party_id, party['activity_type'], -party['current_participants'])
+        return cancelled
+
+    # Occupancy is read from the catalog rather than storage
+    def _party_topic(self, party_id):
+        party = self.catalog.get_party(party_id)
+        return party['activity_type'] if party else None
+
+    def _party_occupancy(self, party_ids):
+        parties = (self.catalog.get_party(party_id) for party_id in party_ids)
+        return {party['id']: _party_occupancy(party) for party in parties if party}
+
+    # Per-person quotes for many parties for one user (None for a guest),
+    # keyed by party id
+    def calculate_party_costs(self, party_ids, user=None, apply_coupon=None):
+        return self.catalog.quote_many(party_ids, user, apply_coupon)
+
+    def calculate_party_cost(self, party_id, user=None, apply_coupon=None):
+        return self.calculate_party_costs([party_id], user, apply_coupon).get(party_id)
+
+
+# The vendor booking app: bookings priced by a shared rule engine
+class BookingEngine(Engine):
+    def __init__(self, storage, pricing_rules=BOOKING_PRICING_RULES, waitlist_priority=WAITLIST_PRIORITY, occupancy=None):
+        super().__init__(storage, occupancy)
+        self.pricing = PricingEngine(pricing_rules)
+        self.waitlist_priority = frozenset(waitlist_priority)
+
+    def create_activity(self, activity_data):
+        return self.storage.create_activity(activity_data)
+
+    # (True, booking) or (False, reason)
+    def book_activity(self, activity_id, user_id, coupon_code=None):
+        success, result = self.storage.book_activity(activity_id, user_id, coupon_code, self.pricing)
+        if success and self.occupancy is not None:
+            activity = self.storage.get_activity(activity_id)
+            self._publish("activity", activity_id, activity['type'] if activity else None, 1)
+        return success, result
+
+    # Cancel one of the user's bookings; the slot is booked for the next
+    # user on the activity's waitlist in the same transaction. Returns
+    # (True, promoted booking or None) or (False, reason).
+    def cancel_booking(self, booking_id, user_id):
+        booking = self.storage.get_booking(booking_id) if self.occupancy is not None else None
+        success, promoted = self.storage.cancel_booking(booking_id, user_id, self.pricing)
+        if success and promoted is None and booking:
+            activity = self.storage.get_activity(booking['activity_id'])
+            self._publish("activity", booking['activity_id'], activity['type'] if activity else None, -1)
+        return success, promoted
+
+    # Waitlists, for fully booked activities only. The coupon is applied if
+    # the user is booked from the waitlist later.
+    def join_waitlist(self, activity_id, user_id, coupon_code=None):
+        user = self.storage.get_user(user_id)
+        if not user:
+            return False, "User not found."
+        priority = user['membership_status'] in self.waitlist_priority
+        return self.storage.join_activity_waitlist(activity_id, user_id, coupon_code, priority)
+
+    def leave_waitlist(self, activity_id, user_id):
+        return self.storage.leave_activity_waitlist(activity_id, user_id)
+
+    def waitlisted_activities(self, user_id):
+        return self.storage.activity_waitlist_for(user_id)
+
+    # Only activities: this engine's storage is not where parties live
+    def _register_occupancy(self, occupancy):
+        occupancy.register_source("activity", self._activity_occupancy)
+
+    def _activity_occupancy(self, activity_ids):
+        activities = (self.storage.get_activity(activity_id) for activity_id in activity_ids)
+        return {
+            activity['id']: {"current": activity['booked_slots'], "capacity": activity['available_slots'], "topic": activity['type']}
+            for activity in activities if activity
+        }
@@ -0,0 +1,108 @@
+"""Coordinates for venues and users, and a grid index for distance queries.
+
+Places are geocoded from an offline lookup table: an exact address first,
+then the area after its last comma ("456 Game St, Uptown" -> "uptown").
+"""
+
+import math
+import threading
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Offline geocoding table, keyed by lower-case address or area name
+GEOCODES = {
+    "city center": (40.7549, -73.9840),
+    "uptown": (40.7870, -73.9754),
+    "downtown": (40.7075, -74.0113),
+    "123 park ave, city center": (40.7527, -73.9772),
+    "456 game st, uptown": (40.7851, -73.9683),
+    "789 dice blvd, downtown": (40.7081, -74.0080),
+    "321 sports rd, city center": (40.7580, -73.9855),
+}
+
+
+def geocode(place, table=GEOCODES):
+    if not place:
+        return None
+    place = place.strip().lower()
+    if place in table:
+        return table[place]
+    return table.get(place.rsplit(",", 1)[-1].strip())
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+# Points bucketed into a grid of cells cell_km high. A radius query only
+# measures the points in the cells overlapping the circle's bounding box,
+# and a nearest-k query widens that box until it holds k points, so neither
+# scans every point.
+class GridIndex:
+    def __init__(self, points=(), cell_km=1.0):
+        self._cell = cell_km / KM_PER_DEGREE
+        self._lock = threading.Lock()
+        self._points = {}
+        self._cells = {}
+        for point_id, lat, lon in points:
+            self.add(point_id, lat, lon)
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell_of(self, lat, lon):
+        return math.floor(lat / self._cell), math.floor(lon / self._cell)
+
+    def add(self, point_id, lat, lon):
+        with self._lock:
+            self._remove(point_id)
+            self._points[point_id] = (lat, lon)
+            self._cells.setdefault(self._cell_of(lat, lon), {})[point_id] = None
+
+    def remove(self, point_id):
+        with self._lock:
+            self._remove(point_id)
+
+    def _remove(self, point_id):
+        point = self._points.pop(point_id, None)
+        if point is not None:
+            cell = self._cell_of(*point)
+            self._cells[cell].pop(point_id, None)
+            if not self._cells[cell]:
+                del self._cells[cell]
+
+    def _candidates(self, lat, lon, radius_km):
+        lat_span = radius_km / KM_PER_DEGREE
+        lon_span = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(min(abs(lat) + lat_span, 90.0))), 1e-6))
+        low_row, low_col = self._cell_of(lat - lat_span, lon - min(lon_span, 180.0))
+        high_row, high_col = self._cell_of(lat + lat_span, lon + min(lon_span, 180.0))
+        if (high_row - low_row + 1) * (high_col - low_col + 1) > len(self._cells):
+            cells = [cell for cell in self._cells if low_row <= cell[0] <= high_row and low_col <= cell[1] <= high_col]
+        else:
+            cells = [(row, col) for row in range(low_row, high_row + 1) for col in range(low_col, high_col + 1)]
+        for cell in cells:
+            for point_id in self._cells.get(cell, ()):
+                yield point_id, self._points[point_id]
+
+    # (distance_km, point_id) for every point within radius_km, nearest first
+    def within(self, lat, lon, radius_km):
+        with self._lock:
+            found = []
+            for point_id, (point_lat, point_lon) in self._candidates(lat, lon, radius_km):
+                distance = haversine_km(lat, lon, point_lat, point_lon)
+                if distance <= radius_km:
+                    found.append((distance, point_id))
+        found.sort()
+        return found
+
+    # (distance_km, point_id) for the k nearest points, nearest first
+    def nearest(self, lat, lon, k=1):
+        radius_km = self._cell * KM_PER_DEGREE
+        while True:
+            found = self.within(lat, lon, radius_km)
+            if len(found) >= k or len(found) == len(self._points) or radius_km > math.pi * EARTH_RADIUS_KM:
+                return found[:k]
+            radius_km *= 2
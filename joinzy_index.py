@@ -0,0 +1,340 @@
+"""In-memory indexes over the party catalog used by the Joinzy listing pages."""
+
+import bisect
+import collections
+import datetime
+import heapq
+import itertools
+import threading
+
+
+# Inverted index from filter combinations to parties. Every party is filed
+# under each (activity_type or None, date or None, available) key it matches,
+# so a listing for any mix of the activity-type, "Today only" and
+# "Available slots" filters is a single lookup and costs time proportional
+# to the number of results. Entries are updated incrementally as parties are
+# created, fill up, free a slot or are cancelled.
+class PartyFilterIndex:
+    def __init__(self, parties=()):
+        self._lock = threading.Lock()
+        self._parties = {}
+        self._keys_by_party = {}
+        self._ids_by_key = {}
+        for party in parties:
+            self.add(party)
+
+    @staticmethod
+    def _keys(party):
+        availability = [False]
+        if party['current_participants'] < party['max_participants']:
+            availability.append(True)
+        return frozenset(itertools.product(
+            (party['activity_type'], None),
+            (party['date'], None),
+            availability
+        ))
+
+    def add(self, party):
+        self.update(party)
+
+    # Re-file a party after it changed; only keys that differ are touched
+    def update(self, party):
+        party_id = party['id']
+        keys = self._keys(party)
+        with self._lock:
+            old_keys = self._keys_by_party.get(party_id, frozenset())
+            for key in old_keys - keys:
+                self._ids_by_key[key].pop(party_id, None)
+            for key in keys - old_keys:
+                self._ids_by_key.setdefault(key, {})[party_id] = None
+            self._keys_by_party[party_id] = keys
+            self._parties[party_id] = party
+
+    def remove(self, party_id):
+        with self._lock:
+            for key in self._keys_by_party.pop(party_id, ()):
+                self._ids_by_key[key].pop(party_id, None)
+            self._parties.pop(party_id, None)
+
+    # Parties matching every given filter, ordered by id. `among` narrows
+    # the result to a set of party ids found elsewhere (e.g. nearby ones).
+    # `after` is the id of the last party already shown; only the window
+    # that follows it is built.
+    def query(self, activity_type=None, date=None, available=False, among=None, after=None, limit=None):
+        with self._lock:
+            party_ids = self._ids_by_key.get((activity_type, date, available), {})
+            if among is not None:
+                party_ids = [party_id for party_id in among if party_id in party_ids]
+            party_ids = sorted(party_ids)
+            low = 0 if after is None else bisect.bisect_right(party_ids, after)
+            high = len(party_ids) if limit is None else low + limit
+            return [self._parties[party_id] for party_id in party_ids[low:high]]
+
+    def count(self, activity_type=None, date=None, available=False, among=None):
+        with self._lock:
+            party_ids = self._ids_by_key.get((activity_type, date, available), {})
+            if among is not None:
+                return sum(1 for party_id in among if party_id in party_ids)
+            return len(party_ids)
+
+
+# Records kept sorted by a datetime key, overall and per group (activity
+# type), so a time window is found with two binary searches and comes back
+# already in date order: O(log N + k) instead of a scan and a sort.
+class DatetimeIndex:
+    def __init__(self, records=(), key='datetime', group='type'):
+        self._key = key
+        self._group = group
+        self._lock = threading.Lock()
+        self._records = {}
+        self._positions = {}
+        self._sorted = {None: []}
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        with self._lock:
+            self._insert(record)
+
+    def update(self, record):
+        with self._lock:
+            self._delete(record['id'])
+            self._insert(record)
+
+    def remove(self, record_id):
+        with self._lock:
+            self._delete(record_id)
+
+    # The entry a record was filed under is remembered, so records that were
+    # changed in place can still be found and moved
+    def _insert(self, record):
+        entry = (record[self._key], record['id'])
+        group = record[self._group]
+        self._records[record['id']] = record
+        self._positions[record['id']] = (entry, group)
+        bisect.insort(self._sorted[None], entry)
+        bisect.insort(self._sorted.setdefault(group, []), entry)
+
+    def _delete(self, record_id):
+        self._records.pop(record_id, None)
+        position = self._positions.pop(record_id, None)
+        if position is None:
+            return
+        entry, group = position
+        for entries in (self._sorted[None], self._sorted[group]):
+            del entries[bisect.bisect_left(entries, entry)]
+
+    def count(self, start=None, end=None, group=None):
+        with self._lock:
+            entries = self._sorted.get(group, [])
+            low = 0 if start is None else bisect.bisect_left(entries, (start,))
+            high = len(entries) if end is None else bisect.bisect_left(entries, (end,))
+            return max(high - low, 0)
+
+    # Records with start <= key < end (either bound may be None), in key order.
+    # Pass the cursor returned by a previous call as `after` to resume from
+    # where that page stopped.
+    def range(self, start=None, end=None, group=None, after=None, limit=None):
+        with self._lock:
+            entries = self._sorted.get(group, [])
+            low = 0 if start is None else bisect.bisect_left(entries, (start,))
+            if after is not None:
+                low = max(low, bisect.bisect_right(entries, after))
+            high = len(entries) if end is None else bisect.bisect_left(entries, (end,))
+            if limit is not None:
+                high = min(high, low + limit)
+            page = entries[low:high]
+            return [self._records[record_id] for _, record_id in page], (page[-1] if page else after)
+
+
+# One page of records ordered by `key`. Only the first (page + 1) * page_size
+# records are selected, with a bounded heap, so a page costs O(N log k)
+# instead of sorting everything. Ties keep their input order, as with sorted().
+def select_page(records, key, page=0, page_size=20, reverse=False):
+    k = (page + 1) * page_size
+    if reverse:
+        top = heapq.nlargest(k, records, key=key)
+    else:
+        top = heapq.nsmallest(k, records, key=key)
+    return top[page * page_size:]
+
+
+# Start and end of a party as datetimes; an end at or before the start is
+# taken to be on the next day
+def party_span(party):
+    start = datetime.datetime.combine(party['date'], party['start_time'])
+    end = datetime.datetime.combine(party['date'], party['end_time'])
+    if end <= start:
+        end += datetime.timedelta(days=1)
+    return start, end
+
+
+# Each user's parties as (start, end, party_id) entries sorted by start,
+# with a running maximum of the end times alongside. Whether a new time
+# slot overlaps anything is then two binary searches: only entries starting
+# before it ends can overlap, and the first of them whose running maximum
+# passes the slot's start ends after it starts.
+class ScheduleIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._max_ends = {}
+        self._spans = {}
+
+    def _overlap(self, user_id, start, end):
+        entries = self._entries.get(user_id, [])
+        high = bisect.bisect_left(entries, (end,))
+        max_ends = self._max_ends.get(user_id, [])
+        if not high or max_ends[high - 1] <= start:
+            return None
+        # The running maximum rises at an entry only through that entry's
+        # own end, so the first entry past start is itself the overlap
+        return entries[bisect.bisect_right(max_ends, start, 0, high)][2]
+
+    # Id of a party on the user's schedule that overlaps the given one, if any
+    def overlapping(self, user_id, party):
+        with self._lock:
+            return self._overlap(user_id, *party_span(party))
+
+    # Put a party on the user's schedule unless it overlaps another one
+    # (check=False adds it regardless). Returns whether it was added.
+    def add(self, user_id, party, check=True):
+        start, end = party_span(party)
+        with self._lock:
+            if (user_id, party['id']) in self._spans:
+                return False
+            if check and self._overlap(user_id, start, end) is not None:
+                return False
+            entries = self._entries.setdefault(user_id, [])
+            position = bisect.bisect_left(entries, (start, end, party['id']))
+            entries.insert(position, (start, end, party['id']))
+            self._spans[(user_id, party['id'])] = (start, end)
+            self._update_max_ends(user_id, position)
+            return True
+
+    def remove(self, user_id, party_id):
+        with self._lock:
+            span = self._spans.pop((user_id, party_id), None)
+            if span is None:
+                return
+            entries = self._entries[user_id]
+            position = bisect.bisect_left(entries, (*span, party_id))
+            del entries[position]
+            self._update_max_ends(user_id, position)
+
+    def _update_max_ends(self, user_id, position):
+        entries = self._entries[user_id]
+        max_ends = self._max_ends.setdefault(user_id, [])
+        del max_ends[position:]
+        running = max_ends[-1] if max_ends else None
+        for _, end, _ in entries[position:]:
+            running = end if running is None or end > running else running
+            max_ends.append(running)
+
+    # Ids of the user's parties starting in [start, end), in time order
+    def schedule(self, user_id, start=None, end=None):
+        with self._lock:
+            entries = self._entries.get(user_id, [])
+            low = 0 if start is None else bisect.bisect_left(entries, (start,))
+            high = len(entries) if end is None else bisect.bisect_left(entries, (end,))
+            return [party_id for _, _, party_id in entries[low:high]]
+
+
+# Per-party FIFO queues of waiting users, with a priority lane that is
+# served first. Leaving the queue only marks the user's entry, and pop()
+# skips marked entries, so every entry is pushed and popped at most once and
+# promoting the next user is O(1) amortized. A queue is compacted when most
+# of it is marked.
+class Waitlist:
+    def __init__(self, entries=()):
+        self._lock = threading.Lock()
+        self._lanes = {}
+        self._entries = {}
+        self._removed = {}
+        self._parties_by_user = {}
+        for party_id, user_id, priority in entries:
+            self.add(party_id, user_id, priority)
+
+    # Queue a user at the back of their lane; False if already waiting
+    def add(self, party_id, user_id, priority=False):
+        with self._lock:
+            return self._add(party_id, user_id, priority, front=False)
+
+    # Put a user back at the front of their lane (undoing a pop)
+    def push_front(self, party_id, user_id, priority=False):
+        with self._lock:
+            return self._add(party_id, user_id, priority, front=True)
+
+    def _add(self, party_id, user_id, priority, front):
+        if (party_id, user_id) in self._entries:
+            return False
+        entry = [user_id, bool(priority), True]
+        lane = self._lanes.setdefault(party_id, (collections.deque(), collections.deque()))[0 if priority else 1]
+        if front:
+            lane.appendleft(entry)
+        else:
+            lane.append(entry)
+        self._entries[(party_id, user_id)] = entry
+        self._parties_by_user.setdefault(user_id, {})[party_id] = None
+        return True
+
+    def remove(self, party_id, user_id):
+        with self._lock:
+            entry = self._entries.pop((party_id, user_id), None)
+            if entry is None:
+                return False
+            entry[2] = False
+            self._parties_by_user[user_id].pop(party_id, None)
+            removed = self._removed[party_id] = self._removed.get(party_id, 0) + 1
+            lanes = self._lanes[party_id]
+            if removed > 32 and removed * 2 > len(lanes[0]) + len(lanes[1]):
+                for lane in lanes:
+                    live = [entry for entry in lane if entry[2]]
+                    lane.clear()
+                    lane.extend(live)
+                self._removed[party_id] = 0
+            return True
+
+    # Take the next waiting user off the party's queue, as (user_id,
+    # priority), or None
+    def pop(self, party_id):
+        with self._lock:
+            for lane in self._lanes.get(party_id, ()):
+                while lane:
+                    user_id, priority, live = lane.popleft()
+                    if live:
+                        del self._entries[(party_id, user_id)]
+                        self._parties_by_user[user_id].pop(party_id, None)
+                        return user_id, priority
+                    self._removed[party_id] -= 1
+            return None
+
+    # Forget a party's whole queue; returns the users who were waiting
+    def drop(self, party_id):
+        with self._lock:
+            lanes = self._lanes.pop(party_id, ((), ()))
+            self._removed.pop(party_id, None)
+            waiting = [entry[0] for lane in lanes for entry in lane if entry[2]]
+            for user_id in waiting:
+                del self._entries[(party_id, user_id)]
+                self._parties_by_user[user_id].pop(party_id, None)
+            return waiting
+
+    def is_waiting(self, party_id, user_id):
+        return (party_id, user_id) in self._entries
+
+    # The users waiting for a party, next to be promoted first
+    def waiting(self, party_id):
+        with self._lock:
+            return [entry[0] for lane in self._lanes.get(party_id, ()) for entry in lane if entry[2]]
+
+    # 1-based place of a user in a party's queue, or None
+    def position(self, party_id, user_id):
+        if not self.is_waiting(party_id, user_id):
+            return None
+        waiting = self.waiting(party_id)
+        return waiting.index(user_id) + 1 if user_id in waiting else None
+
+    def parties_waited_by(self, user_id):
+        with self._lock:
+            return list(self._parties_by_user.get(user_id, ()))
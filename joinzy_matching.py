@@ -0,0 +1,125 @@
+"""Offline group formation: suggest invites that fill open parties.
+
+Users and open parties are grouped by their feature rows (see
+joinzy_recommend), every user group is scored against every party group in
+one small matrix product, and group pairs are then taken greedily from the
+best score down, handing each pair as many invites as the party group has
+free slots and the user group has users. Invites follow the same rules as
+joining (no party twice, no two parties whose times overlap), and
+each user gets at most one. Nothing is joined; the result is a list of
+suggested invites.
+
+    python joinzy_matching.py --db joinzy.db --start 2025-03-03 --days 7
+"""
+
+import argparse
+import datetime
+import heapq
+
+import numpy as np
+
+from joinzy_index import ScheduleIndex
+from joinzy_recommend import FeatureEncoder, venue_areas
+
+
+# Distinct feature rows and, for each, the rows that share it. Rows are
+# compared as raw bytes, which is much faster than a row-wise unique.
+def _groups(features):
+    features = np.ascontiguousarray(features)
+    keys = features.view(np.dtype((np.void, features.dtype.itemsize * features.shape[1]))).reshape(-1)
+    _, first, group_of = np.unique(keys, return_index=True, return_inverse=True)
+    members = [[] for _ in range(len(first))]
+    for row, group in enumerate(group_of.reshape(-1).tolist()):
+        members[group].append(row)
+    return features[first], members
+
+
+# Suggested invites as {'party_id', 'user_id', 'score'} dicts, best first.
+# Within a party group, parties with the fewest free slots are filled first
+# so they get completed.
+def suggest_invites(parties, users, activity_types, party_areas=None):
+    busy = ScheduleIndex()
+    for party in parties:
+        for user_id in party['participants']:
+            busy.add(user_id, party, check=False)
+    open_parties = [party for party in parties if party['current_participants'] < party['max_participants']]
+    users = list(users)
+    if not open_parties or not users:
+        return []
+
+    encoder = FeatureEncoder(activity_types, party_areas)
+    party_signatures, party_groups = _groups(encoder.encode_parties(open_parties))
+    user_signatures, user_groups = _groups(encoder.encode_users(users))
+    scores = user_signatures @ party_signatures.T
+
+    free_slots = [party['max_participants'] - party['current_participants'] for party in open_parties]
+    for members in party_groups:
+        members.sort(key=lambda row: (free_slots[row], open_parties[row]['id']))
+    # Users are popped from the end of their group's pool, lowest id first
+    for members in user_groups:
+        members.reverse()
+
+    # Each party group walks its user groups from the best score down; a
+    # heap keyed on the current score interleaves the groups, so a party
+    # group drops out as soon as it is full
+    ranked = np.argsort(-scores.T, axis=1, kind="stable")
+    heap = [(-float(scores[ranked[group, 0], group]), group, 0) for group in range(len(party_groups))]
+    heapq.heapify(heap)
+
+    invites = []
+    while heap:
+        score, group, position = heapq.heappop(heap)
+        if score >= 0:
+            break
+        pool = user_groups[ranked[group, position]]
+        party_group = party_groups[group]
+        for row in party_group:
+            if not pool:
+                break
+            party = open_parties[row]
+            skipped = []
+            while pool and free_slots[row]:
+                user_row = pool.pop()
+                user_id = users[user_row]['id']
+                if user_id in party['participants'] or user_id == party['creator_id'] or busy.overlapping(user_id, party) is not None:
+                    skipped.append(user_row)
+                    continue
+                free_slots[row] -= 1
+                invites.append({'party_id': party['id'], 'user_id': user_id, 'score': -score})
+            pool.extend(reversed(skipped))
+        party_group[:] = [row for row in party_group if free_slots[row]]
+        position += 1
+        if party_group and position < len(user_groups):
+            heapq.heappush(heap, (-float(scores[ranked[group, position], group]), group, position))
+    return invites
+
+
+def main():
+    from joinzy_storage import SQLiteStorage
+
+    parser = argparse.ArgumentParser(description="Suggest invites that fill open Joinzy parties.")
+    parser.add_argument("--db", default="joinzy.db")
+    parser.add_argument("--start", type=datetime.date.fromisoformat, default=datetime.date.today())
+    parser.add_argument("--days", type=int, default=7)
+    args = parser.parse_args()
+
+    storage = SQLiteStorage(args.db)
+    try:
+        end = args.start + datetime.timedelta(days=args.days)
+        parties = [party for party in storage.list_parties() if args.start <= party['date'] < end]
+        users = storage.list_users()
+        activity_types = sorted({party['activity_type'] for party in parties})
+        invites = suggest_invites(parties, users, activity_types, venue_areas(storage.list_venues()))
+    finally:
+        storage.close()
+
+    usernames = {user['id']: user['username'] for user in users}
+    names = {party['id']: party['name'] for party in parties}
+    for invite in invites:
+        print(f"{names[invite['party_id']]}\t{usernames[invite['user_id']]}\t{invite['score']:.1f}")
+    slots = sum(party['max_participants'] - party['current_participants'] for party in parties)
+    print(f"{len(invites)} invites for {slots} free slots in {len(parties)} parties")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Live occupancy feed: publish/subscribe for party and activity capacity.
+
+Engines publish a delta whenever a slot is taken or freed, and subscribers
+follow parties or activities by id or by activity type. A subscription
+only collects which items changed (summing their deltas); at most once per
+coalescing window it reads the current counts of those items and yields
+one update each. A burst of joins on a popular party is therefore one
+message per subscriber per window, and the counts sent are read after the
+burst, so they are never older than the window however the publishing
+threads interleaved.
+
+publish() is thread-safe and touches only the subscriptions following the
+item or its type; subscriptions are consumed from asyncio:
+
+    feed = OccupancyFeed()
+    engine = PartyEngine.open("joinzy.db", occupancy=feed)
+    async with feed.subscribe("party", ids=[1, 2], topics=["Chess"]) as updates:
+        async for batch in updates:
+            ...  # [{"id": 1, "delta": 2, "current": 9, "capacity": 10, "topic": "Football"}, ...]
+"""
+
+import asyncio
+import threading
+
+# Coalescing window, in seconds
+WINDOW_SECONDS = 0.25
+
+
+class OccupancyFeed:
+    def __init__(self, window=WINDOW_SECONDS):
+        self.window = window
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._by_topic = {}
+        self._sources = {}
+
+    # Register the function that reads current counts for a kind of item:
+    # it takes a list of ids and returns {id: {"current", "capacity",
+    # "topic"}}, leaving out items that no longer exist
+    def register_source(self, kind, occupancy):
+        self._sources[kind] = occupancy
+
+    # Whether counts for a kind of item can be read
+    def serves(self, kind):
+        return kind in self._sources
+
+    def occupancy(self, kind, ids):
+        return self._sources[kind](ids)
+
+    def publish(self, kind, item_id, topic, delta):
+        with self._lock:
+            subscriptions = self._by_id.get((kind, item_id), set()) | self._by_topic.get((kind, topic), set())
+            for subscription in subscriptions:
+                subscription._changed(item_id, delta)
+
+    # A subscription to the given ids and topics of one kind of item, bound
+    # to the running event loop
+    def subscribe(self, kind, ids=(), topics=()):
+        subscription = Subscription(self, kind, ids, topics, asyncio.get_running_loop())
+        with self._lock:
+            for item_id in subscription.ids:
+                self._by_id.setdefault((kind, item_id), set()).add(subscription)
+            for topic in subscription.topics:
+                self._by_topic.setdefault((kind, topic), set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for index, keys in ((self._by_id, subscription.ids), (self._by_topic, subscription.topics)):
+                for key in keys:
+                    subscribers = index.get((subscription.kind, key))
+                    if subscribers is not None:
+                        subscribers.discard(subscription)
+                        if not subscribers:
+                            del index[(subscription.kind, key)]
+
+
+class Subscription:
+    def __init__(self, feed, kind, ids, topics, loop):
+        self.feed = feed
+        self.kind = kind
+        self.ids = frozenset(ids)
+        self.topics = frozenset(topics)
+        self._loop = loop
+        self._pending = {}
+        self._ready = asyncio.Event()
+
+    # Called under the feed lock from any thread. Only the first change of a
+    # window wakes the consumer; later ones just add to the pending delta.
+    def _changed(self, item_id, delta):
+        wake = not self._pending
+        self._pending[item_id] = self._pending.get(item_id, 0) + delta
+        if wake:
+            try:
+                self._loop.call_soon_threadsafe(self._ready.set)
+            except RuntimeError:
+                # The consumer's loop has closed without unsubscribing;
+                # publishers must not fail because of it
+                pass
+
+    # Current counts for the subscribed ids, for a client's first message
+    async def snapshot(self):
+        if not self.ids:
+            return []
+        counts = await asyncio.to_thread(self.feed.occupancy, self.kind, list(self.ids))
+        return [dict(counts[item_id], id=item_id, delta=0) for item_id in sorted(self.ids) if item_id in counts]
+
+    # The next batch of coalesced updates, or [] when nothing changed within
+    # timeout seconds. Items that no longer exist (a cancelled party) come
+    # with "cancelled": True instead of counts.
+    async def next_batch(self, timeout=None):
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        await asyncio.sleep(self.feed.window)
+        with self.feed._lock:
+            pending, self._pending = self._pending, {}
+            self._ready.clear()
+        if not pending:
+            return []
+        counts = await asyncio.to_thread(self.feed.occupancy, self.kind, list(pending))
+        return [
+            dict(counts[item_id], id=item_id, delta=delta) if item_id in counts
+            else {"id": item_id, "delta": delta, "cancelled": True}
+            for item_id, delta in pending.items()
+        ]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            batch = await self.next_batch()
+            if batch:
+                return batch
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.feed.unsubscribe(self)
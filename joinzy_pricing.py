@@ -0,0 +1,162 @@
+"""Declarative pricing rules compiled into a vectorised evaluation plan.
+
+Rules are plain dicts, one per kind:
+
+    {"kind": "coupon", "rates": {"WELCOME": 0.15}}         # discount by code
+    {"kind": "membership", "rates": {"Premium": 0.10}}     # discount by tier
+    {"kind": "group", "min_size": 6, "rate": 0.05}         # discount by size
+    {"kind": "weekend", "surcharge": 0.20}                 # price change on Sat/Sun
+
+Weekend rules adjust the listed price; of the discounts that apply, the
+largest wins. PricingEngine turns the rules into lookup tables and arrays
+once, so pricing any number of quotes is a handful of array operations.
+
+VenueCostService prices venue hire for the Create Party form.
+"""
+
+import functools
+
+import numpy as np
+
+from joinzy_geo import GridIndex, geocode
+
+
+class PricingEngine:
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        self._coupon_rates = {}
+        self._membership_rates = {}
+        self._weekday_multipliers = np.ones(7)
+        group_rates = {}
+        for rule in self.rules:
+            kind = rule['kind']
+            if kind == "coupon":
+                self._coupon_rates.update(rule['rates'])
+            elif kind == "membership":
+                self._membership_rates.update(rule['rates'])
+            elif kind == "group":
+                group_rates[rule['min_size']] = max(rule['rate'], group_rates.get(rule['min_size'], 0))
+            elif kind == "weekend":
+                self._weekday_multipliers[5:] *= 1 + rule['surcharge']
+            else:
+                raise ValueError(f"Unknown pricing rule kind: {kind}")
+
+        # Group discounts as a step function of group size: the best rate
+        # for any threshold at or below the size
+        sizes = sorted(group_rates)
+        self._group_sizes = np.array(sizes, dtype=np.int64)
+        self._group_rates = np.concatenate([[0.0], np.maximum.accumulate([group_rates[size] for size in sizes])])
+
+    def coupon_rate(self, coupon):
+        return self._coupon_rates.get(coupon, 0) if coupon else 0
+
+    def membership_rate(self, membership):
+        return self._membership_rates.get(membership, 0)
+
+    # Arrays of (base_cost, discount, final_cost) for many quotes. Every
+    # argument is a scalar or an array of the same length as base_costs:
+    # memberships are tier names, dates are datetime.date objects and
+    # group_sizes are participant counts.
+    def price(self, base_costs, coupon=None, memberships=None, dates=None, group_sizes=None):
+        base_costs = np.asarray(base_costs, dtype=float)
+        if dates is not None:
+            weekdays = np.array([date.weekday() for date in np.ravel(dates)], dtype=np.int64).reshape(np.shape(dates))
+            base_costs = base_costs * self._weekday_multipliers[weekdays]
+        rates = np.zeros(base_costs.shape)
+        if coupon:
+            rates = np.maximum(rates, self.coupon_rate(coupon))
+        if memberships is not None and self._membership_rates:
+            if isinstance(memberships, str):
+                rates = np.maximum(rates, self.membership_rate(memberships))
+            else:
+                tiers, tier_of = np.unique(np.asarray(memberships, dtype=str), return_inverse=True)
+                tier_rates = np.array([self.membership_rate(tier) for tier in tiers.tolist()], dtype=float)
+                rates = np.maximum(rates, tier_rates[tier_of.reshape(-1)])
+        if group_sizes is not None and len(self._group_sizes):
+            steps = np.searchsorted(self._group_sizes, group_sizes, side="right")
+            rates = np.maximum(rates, self._group_rates[steps])
+        discounts = base_costs * rates
+        return base_costs, discounts, base_costs - discounts
+
+    # The same as price(), as a list of quote dicts
+    def quotes(self, base_costs, **kwargs):
+        base_costs, discounts, final_costs = self.price(base_costs, **kwargs)
+        return [
+            {"base_cost": base_cost, "discount": discount, "final_cost": final_cost}
+            for base_cost, discount, final_cost in zip(base_costs.tolist(), discounts.tolist(), final_costs.tolist())
+        ]
+
+    def quote(self, base_cost, coupon=None, membership=None, date=None, group_size=None):
+        return self.quotes(
+            [base_cost],
+            coupon=coupon,
+            memberships=membership,
+            dates=None if date is None else [date],
+            group_sizes=None if group_size is None else [group_size]
+        )[0]
+
+
+# Length of a time slot in hours; an end at or before the start is on the
+# next day, so 22:00-01:00 is 3 hours and 18:00-18:00 a full day
+def slot_hours(start_time, end_time):
+    minutes = (end_time.hour * 60 + end_time.minute) - (start_time.hour * 60 + start_time.minute)
+    if minutes <= 0:
+        minutes += 24 * 60
+    return minutes / 60
+
+
+# Venue lookups and hire costs. Venues are read-only configuration, so the
+# per-activity lists and a spatial index of each activity's venues are
+# built once, and costs and distance orderings are memoized: form reruns
+# with the same inputs are dictionary hits.
+class VenueCostService:
+    def __init__(self, venues):
+        self._venues = {venue['id']: venue for venue in venues}
+        self._points = {venue['id']: geocode(venue['address']) for venue in venues}
+        self._by_activity = {}
+        self._locations = {}
+        self._unplaced = {}
+        for venue in venues:
+            point = self._points[venue['id']]
+            for activity_type in venue['activity_types']:
+                self._by_activity.setdefault(activity_type, []).append(venue)
+                if point:
+                    self._locations.setdefault(activity_type, GridIndex()).add(venue['id'], *point)
+                else:
+                    self._unplaced.setdefault(activity_type, []).append(venue)
+        self.venues_for = functools.lru_cache(maxsize=1024)(self._venues_for)
+        self.quote = functools.lru_cache(maxsize=4096)(self._quote)
+
+    def get(self, venue_id):
+        return self._venues.get(venue_id)
+
+    # Coordinates of a venue, or None if its address is unknown
+    def point(self, venue_id):
+        return self._points.get(venue_id)
+
+    # Venues suitable for an activity type. With near=(latitude, longitude)
+    # only the k closest to that point are returned, nearest first; venues
+    # whose address can't be placed make up the numbers at the end.
+    def _venues_for(self, activity_type, near=None, k=None):
+        venues = self._by_activity.get(activity_type, [])
+        if near is None:
+            return tuple(venues if k is None else venues[:k])
+        k = len(venues) if k is None else k
+        locations = self._locations.get(activity_type)
+        nearest = [self._venues[venue_id] for _, venue_id in locations.nearest(*near, k)] if locations else []
+        return tuple(nearest + self._unplaced.get(activity_type, [])[:k - len(nearest)])
+
+    # Hire costs for a venue and time slot: the total hourly charge
+    # (None when the venue doesn't charge by the hour), the fixed
+    # per-person charge and the per-person share of both
+    def _quote(self, venue_id, start_time, end_time, participants):
+        venue = self._venues[venue_id]
+        person_cost = venue.get('cost_per_person', 0)
+        if venue.get('cost_per_hour', 0) <= 0:
+            return {"venue_cost": None, "person_cost": person_cost, "cost_per_person": person_cost}
+        venue_cost = venue['cost_per_hour'] * slot_hours(start_time, end_time)
+        return {
+            "venue_cost": venue_cost,
+            "person_cost": person_cost,
+            "cost_per_person": person_cost + venue_cost / participants
+        }
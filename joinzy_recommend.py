@@ -0,0 +1,313 @@
+"""Preference matching between users and open parties.
+
+Users and parties are encoded as rows of small 0/1 feature matrices
+(activity type, day of week, time of day, area), so scoring any number of
+users against every party is a single matrix product.
+"""
+
+import threading
+
+import numpy as np
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+DAY_GROUPS = {
+    "Weekdays": DAYS[:5],
+    "Weekends": DAYS[5:]
+}
+TIMES = ["Morning", "Afternoon", "Evening", "Night"]
+
+# How much each kind of match adds to a score
+ACTIVITY_WEIGHT = 4.0
+DAY_WEIGHT = 2.0
+TIME_WEIGHT = 2.0
+AREA_WEIGHT = 1.0
+
+
+def time_of_day(start_time):
+    if 5 <= start_time.hour < 12:
+        return "Morning"
+    if 12 <= start_time.hour < 17:
+        return "Afternoon"
+    if 17 <= start_time.hour < 21:
+        return "Evening"
+    return "Night"
+
+
+# Area of a venue, taken from the last part of its address ("..., Uptown")
+def venue_areas(venues):
+    return {venue['name']: venue['address'].rsplit(",", 1)[-1].strip() for venue in venues}
+
+
+# Turns parties and users into feature rows of the same width. Party rows
+# have a single 1 in each block; user rows carry the weight of every
+# preference they list, so a dot product is the match score.
+class FeatureEncoder:
+    def __init__(self, activity_types, party_areas=None):
+        self.party_areas = party_areas or {}
+        self._activity_index = {activity: i for i, activity in enumerate(activity_types)}
+        areas = sorted(set(self.party_areas.values()))
+        self._area_index = {area.lower(): i for i, area in enumerate(areas)}
+        self._offsets = np.cumsum([0, len(self._activity_index), len(DAYS), len(TIMES)])
+        self.width = int(self._offsets[-1]) + len(self._area_index)
+
+    def encode_parties(self, parties):
+        encoded = np.zeros((len(parties), self.width), dtype=np.float32)
+        for row, party in enumerate(parties):
+            activity = self._activity_index.get(party['activity_type'])
+            if activity is not None:
+                encoded[row, self._offsets[0] + activity] = 1
+            encoded[row, self._offsets[1] + party['date'].weekday()] = 1
+            encoded[row, self._offsets[2] + TIMES.index(time_of_day(party['start_time']))] = 1
+            area = self._area_index.get(self.party_areas.get(party['location'], "").lower())
+            if area is not None:
+                encoded[row, self._offsets[3] + area] = 1
+        return encoded
+
+    def encode_users(self, users):
+        encoded = np.zeros((len(users), self.width), dtype=np.float32)
+        for row, user in enumerate(users):
+            for activity in user.get('activities_pref', []):
+                if activity in self._activity_index:
+                    encoded[row, self._offsets[0] + self._activity_index[activity]] = ACTIVITY_WEIGHT
+            for day in user.get('preferred_days', []):
+                for name in DAY_GROUPS.get(day, [day]):
+                    if name in DAYS:
+                        encoded[row, self._offsets[1] + DAYS.index(name)] = DAY_WEIGHT
+            for time in user.get('preferred_times', []):
+                if time in TIMES:
+                    encoded[row, self._offsets[2] + TIMES.index(time)] = TIME_WEIGHT
+            area = self._area_index.get((user.get('location') or "").lower())
+            if area is not None:
+                encoded[row, self._offsets[3] + area] = AREA_WEIGHT
+        return encoded
+
+
+class PartyRecommender:
+    def __init__(self, parties, activity_types, party_areas=None):
+        self.encoder = FeatureEncoder(activity_types, party_areas)
+        self.parties = list(parties)
+        self.party_ids = np.array([party['id'] for party in self.parties], dtype=np.int64)
+        features = self.encoder.encode_parties(self.parties)
+
+        # Parties with identical features score identically, so users are
+        # scored against each distinct feature row once and the scores are
+        # spread back out to the parties sharing it
+        self._signatures, self._signature_of_party = np.unique(features, axis=0, return_inverse=True)
+        self._signature_of_party = self._signature_of_party.reshape(-1)
+        order = np.argsort(self._signature_of_party, kind="stable")
+        bounds = np.searchsorted(self._signature_of_party[order], np.arange(len(self._signatures) + 1))
+        self._parties_by_signature = [order[bounds[i]:bounds[i + 1]] for i in range(len(self._signatures))]
+
+    def encode_users(self, users):
+        return self.encoder.encode_users(users)
+
+    def _signature_scores(self, users):
+        return self.encode_users(users) @ self._signatures.T
+
+    # Score matrix of shape (len(users), len(parties))
+    def score(self, users):
+        return self._signature_scores(users)[:, self._signature_of_party]
+
+    # Best-matching parties for one user as (party, score) pairs, best first.
+    # Parties in `exclude` (e.g. ones the user already joined) are skipped.
+    def recommend(self, user, k=5, exclude=()):
+        if not self.parties:
+            return []
+        scores = self.score([user])[0]
+        if exclude:
+            scores[np.isin(self.party_ids, list(exclude))] = 0
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]
+        return [(self.parties[i], float(scores[i])) for i in top if scores[i] > 0]
+
+    # Top-k party ids and scores for every user, best first, for the nightly
+    # batch. Users are scored batch_size at a time against the distinct party
+    # signatures, so the users x parties matrix is never built. Slots without
+    # a positive match hold id -1.
+    def recommend_all(self, users, k=10, batch_size=4096):
+        party_ids = np.full((len(users), k), -1, dtype=np.int64)
+        party_scores = np.zeros((len(users), k), dtype=np.float32)
+        if not self.parties:
+            return party_ids, party_scores
+        for start in range(0, len(users), batch_size):
+            scores = self._signature_scores(users[start:start + batch_size])
+            ranked = np.argsort(-scores, axis=1, kind="stable")
+            for row in range(len(scores)):
+                filled = 0
+                for signature in ranked[row]:
+                    score = scores[row, signature]
+                    if filled == k or score <= 0:
+                        break
+                    parties = self._parties_by_signature[signature][:k - filled]
+                    party_ids[start + row, filled:filled + len(parties)] = self.party_ids[parties]
+                    party_scores[start + row, filled:filled + len(parties)] = score
+                    filled += len(parties)
+        return party_ids, party_scores
+
+
+# Feature rows kept in a growable matrix, addressed by record id. Removing a
+# row moves the last row into its place, so the live rows stay contiguous.
+class _FeatureRows:
+    def __init__(self, width):
+        self.matrix = np.zeros((16, width), dtype=np.float32)
+        self.ids = []
+        self.rows = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def live(self):
+        return self.matrix[:len(self.ids)]
+
+    def put(self, record_id, vector):
+        row = self.rows.get(record_id)
+        if row is None:
+            row = len(self.ids)
+            if row == len(self.matrix):
+                self.matrix = np.concatenate([self.matrix, np.zeros_like(self.matrix)])
+            self.rows[record_id] = row
+            self.ids.append(record_id)
+        self.matrix[row] = vector
+        return row
+
+    def remove(self, record_id):
+        row = self.rows.pop(record_id, None)
+        if row is None:
+            return
+        last_id = self.ids.pop()
+        if last_id != record_id:
+            self.matrix[row] = self.matrix[len(self.ids)]
+            self.ids[row] = last_id
+            self.rows[last_id] = row
+
+
+# Every user's top-n open parties, computed once and then patched as things
+# change, so serving recommendations is a dictionary lookup:
+#   - a new or reopened party is scored against all users in one product and
+#     only users it would make the top-n for are touched;
+#   - a party that fills up or is cancelled only re-ranks users who had it;
+#   - a profile edit, join or leave only re-ranks that user.
+class RecommendationCache:
+    def __init__(self, users, parties, activity_types, party_areas=None, n=5):
+        self.n = n
+        self.encoder = FeatureEncoder(activity_types, party_areas)
+        self._lock = threading.Lock()
+        self._users = _FeatureRows(self.encoder.width)
+        self._parties = _FeatureRows(self.encoder.width)
+        self._thresholds = np.zeros(16, dtype=np.float32)
+        self._top = {}
+        self._holders = {}
+        self._joined = {}
+
+        parties = list(parties)
+        users = list(users)
+        for party in parties:
+            for user_id in party['participants']:
+                self._joined.setdefault(user_id, set()).add(party['id'])
+        party_vectors = self.encoder.encode_parties(parties)
+        for party, vector in zip(parties, party_vectors):
+            self._parties.put(party['id'], vector)
+        for user, vector in zip(users, self.encoder.encode_users(users)):
+            self._put_user_row(user['id'], vector)
+
+        # Initial fill uses the batch scorer; ask for extra rows so parties
+        # a user already joined can be dropped
+        extra = max((len(joined) for joined in self._joined.values()), default=0)
+        party_ids, scores = PartyRecommender(parties, activity_types, party_areas).recommend_all(users, n + extra)
+        for user, ids, user_scores in zip(users, party_ids, scores):
+            joined = self._joined.get(user['id'], ())
+            top = [(float(score), int(party_id)) for party_id, score in zip(ids, user_scores)
+                   if party_id >= 0 and party_id not in joined]
+            self._set_top(user['id'], top[:n])
+
+    def _put_user_row(self, user_id, vector):
+        row = self._users.put(user_id, vector)
+        if row >= len(self._thresholds):
+            self._thresholds = np.concatenate([self._thresholds, np.zeros_like(self._thresholds)])
+        return row
+
+    # Replace a user's list, keeping the party -> users index and the score a
+    # party has to beat to get into the list in step
+    def _set_top(self, user_id, top):
+        for _, party_id in self._top.get(user_id, ()):
+            self._holders.get(party_id, set()).discard(user_id)
+        top.sort(key=lambda item: (-item[0], item[1]))
+        self._top[user_id] = top
+        for _, party_id in top:
+            self._holders.setdefault(party_id, set()).add(user_id)
+        row = self._users.rows[user_id]
+        self._thresholds[row] = top[-1][0] if len(top) == self.n else 0
+
+    def _rerank(self, user_id):
+        if not len(self._parties):
+            self._set_top(user_id, [])
+            return
+        scores = self._parties.live() @ self._users.matrix[self._users.rows[user_id]]
+        for party_id in self._joined.get(user_id, ()):
+            row = self._parties.rows.get(party_id)
+            if row is not None:
+                scores[row] = 0
+        k = min(self.n, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        self._set_top(user_id, [(float(scores[row]), self._parties.ids[row]) for row in best if scores[row] > 0])
+
+    def _offer(self, user_id, party_id, score):
+        top = [item for item in self._top.get(user_id, []) if item[1] != party_id]
+        top.append((score, party_id))
+        top.sort(key=lambda item: (-item[0], item[1]))
+        self._set_top(user_id, top[:self.n])
+
+    # Serving: (party_id, score) for the user's best open parties, best first
+    def recommendations(self, user_id, k=None):
+        with self._lock:
+            top = self._top.get(user_id, [])[:k]
+            return [(party_id, score) for score, party_id in top]
+
+    def add_user(self, user):
+        with self._lock:
+            self._put_user_row(user['id'], self.encoder.encode_users([user])[0])
+            self._rerank(user['id'])
+
+    def update_user(self, user):
+        with self._lock:
+            self._users.put(user['id'], self.encoder.encode_users([user])[0])
+            self._rerank(user['id'])
+
+    # A party was created or has free slots again
+    def add_party(self, party):
+        with self._lock:
+            for user_id in party['participants']:
+                self._joined.setdefault(user_id, set()).add(party['id'])
+            vector = self.encoder.encode_parties([party])[0]
+            self._parties.put(party['id'], vector)
+            scores = self._users.live() @ vector
+            thresholds = self._thresholds[:len(self._users)]
+            for row in np.flatnonzero((scores > thresholds) & (scores > 0)):
+                user_id = self._users.ids[row]
+                if party['id'] not in self._joined.get(user_id, ()):
+                    self._offer(user_id, party['id'], float(scores[row]))
+
+    # A party filled up or was cancelled
+    def remove_party(self, party_id):
+        with self._lock:
+            self._parties.remove(party_id)
+            for user_id in list(self._holders.pop(party_id, ())):
+                self._rerank(user_id)
+
+    def user_joined(self, user_id, party_id):
+        with self._lock:
+            self._joined.setdefault(user_id, set()).add(party_id)
+            if user_id in self._holders.get(party_id, ()):
+                self._rerank(user_id)
+
+    def user_left(self, user_id, party_id):
+        with self._lock:
+            self._joined.get(user_id, set()).discard(party_id)
+            party_row = self._parties.rows.get(party_id)
+            user_row = self._users.rows.get(user_id)
+            if party_row is None or user_row is None:
+                return
+            score = float(self._parties.matrix[party_row] @ self._users.matrix[user_row])
+            if score > 0 and score > self._thresholds[user_row]:
+                self._offer(user_id, party_id, score)
@@ -0,0 +1,583 @@
+"""SQLite storage backend shared by the Joinzy Streamlit apps.
+
+The database runs in WAL mode so any number of sessions can read while a
+single writer connection serializes every write. Reads borrow a connection
+from a small pool; each connection keeps its own cache of prepared
+statements, so the SQL below is compiled once per connection.
+"""
+
+import datetime
+import json
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS parties (
+    id INTEGER PRIMARY KEY,
+    activity_type TEXT NOT NULL,
+    date TEXT NOT NULL,
+    max_participants INTEGER NOT NULL,
+    current_participants INTEGER NOT NULL,
+    creator_id INTEGER,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS party_participants (
+    party_id INTEGER NOT NULL REFERENCES parties(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (party_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS venues (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    vendor TEXT NOT NULL,
+    datetime TEXT NOT NULL,
+    cost REAL NOT NULL,
+    available_slots INTEGER NOT NULL,
+    booked_slots INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bookings (
+    id INTEGER PRIMARY KEY,
+    activity_id INTEGER NOT NULL REFERENCES activities(id),
+    user_id INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+-- Waitlists: the next user is the one with the highest priority, then the
+-- lowest id (earliest to join)
+CREATE TABLE IF NOT EXISTS party_waitlist (
+    id INTEGER PRIMARY KEY,
+    party_id INTEGER NOT NULL REFERENCES parties(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL,
+    priority INTEGER NOT NULL,
+    UNIQUE (party_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS activity_waitlist (
+    id INTEGER PRIMARY KEY,
+    activity_id INTEGER NOT NULL REFERENCES activities(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL,
+    priority INTEGER NOT NULL,
+    coupon_code TEXT,
+    UNIQUE (activity_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS id_sequences (
+    name TEXT PRIMARY KEY,
+    next_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_parties_activity_date ON parties(activity_type, date);
+CREATE INDEX IF NOT EXISTS idx_parties_creator ON parties(creator_id);
+CREATE INDEX IF NOT EXISTS idx_participants_user ON party_participants(user_id);
+CREATE INDEX IF NOT EXISTS idx_activities_type_datetime ON activities(type, datetime);
+CREATE INDEX IF NOT EXISTS idx_activities_vendor ON activities(vendor);
+CREATE INDEX IF NOT EXISTS idx_bookings_activity ON bookings(activity_id);
+CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings(user_id);
+CREATE INDEX IF NOT EXISTS idx_party_waitlist_order ON party_waitlist(party_id, priority DESC, id);
+CREATE INDEX IF NOT EXISTS idx_activity_waitlist_order ON activity_waitlist(activity_id, priority DESC, id);
+CREATE INDEX IF NOT EXISTS idx_activity_waitlist_user ON activity_waitlist(user_id);
+"""
+
+# Columns that are stored natively; everything else goes in the JSON "data" column
+USER_COLUMNS = ("id", "username", "password", "name")
+PARTY_COLUMNS = ("id", "activity_type", "date", "max_participants", "current_participants", "creator_id")
+VENUE_COLUMNS = ("id", "name")
+ACTIVITY_COLUMNS = ("id", "type", "vendor", "datetime", "cost", "available_slots", "booked_slots")
+BOOKING_COLUMNS = ("id", "activity_id", "user_id")
+
+INSERT_USER = "INSERT INTO users (id, username, password, name, data) VALUES (?, ?, ?, ?, ?)"
+SELECT_USER = "SELECT * FROM users WHERE id = ?"
+SELECT_USER_BY_USERNAME = "SELECT * FROM users WHERE username = ?"
+SELECT_USERS = "SELECT * FROM users ORDER BY id"
+# Fixed batch size keeps the number of distinct IN (...) statements small
+USER_BATCH_SIZE = 256
+SELECT_USER_BATCH = "SELECT * FROM users WHERE id IN ({})".format(", ".join("?" * USER_BATCH_SIZE))
+UPDATE_USER = "UPDATE users SET username = ?, password = ?, name = ?, data = ? WHERE id = ?"
+DELETE_USER = "DELETE FROM users WHERE id = ?"
+
+INSERT_PARTY = (
+    "INSERT INTO parties (id, activity_type, date, max_participants, current_participants, creator_id, data) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+SELECT_PARTY = "SELECT * FROM parties WHERE id = ?"
+SELECT_PARTIES = "SELECT * FROM parties ORDER BY id"
+SELECT_PARTICIPANTS = "SELECT party_id, user_id FROM party_participants ORDER BY party_id, position"
+SELECT_PARTY_PARTICIPANTS = "SELECT user_id FROM party_participants WHERE party_id = ? ORDER BY position"
+INSERT_PARTICIPANT = (
+    "INSERT OR IGNORE INTO party_participants (party_id, user_id, position) "
+    "VALUES (?, ?, (SELECT COALESCE(MAX(position), 0) + 1 FROM party_participants WHERE party_id = ?))"
+)
+DELETE_PARTICIPANT = "DELETE FROM party_participants WHERE party_id = ? AND user_id = ?"
+RESERVE_PARTY_SLOT = (
+    "UPDATE parties SET current_participants = current_participants + 1 "
+    "WHERE id = ? AND current_participants < max_participants"
+)
+RELEASE_PARTY_SLOT = "UPDATE parties SET current_participants = current_participants - 1 WHERE id = ?"
+DELETE_PARTY = "DELETE FROM parties WHERE id = ?"
+INSERT_PARTY_WAITER = "INSERT OR IGNORE INTO party_waitlist (party_id, user_id, priority) VALUES (?, ?, ?)"
+DELETE_PARTY_WAITER = "DELETE FROM party_waitlist WHERE party_id = ? AND user_id = ?"
+SELECT_PARTICIPANT = "SELECT 1 FROM party_participants WHERE party_id = ? AND user_id = ?"
+SELECT_PARTY_WAITLIST = "SELECT party_id, user_id, priority FROM party_waitlist ORDER BY party_id, priority DESC, id"
+
+INSERT_VENUE = "INSERT INTO venues (id, name, data) VALUES (?, ?, ?)"
+SELECT_VENUES = "SELECT * FROM venues ORDER BY id"
+
+INSERT_ACTIVITY = (
+    "INSERT INTO activities (id, type, vendor, datetime, cost, available_slots, booked_slots, data) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SELECT_ACTIVITY = "SELECT * FROM activities WHERE id = ?"
+SELECT_ACTIVITIES = "SELECT * FROM activities ORDER BY id"
+RESERVE_ACTIVITY_SLOT = (
+    "UPDATE activities SET booked_slots = booked_slots + 1 "
+    "WHERE id = ? AND booked_slots < available_slots"
+)
+
+RELEASE_ACTIVITY_SLOT = "UPDATE activities SET booked_slots = booked_slots - 1 WHERE id = ?"
+
+INSERT_BOOKING = "INSERT INTO bookings (id, activity_id, user_id, data) VALUES (?, ?, ?, ?)"
+SELECT_BOOKING = "SELECT * FROM bookings WHERE id = ?"
+SELECT_BOOKINGS = "SELECT * FROM bookings ORDER BY id"
+DELETE_BOOKING = "DELETE FROM bookings WHERE id = ?"
+
+INSERT_ACTIVITY_WAITER = (
+    "INSERT OR IGNORE INTO activity_waitlist (activity_id, user_id, priority, coupon_code) VALUES (?, ?, ?, ?)"
+)
+DELETE_ACTIVITY_WAITER = "DELETE FROM activity_waitlist WHERE activity_id = ? AND user_id = ?"
+SELECT_NEXT_ACTIVITY_WAITER = (
+    "SELECT id, user_id, coupon_code FROM activity_waitlist WHERE activity_id = ? ORDER BY priority DESC, id LIMIT 1"
+)
+DELETE_ACTIVITY_WAITER_BY_ID = "DELETE FROM activity_waitlist WHERE id = ?"
+SELECT_USER_ACTIVITY_WAITLIST = "SELECT activity_id FROM activity_waitlist WHERE user_id = ? ORDER BY id"
+
+# Tables that draw their ids from id_sequences
+SEQUENCE_TABLES = ("users", "parties", "venues", "activities", "bookings")
+SELECT_SEQUENCE = "SELECT next_id FROM id_sequences WHERE name = ?"
+INSERT_SEQUENCE = "INSERT INTO id_sequences (name, next_id) VALUES (?, ?)"
+ADVANCE_SEQUENCE = "UPDATE id_sequences SET next_id = next_id + ? WHERE name = ?"
+
+
+# JSON encoding that keeps dates, times and datetimes round-trippable
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {"__time__": value.isoformat()}
+    raise TypeError(f"Cannot store {type(value).__name__}")
+
+
+def _decode(obj):
+    if "__datetime__" in obj:
+        return datetime.datetime.fromisoformat(obj["__datetime__"])
+    if "__date__" in obj:
+        return datetime.date.fromisoformat(obj["__date__"])
+    if "__time__" in obj:
+        return datetime.time.fromisoformat(obj["__time__"])
+    return obj
+
+
+def _to_row(record, columns, skip=()):
+    extra = {key: value for key, value in record.items() if key not in columns and key not in skip}
+    values = []
+    for column in columns:
+        value = record.get(column)
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            value = value.isoformat()
+        values.append(value)
+    return values + [json.dumps(extra, default=_encode)]
+
+
+def _from_row(row):
+    record = {key: row[key] for key in row.keys() if key != "data"}
+    record.update(json.loads(row["data"], object_hook=_decode))
+    return record
+
+
+def _party_from_row(row, participants):
+    party = _from_row(row)
+    party["date"] = datetime.date.fromisoformat(party["date"])
+    party["participants"] = participants
+    return party
+
+
+def _membership(user_row):
+    return _from_row(user_row).get("membership_status") if user_row else None
+
+
+# A booking priced with every kind of rule the pricing engine has, as a
+# party quote is: the coupon, the user's membership, the activity's day and
+# its group size (the number of places, as max_participants for parties)
+def _new_booking(booking_id, activity_row, user_id, membership, coupon_code, pricing):
+    cost = activity_row["cost"]
+    discount = 0
+    if pricing:
+        quote = pricing.quote(
+            cost,
+            coupon=coupon_code,
+            membership=membership,
+            date=datetime.datetime.fromisoformat(activity_row["datetime"]).date(),
+            group_size=activity_row["available_slots"]
+        )
+        discount, cost = quote["discount"], quote["final_cost"]
+    return {
+        "id": booking_id,
+        "activity_id": activity_row["id"],
+        "user_id": user_id,
+        "booking_time": datetime.datetime.now(),
+        "original_cost": activity_row["cost"],
+        "discount": discount,
+        "final_cost": cost,
+        "coupon_applied": coupon_code if coupon_code else "None"
+    }
+
+
+def _activity_from_row(row):
+    activity = _from_row(row)
+    activity["datetime"] = datetime.datetime.fromisoformat(activity["datetime"])
+    return activity
+
+
+class SQLiteStorage:
+    def __init__(self, path, pool_size=4, id_block_size=32):
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._writer = self._connect()
+        self._writer.executescript(SCHEMA)
+        self._readers = queue.Queue()
+        for _ in range(pool_size):
+            self._readers.put(self._connect())
+        self.ids = IdAllocator(self, id_block_size)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    @contextmanager
+    def _read(self):
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    # Writes go through the single writer connection, one transaction at a time
+    @contextmanager
+    def _write(self):
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+            self._writer.execute("COMMIT")
+
+    def close(self):
+        self._writer.close()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
+    def is_empty(self):
+        with self._read() as conn:
+            return conn.execute("SELECT NOT EXISTS (SELECT 1 FROM users) AND NOT EXISTS (SELECT 1 FROM parties) "
+                                "AND NOT EXISTS (SELECT 1 FROM activities)").fetchone()[0] == 1
+
+    # Load the demo data the first time a database is created
+    def seed(self, users=(), parties=(), venues=(), activities=()):
+        with self._write() as conn:
+            for user in users:
+                conn.execute(INSERT_USER, _to_row(user, USER_COLUMNS))
+            for party in parties:
+                self._insert_party(conn, party)
+            for venue in venues:
+                conn.execute(INSERT_VENUE, _to_row(venue, VENUE_COLUMNS))
+            for activity in activities:
+                conn.execute(INSERT_ACTIVITY, _to_row(activity, ACTIVITY_COLUMNS))
+
+    # Claim the next `count` ids of a sequence and return the first one.
+    # A sequence starts after the highest id already in its table.
+    def reserve_ids(self, name, count=1):
+        with self._write() as conn:
+            return self._reserve_ids(conn, name, count)
+
+    # Reserve ids inside a write transaction that is already open, so they
+    # are only taken if that transaction commits
+    def _reserve_ids(self, conn, name, count):
+        if name not in SEQUENCE_TABLES:
+            raise ValueError(f"Unknown id sequence: {name}")
+        row = conn.execute(SELECT_SEQUENCE, (name,)).fetchone()
+        if row:
+            start = row[0]
+            conn.execute(ADVANCE_SEQUENCE, (count, name))
+        else:
+            start = conn.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {name}").fetchone()[0]
+            conn.execute(INSERT_SEQUENCE, (name, start + count))
+        return start
+
+    # Users
+    def register_user(self, user_data):
+        try:
+            with self._write() as conn:
+                conn.execute(INSERT_USER, _to_row(user_data, USER_COLUMNS))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def delete_user(self, user_id):
+        with self._write() as conn:
+            return conn.execute(DELETE_USER, (user_id,)).rowcount > 0
+
+    def get_user(self, user_id):
+        with self._read() as conn:
+            row = conn.execute(SELECT_USER, (user_id,)).fetchone()
+        return _from_row(row) if row else None
+
+    def get_user_by_username(self, username):
+        with self._read() as conn:
+            row = conn.execute(SELECT_USER_BY_USERNAME, (username,)).fetchone()
+        return _from_row(row) if row else None
+
+    # Users for many ids in one pass, keyed by id; unknown ids are left out
+    def get_users(self, user_ids):
+        user_ids = list(dict.fromkeys(user_ids))
+        users = {}
+        with self._read() as conn:
+            for i in range(0, len(user_ids), USER_BATCH_SIZE):
+                batch = user_ids[i:i + USER_BATCH_SIZE]
+                # Pad the last batch so every lookup reuses the same prepared statement
+                batch += [None] * (USER_BATCH_SIZE - len(batch))
+                for row in conn.execute(SELECT_USER_BATCH, batch):
+                    users[row["id"]] = _from_row(row)
+        return {user_id: users[user_id] for user_id in user_ids if user_id in users}
+
+    def list_users(self):
+        with self._read() as conn:
+            return [_from_row(row) for row in conn.execute(SELECT_USERS)]
+
+    def update_user(self, user):
+        values = _to_row(user, USER_COLUMNS)
+        try:
+            with self._write() as conn:
+                conn.execute(UPDATE_USER, values[1:] + values[:1])
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    # Parties
+    def _insert_party(self, conn, party):
+        # Participants live in their own table
+        conn.execute(INSERT_PARTY, _to_row(party, PARTY_COLUMNS, skip=("participants",)))
+        for user_id in party.get("participants", []):
+            conn.execute(INSERT_PARTICIPANT, (party["id"], user_id, party["id"]))
+
+    def create_party(self, party_data):
+        with self._write() as conn:
+            self._insert_party(conn, party_data)
+        return party_data["id"]
+
+    def get_party(self, party_id):
+        with self._read() as conn:
+            row = conn.execute(SELECT_PARTY, (party_id,)).fetchone()
+            if not row:
+                return None
+            participants = [r[0] for r in conn.execute(SELECT_PARTY_PARTICIPANTS, (party_id,))]
+        return _party_from_row(row, participants)
+
+    def list_parties(self):
+        with self._read() as conn:
+            rows = conn.execute(SELECT_PARTIES).fetchall()
+            participants = {}
+            for party_id, user_id in conn.execute(SELECT_PARTICIPANTS):
+                participants.setdefault(party_id, []).append(user_id)
+        return [_party_from_row(row, participants.get(row["id"], [])) for row in rows]
+
+    def join_party(self, party_id, user_id):
+        with self._write() as conn:
+            row = conn.execute(SELECT_PARTY, (party_id,)).fetchone()
+            if not row:
+                return False, "Party not found."
+            if not conn.execute(SELECT_USER, (user_id,)).fetchone():
+                return False, "User not found."
+            if row["current_participants"] >= row["max_participants"]:
+                return False, "Party is already full."
+            if conn.execute(INSERT_PARTICIPANT, (party_id, user_id, party_id)).rowcount == 0:
+                return False, "You are already in this party."
+            conn.execute(RESERVE_PARTY_SLOT, (party_id,))
+            conn.execute(DELETE_PARTY_WAITER, (party_id, user_id))
+        return True, "Successfully joined the party!"
+
+    # Leave, and hand the freed slot to `promote` from the waitlist in the
+    # same transaction. `dropped` waiters are taken off the waitlist without
+    # a place (the caller found they can no longer join).
+    def leave_party(self, party_id, user_id, promote=None, dropped=()):
+        with self._write() as conn:
+            if not conn.execute(SELECT_PARTY, (party_id,)).fetchone():
+                return False, "Party not found."
+            if conn.execute(DELETE_PARTICIPANT, (party_id, user_id)).rowcount == 0:
+                return False, "You are not in this party."
+            for waiter_id in dropped:
+                conn.execute(DELETE_PARTY_WAITER, (party_id, waiter_id))
+            if promote is None:
+                conn.execute(RELEASE_PARTY_SLOT, (party_id,))
+            else:
+                conn.execute(DELETE_PARTY_WAITER, (party_id, promote))
+                conn.execute(INSERT_PARTICIPANT, (party_id, promote, party_id))
+        return True, "Successfully left the party."
+
+    # Party waitlists. Whether a user may wait is decided by the caller;
+    # storage only refuses users who are already in the party.
+    def join_waitlist(self, party_id, user_id, priority=False):
+        with self._write() as conn:
+            if not conn.execute(SELECT_PARTY, (party_id,)).fetchone():
+                return False
+            if conn.execute(SELECT_PARTICIPANT, (party_id, user_id)).fetchone():
+                return False
+            return conn.execute(INSERT_PARTY_WAITER, (party_id, user_id, int(priority))).rowcount > 0
+
+    def leave_waitlist(self, party_id, user_id):
+        with self._write() as conn:
+            return conn.execute(DELETE_PARTY_WAITER, (party_id, user_id)).rowcount > 0
+
+    # (party_id, user_id, priority) for every waiting user, each party's
+    # queue in promotion order
+    def list_waitlists(self):
+        with self._read() as conn:
+            return [(row[0], row[1], bool(row[2])) for row in conn.execute(SELECT_PARTY_WAITLIST)]
+
+    def cancel_party(self, party_id):
+        with self._write() as conn:
+            return conn.execute(DELETE_PARTY, (party_id,)).rowcount > 0
+
+    # Venues
+    def list_venues(self):
+        with self._read() as conn:
+            return [_from_row(row) for row in conn.execute(SELECT_VENUES)]
+
+    # Activities and bookings
+    def create_activity(self, activity_data):
+        with self._write() as conn:
+            conn.execute(INSERT_ACTIVITY, _to_row(activity_data, ACTIVITY_COLUMNS))
+        return activity_data["id"]
+
+    def get_activity(self, activity_id):
+        with self._read() as conn:
+            row = conn.execute(SELECT_ACTIVITY, (activity_id,)).fetchone()
+        return _activity_from_row(row) if row else None
+
+    def list_activities(self):
+        with self._read() as conn:
+            return [_activity_from_row(row) for row in conn.execute(SELECT_ACTIVITIES)]
+
+    # Prices come from a joinzy_pricing.PricingEngine; without one there is
+    # no discount
+    def book_activity(self, activity_id, user_id, coupon_code=None, pricing=None):
+        booking_id = self.ids.next_id("bookings")
+        with self._write() as conn:
+            user = conn.execute(SELECT_USER, (user_id,)).fetchone()
+            if not user:
+                return False, "User not found."
+            row = conn.execute(SELECT_ACTIVITY, (activity_id,)).fetchone()
+            if not row or conn.execute(RESERVE_ACTIVITY_SLOT, (activity_id,)).rowcount == 0:
+                return False, "Activity not found or fully booked."
+            booking = _new_booking(booking_id, row, user_id, _membership(user), coupon_code, pricing)
+            conn.execute(INSERT_BOOKING, _to_row(booking, BOOKING_COLUMNS))
+        return True, booking
+
+    def get_booking(self, booking_id):
+        with self._read() as conn:
+            row = conn.execute(SELECT_BOOKING, (booking_id,)).fetchone()
+        return _from_row(row) if row else None
+
+    # Cancel a booking and, in the same transaction, book the freed slot for
+    # the next user on the activity's waitlist at their coupon's price.
+    # With user_id only that user's own booking can be cancelled.
+    # Returns (True, promoted booking or None) or (False, reason).
+    # The promoted booking's id is reserved in the same transaction, so a
+    # cancel that fails or finds nobody waiting uses up no id.
+    def cancel_booking(self, booking_id, user_id=None, pricing=None):
+        with self._write() as conn:
+            booking = conn.execute(SELECT_BOOKING, (booking_id,)).fetchone()
+            if not booking or (user_id is not None and booking["user_id"] != user_id):
+                return False, "Booking not found."
+            activity_id = booking["activity_id"]
+            conn.execute(DELETE_BOOKING, (booking_id,))
+            waiter = conn.execute(SELECT_NEXT_ACTIVITY_WAITER, (activity_id,)).fetchone()
+            if waiter is None:
+                conn.execute(RELEASE_ACTIVITY_SLOT, (activity_id,))
+                return True, None
+            conn.execute(DELETE_ACTIVITY_WAITER_BY_ID, (waiter["id"],))
+            activity = conn.execute(SELECT_ACTIVITY, (activity_id,)).fetchone()
+            user = conn.execute(SELECT_USER, (waiter["user_id"],)).fetchone()
+            promoted_id = self._reserve_ids(conn, "bookings", 1)
+            promoted = _new_booking(promoted_id, activity, waiter["user_id"], _membership(user), waiter["coupon_code"], pricing)
+            conn.execute(INSERT_BOOKING, _to_row(promoted, BOOKING_COLUMNS))
+        return True, promoted
+
+    # Activity waitlists: only fully booked activities can be waited for
+    def join_activity_waitlist(self, activity_id, user_id, coupon_code=None, priority=False):
+        with self._write() as conn:
+            row = conn.execute(SELECT_ACTIVITY, (activity_id,)).fetchone()
+            if not row:
+                return False, "Activity not found."
+            if row["booked_slots"] < row["available_slots"]:
+                return False, "The activity still has free slots."
+            if conn.execute(INSERT_ACTIVITY_WAITER, (activity_id, user_id, int(priority), coupon_code)).rowcount == 0:
+                return False, "You are already on the waitlist."
+        return True, "You are on the waitlist and will be booked when a slot frees up."
+
+    def leave_activity_waitlist(self, activity_id, user_id):
+        with self._write() as conn:
+            return conn.execute(DELETE_ACTIVITY_WAITER, (activity_id, user_id)).rowcount > 0
+
+    def activity_waitlist_for(self, user_id):
+        with self._read() as conn:
+            return [row[0] for row in conn.execute(SELECT_USER_ACTIVITY_WAITLIST, (user_id,))]
+
+    def list_bookings(self):
+        with self._read() as conn:
+            return [_from_row(row) for row in conn.execute(SELECT_BOOKINGS)]
+
+
+# Hands out ids from blocks reserved in storage, so most calls only take a
+# short in-process lock and storage is hit once per block. Each process keeps
+# its own blocks; ids stay unique and increasing, with gaps where a block is
+# left unfinished.
+class IdAllocator:
+    def __init__(self, storage, block_size=32):
+        self.storage = storage
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._blocks = {}
+
+    def next_id(self, name):
+        with self._lock:
+            next_id, end = self._blocks.get(name, (0, 0))
+            if next_id >= end:
+                next_id = self.storage.reserve_ids(name, self.block_size)
+                end = next_id + self.block_size
+            self._blocks[name] = (next_id + 1, end)
+            return next_id
+
+    # Bulk inserts take a whole range in one call
+    def allocate(self, name, count):
+        start = self.storage.reserve_ids(name, count)
+        return range(start, start + count)
@@ -0,0 +1,258 @@
+import datetime
+import random
+import threading
+
+import pytest
+
+from joinzy_core import PartyEngine
+from joinzy_index import ScheduleIndex, party_span
+from joinzy_recommend import DAYS, TIMES, FeatureEncoder, RecommendationCache
+from joinzy_storage import SQLiteStorage
+
+ACTIVITY_TYPES = ["Football", "Tennis", "Yoga", "Bowling"]
+AREAS = ["Downtown", "Uptown", "Riverside"]
+VENUES = [
+    {"id": i + 1, "name": f"{area} Hall", "activity_types": ACTIVITY_TYPES, "cost_per_hour": 50,
+     "max_capacity": 20, "address": f"{i + 1} Main St, {area}", "available_hours": ["09:00-22:00"]}
+    for i, area in enumerate(AREAS)
+]
+DATE = datetime.date(2030, 6, 1)
+
+
+def make_user(user_id, membership="Basic"):
+    return {
+        "id": user_id, "name": f"User {user_id}", "age": 30, "phone": "", "gender": "Female",
+        "username": f"user{user_id}", "password": "secret", "activities_pref": ["Football"],
+        "preferred_days": ["Weekends"], "preferred_times": ["Evening"], "location": "Downtown",
+        "joined_date": datetime.datetime(2030, 1, 1), "membership_status": membership
+    }
+
+
+def make_party(party_id, participants, max_participants, start=18, end=20, date=DATE):
+    return {
+        "id": party_id, "name": f"Party {party_id}", "activity_type": "Football", "date": date,
+        "start_time": datetime.time(start), "end_time": datetime.time(end), "location": VENUES[0]["name"],
+        "max_participants": max_participants, "current_participants": len(participants),
+        "participants": list(participants), "creator_id": participants[0],
+        "cost_per_person": 10.0, "description": ""
+    }
+
+
+@pytest.fixture
+def open_engine(tmp_path):
+    path = str(tmp_path / "joinzy.db")
+    engines = []
+
+    def open_engine(users=(), parties=()):
+        if users or parties:
+            storage = SQLiteStorage(path)
+            storage.seed(users=users, parties=parties, venues=VENUES)
+            storage.close()
+        engine = PartyEngine.open(path)
+        engines.append(engine)
+        return engine
+
+    yield open_engine
+    for engine in engines:
+        engine.close()
+
+
+def stored_participants(engine, party_id):
+    return sorted(engine.storage.get_party(party_id)["participants"])
+
+
+def catalog_participants(engine, party_id):
+    return sorted(engine.catalog.get_party(party_id)["participants"])
+
+
+# Members of a full party leave concurrently while others join a second
+# party; every place freed goes to the next waiter, priority lane first, and
+# storage ends up with the same parties and queue as the catalog
+def test_concurrent_leave_promotes_waiters_in_order(open_engine):
+    members = list(range(1, 7))
+    waiters = list(range(7, 19))
+    joiners = list(range(19, 31))
+    premium = set(waiters[2::4])
+    users = [make_user(user_id, "Premium" if user_id in premium else "Basic")
+             for user_id in members + waiters + joiners]
+    parties = [make_party(1, members, len(members)), make_party(2, [joiners[0]], 8, start=10, end=12)]
+    engine = open_engine(users, parties)
+    for user_id in waiters:
+        assert engine.join_waitlist(1, user_id)[0]
+    expected = [user_id for user_id in waiters if user_id in premium] + \
+               [user_id for user_id in waiters if user_id not in premium]
+    assert engine.catalog._waitlist.waiting(1) == expected
+
+    results = []
+    threads = [threading.Thread(target=lambda user_id=user_id: results.append(engine.leave_party(1, user_id)[0]))
+               for user_id in members]
+    threads += [threading.Thread(target=lambda user_id=user_id: results.append(engine.join_party(2, user_id)[0]))
+                for user_id in joiners[1:]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == len(members) + 7
+    assert catalog_participants(engine, 1) == stored_participants(engine, 1) == sorted(expected[:len(members)])
+    assert engine.catalog.get_party(1)["current_participants"] == engine.storage.get_party(1)["current_participants"] == len(members)
+    assert catalog_participants(engine, 2) == stored_participants(engine, 2)
+    assert engine.storage.get_party(2)["current_participants"] == 8
+    assert engine.catalog._waitlist.waiting(1) == expected[len(members):]
+
+    engine.close()
+    reopened = open_engine()
+    assert reopened.catalog._waitlist.waiting(1) == expected[len(members):]
+    assert catalog_participants(reopened, 1) == sorted(expected[:len(members)])
+
+
+# A leave that storage refuses puts the leaver back and the promoted and
+# dropped waiters back at the front of the queue, in their old order
+def test_undo_leave_restores_queue_order(open_engine, monkeypatch):
+    users = [make_user(user_id, "Premium" if user_id == 6 else "Basic") for user_id in range(1, 9)]
+    parties = [make_party(1, [1, 2], 2), make_party(2, [3], 4, start=19, end=21)]
+    engine = open_engine(users, parties)
+    for user_id in (4, 5, 6, 7):
+        assert engine.join_waitlist(1, user_id)[0]
+    # Waiters 6 (priority) and 4 are then busy at the same time and get
+    # dropped, so the place goes to 5
+    assert engine.join_party(2, 6)[0]
+    assert engine.join_party(2, 4)[0]
+    queue = engine.catalog._waitlist.waiting(1)
+    assert queue == [6, 4, 5, 7]
+
+    monkeypatch.setattr(engine.storage, "leave_party", lambda *args: (False, "Storage refused."))
+    assert engine.leave_party(1, 1) == (False, "Storage refused.")
+    assert engine.catalog._waitlist.waiting(1) == queue
+    assert engine.waitlist_position(1, 4) == 2
+    assert catalog_participants(engine, 1) == stored_participants(engine, 1) == [1, 2]
+
+    monkeypatch.undo()
+    assert engine.leave_party(1, 1)[0]
+    assert catalog_participants(engine, 1) == stored_participants(engine, 1) == [2, 5]
+    assert engine.catalog._waitlist.waiting(1) == [7]
+    assert [user_id for party_id, user_id, _ in engine.storage.list_waitlists() if party_id == 1] == [7]
+
+
+def brute_force_overlaps(spans, start, end):
+    return {party_id for party_id, (other_start, other_end) in spans.items() if other_start < end and start < other_end}
+
+
+def test_schedule_index_matches_brute_force():
+    rng = random.Random(7)
+    index = ScheduleIndex()
+    spans = {user_id: {} for user_id in range(3)}
+    for party_id in range(1, 400):
+        user_id = rng.randrange(3)
+        start = rng.randrange(24)
+        party = make_party(party_id, [user_id], 4, start=start, end=(start + rng.randrange(1, 6)) % 24,
+                           date=DATE + datetime.timedelta(days=rng.randrange(10)))
+        span = party_span(party)
+        overlaps = brute_force_overlaps(spans[user_id], *span)
+        found = index.overlapping(user_id, party)
+        assert (found is None) == (not overlaps)
+        assert found is None or found in overlaps
+        assert index.add(user_id, party) == (not overlaps)
+        if not overlaps:
+            spans[user_id][party_id] = span
+        # Forced adds and removals keep the running maxima honest
+        elif rng.random() < 0.3:
+            assert index.add(user_id, party, check=False)
+            spans[user_id][party_id] = span
+        if spans[user_id] and rng.random() < 0.2:
+            removed = rng.choice(sorted(spans[user_id]))
+            index.remove(user_id, removed)
+            del spans[user_id][removed]
+
+    for user_id, user_spans in spans.items():
+        assert index.schedule(user_id) == [party_id for party_id, _ in sorted(user_spans.items(), key=lambda item: (item[1], item[0]))]
+
+
+def random_user(rng, user_id):
+    return {
+        "id": user_id,
+        "activities_pref": rng.sample(ACTIVITY_TYPES, rng.randrange(3)),
+        "preferred_days": rng.sample(DAYS + ["Weekdays", "Weekends"], rng.randrange(3)),
+        "preferred_times": rng.sample(TIMES, rng.randrange(3)),
+        "location": rng.choice(AREAS + [""])
+    }
+
+
+def random_party(rng, party_id, user_ids):
+    return {
+        "id": party_id,
+        "activity_type": rng.choice(ACTIVITY_TYPES),
+        "date": DATE + datetime.timedelta(days=rng.randrange(7)),
+        "start_time": datetime.time(rng.randrange(24)),
+        "location": rng.choice(VENUES)["name"],
+        "participants": rng.sample(user_ids, rng.randrange(3))
+    }
+
+
+# Each user's cached list must hold the same scores as rescoring every open
+# party they have not joined; among parties tied with the last score, any
+# may fill the remaining places
+def assert_matches_rescore(cache, encoder, users, parties, joined, n):
+    party_ids = sorted(parties)
+    scores = encoder.encode_users([users[user_id] for user_id in sorted(users)]) @ \
+        encoder.encode_parties([parties[party_id] for party_id in party_ids]).T
+    for row, user_id in enumerate(sorted(users)):
+        ranked = sorted(((-float(score), party_id) for party_id, score in zip(party_ids, scores[row])
+                         if score > 0 and party_id not in joined.get(user_id, ())))
+        expected = [(party_id, -score) for score, party_id in ranked[:n]]
+        cached = cache.recommendations(user_id)
+        assert [score for _, score in cached] == pytest.approx([score for _, score in expected])
+        if expected:
+            last = expected[-1][1]
+            assert {party_id for party_id, score in cached if score > last} == \
+                   {party_id for party_id, score in expected if score > last}
+            tied = {party_id for score, party_id in ranked if -score == last}
+            assert {party_id for party_id, score in cached if score == last} <= tied
+
+
+def test_recommendation_cache_matches_rescore():
+    rng = random.Random(11)
+    n = 5
+    party_areas = {venue["name"]: venue["address"].rsplit(",", 1)[-1].strip() for venue in VENUES}
+    encoder = FeatureEncoder(ACTIVITY_TYPES, party_areas)
+    users = {user_id: random_user(rng, user_id) for user_id in range(1, 41)}
+    parties = {party_id: random_party(rng, party_id, list(users)) for party_id in range(1, 61)}
+    joined = {}
+    for party in parties.values():
+        for user_id in party["participants"]:
+            joined.setdefault(user_id, set()).add(party["id"])
+    cache = RecommendationCache(list(users.values()), list(parties.values()), ACTIVITY_TYPES, party_areas, n=n)
+    assert_matches_rescore(cache, encoder, users, parties, joined, n)
+
+    next_party = 61
+    for _ in range(300):
+        action = rng.randrange(5)
+        user_id = rng.choice(list(users))
+        if action == 0:
+            party = random_party(rng, next_party, list(users))
+            next_party += 1
+            parties[party["id"]] = party
+            for member in party["participants"]:
+                joined.setdefault(member, set()).add(party["id"])
+            cache.add_party(party)
+        elif action == 1 and parties:
+            party_id = rng.choice(list(parties))
+            del parties[party_id]
+            cache.remove_party(party_id)
+        elif action == 2 and parties:
+            party_id = rng.choice(list(parties))
+            joined.setdefault(user_id, set()).add(party_id)
+            cache.user_joined(user_id, party_id)
+        elif action == 3 and joined.get(user_id):
+            party_id = rng.choice(sorted(joined[user_id]))
+            joined[user_id].discard(party_id)
+            cache.user_left(user_id, party_id)
+        else:
+            users[user_id] = random_user(rng, user_id)
+            cache.update_user(users[user_id])
+        assert_matches_rescore(cache, encoder, users, parties, joined, n)
+
+    new_user = random_user(rng, 41)
+    users[41] = new_user
+    cache.add_user(new_user)
+    assert_matches_rescore(cache, encoder, users, parties, joined, n)